@@ -0,0 +1,61 @@
+"""Figlet banners shown at the start of each day.
+
+Rendering a figlet banner parses its font every time, which costs more than a whole turn of the game.
+Banners are rendered once for all days in a batch, and kept in memory and in a json file under the cache
+directory, so that later processes don't even import pyfiglet.
+"""
+
+from __future__ import annotations
+
+import json
+from pathlib import Path
+
+from llm_chat_game.util import get_cache_dir
+
+FONT = "standard"
+PRERENDERED_DAYS = 60
+_banners: dict[str, str] | None = None
+
+
+def _cache_path() -> Path:
+    return get_cache_dir() / f"banners_{FONT}.json"
+
+
+def _read_banners() -> dict[str, str]:
+    try:
+        with _cache_path().open("r", encoding="utf-8") as f:
+            banners = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return banners if isinstance(banners, dict) else {}
+
+
+def _write_banners(banners: dict[str, str]) -> None:
+    tmp_path = _cache_path().with_suffix(".tmp")
+    try:
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(banners, f, ensure_ascii=False)
+        tmp_path.replace(_cache_path())
+    except OSError:  # banners are only a cache
+        pass
+
+
+def render(texts: list[str]) -> dict[str, str]:
+    """Render `texts` with pyfiglet, loading the font once for all of them."""
+    import pyfiglet
+
+    figlet = pyfiglet.Figlet(font=FONT)
+    return {text: figlet.renderText(text) for text in texts}
+
+
+def day_banner(day: int) -> str:
+    """Banner of `day`. Days up to PRERENDERED_DAYS are rendered together on the first miss."""
+    global _banners
+    text = f"Day {day}..."
+    if _banners is None:
+        _banners = _read_banners()
+    if text not in _banners:
+        texts = [text] + [f"Day {n}..." for n in range(1, PRERENDERED_DAYS + 1)]
+        _banners.update(render(texts))
+        _write_banners(_banners)
+    return _banners[text]
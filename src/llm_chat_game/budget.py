@@ -0,0 +1,135 @@
+"""Token and cost accounting of sessions, and degradation of a session as it spends its budget."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Any
+
+from llm_chat_game.context_var import SESSION_USAGE
+from llm_chat_game.llm_backend import LlmUsage
+from llm_chat_game.metrics import METRICS
+
+# dollars per million tokens: (input, cached input, output)
+PRICES: dict[str, tuple[float, float, float]] = {
+    "gpt-4o": (2.5, 1.25, 10.0),
+    "gpt-4o-mini": (0.15, 0.075, 0.6),
+    "gpt-4.1-nano": (0.1, 0.025, 0.4),
+}
+
+
+def request_cost(model: str, usage: LlmUsage) -> float:
+    """Dollars a request cost. Models which aren't in `PRICES` cost nothing."""
+    if (prices := PRICES.get(model)) is None:
+        return 0.0
+    input_price, cached_price, output_price = prices
+    uncached = usage.prompt_tokens - usage.cached_tokens
+    return (uncached * input_price + usage.cached_tokens * cached_price + usage.completion_tokens * output_price) / 1e6
+
+
+def session_degraded(step: str) -> bool:
+    """Whether the session being played has reached degradation `step` of its budget."""
+    return (session_usage := SESSION_USAGE.get()) is not None and session_usage.degraded(step)
+
+
+@dataclass(frozen=True)
+class Budget:
+    """Tokens and dollars a session may spend, and the share of them at which each degradation step starts.
+
+    Steps are
+        cheap_model: every request goes to the economy tier of the router.
+        short_context: conversations of random events are kept shorter.
+        no_twist: results aren't twisted and results aren't speculated.
+        end_phase: random events are asked to end at the next result.
+
+    Args:
+        tokens (int | None): Prompt and completion tokens of a session. None means no limit.
+        cost (float | None): Dollars of a session. None means no limit.
+        steps (tuple[tuple[str, float], ...]): Degradation steps and the share of the budget where they start.
+    """
+    tokens: int | None = None
+    cost: float | None = None
+    steps: tuple[tuple[str, float], ...] = (
+        ("cheap_model", 0.5),
+        ("short_context", 0.7),
+        ("no_twist", 0.85),
+        ("end_phase", 1.0),
+    )
+
+
+class SessionUsage:
+    """Tokens and dollars spent by a session. Every request of the session is added, including background ones.
+
+    Args:
+        budget (Budget | None): Budget of the session. None means the session is only accounted.
+    """
+
+    SHORT_CONTEXT_TOKENS = 2000
+
+    def __init__(self, budget: Budget | None = None) -> None:
+        self.budget = budget
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_tokens = 0
+        self.cost = 0.0
+        self._steps: set[str] = set()
+
+    def add(self, usage: LlmUsage, cost: float) -> None:
+        self.prompt_tokens += usage.prompt_tokens
+        self.completion_tokens += usage.completion_tokens
+        self.cached_tokens += usage.cached_tokens
+        self.cost += cost
+        self._update_steps()
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def spent(self) -> float:
+        """Share of the budget spent. 0 if there is no budget."""
+        if self.budget is None:
+            return 0.0
+        shares = [0.0]
+        if self.budget.tokens:
+            shares.append(self.tokens / self.budget.tokens)
+        if self.budget.cost:
+            shares.append(self.cost / self.budget.cost)
+        return max(shares)
+
+    def _update_steps(self) -> None:
+        if self.budget is None:
+            return
+        spent = self.spent
+        for step, share in self.budget.steps:
+            if spent >= share and step not in self._steps:
+                self._steps.add(step)
+                METRICS.incr(f"budget.degraded.{step}")
+
+    def degraded(self, step: str) -> bool:
+        return step in self._steps
+
+    def context_budget(self, token_budget: int | None) -> int | None:
+        """Token budget of a conversation, which is halved once `short_context` starts."""
+        if not self.degraded("short_context"):
+            return token_budget
+        return token_budget // 2 if token_budget is not None else self.SHORT_CONTEXT_TOKENS
+
+    def state(self) -> dict[str, Any]:
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cached_tokens": self.cached_tokens,
+            "cost": self.cost,
+        }
+
+    def restore(self, state: dict[str, Any]) -> None:
+        self.prompt_tokens = state["prompt_tokens"]
+        self.completion_tokens = state["completion_tokens"]
+        self.cached_tokens = state["cached_tokens"]
+        self.cost = state["cost"]
+        self._update_steps()
+
+    def report(self) -> None:
+        """Record the spend of a finished session in metrics."""
+        METRICS.observe("session.tokens", self.tokens)
+        METRICS.observe("session.cost_usd", self.cost)
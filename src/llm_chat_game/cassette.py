@@ -0,0 +1,161 @@
+"""Recording of LLM exchanges to a cassette file, and replay of a game from it without network.
+
+A cassette is a JSONL file. Each line is one response keyed by a hash of the response format and messages of
+its request, so the model a request was routed to doesn't matter. When the same request was answered more than once,
+e.g. when a malformed response was asked again, the responses are replayed in the order they were recorded.
+With `--game-seed`, story order and random rolls of a session are the same too, so a recorded game replays
+in milliseconds.
+
+Requests which weren't answered while recording, e.g. a prefetch cancelled when the player died, are counted as
+`cassette.miss` on replay. They fall back like unavailable requests, so a miss only matters if the game diverges.
+"""
+
+from __future__ import annotations
+
+import atexit
+import hashlib
+import json
+from collections import defaultdict
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+from llm_chat_game.llm_backend import LlmBackend, LlmResult, LlmUsage, ResponseT
+from llm_chat_game.metrics import METRICS
+from pydantic import ValidationError
+
+
+class CassetteMiss(RuntimeError):
+    """Raised when a replayed request wasn't recorded."""
+
+
+def request_key(messages: list[dict[str, str]], response_format: type[ResponseT]) -> str:
+    request = json.dumps([response_format.__name__, messages], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()[:20]
+
+
+class Cassette:
+    """Responses of a cassette file.
+
+    Args:
+        path (Path | str): Cassette file. Recorded responses are appended to it.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self._responses: dict[str, list[dict[str, Any]]] = defaultdict(list)
+        self._played: dict[str, int] = defaultdict(int)
+        self._file = None
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self._responses[record.pop("key")].append(record)
+
+    def __len__(self) -> int:
+        return sum(len(responses) for responses in self._responses.values())
+
+    def record(self, key: str, result: LlmResult) -> None:
+        record: dict[str, Any] = {"key": key}
+        if result.parsed is not None:
+            # values out of range are kept as they were, so that they are repaired again on replay
+            record["parsed"] = result.parsed.model_dump(mode="json", warnings=False)
+        if result.raw is not None and result.parsed is None:
+            record["raw"] = result.raw
+        if result.refusal is not None:
+            record["refusal"] = result.refusal
+        if result.usage is not None:
+            usage = result.usage
+            record["usage"] = [usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens]
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open("a", encoding="utf-8")
+            atexit.register(self.close)
+        self._file.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._file.flush()
+        METRICS.incr("cassette.recorded")
+
+    def play(self, key: str, response_format: type[ResponseT]) -> LlmResult:
+        """Next recorded response of the request. The last one is played again once they are used up."""
+        responses = self._responses.get(key)
+        if not responses:
+            METRICS.incr("cassette.miss")
+            msg = f"{response_format.__name__} request {key} isn't in {self.path}."
+            raise CassetteMiss(msg)
+        record = responses[min(self._played[key], len(responses) - 1)]
+        self._played[key] += 1
+        METRICS.incr("cassette.played")
+
+        parsed = None
+        if (values := record.get("parsed")) is not None:
+            try:
+                parsed = response_format.model_validate(values)
+            except ValidationError:
+                parsed = response_format.model_construct(**values)
+        usage = LlmUsage(*record["usage"]) if "usage" in record else None
+        return LlmResult(parsed, usage, raw=record.get("raw"), refusal=record.get("refusal"))
+
+    def close(self) -> None:
+        if self._file is not None and not self._file.closed:
+            self._file.close()
+
+
+class RecordingBackend(LlmBackend):
+    """Backend which sends requests to `backend` and records every response to `cassette`.
+
+    Args:
+        backend (LlmBackend): Backend which answers requests.
+        cassette (Cassette): Where responses are recorded.
+    """
+
+    def __init__(self, backend: LlmBackend, cassette: Cassette) -> None:
+        self._backend = backend
+        self._cassette = cassette
+
+    async def parse(
+        self, model: str, messages: list[dict[str, str]], response_format: type[ResponseT], **kwarg,
+    ) -> LlmResult:
+        result = await self._backend.parse(model, messages, response_format, **kwarg)
+        self._cassette.record(request_key(messages, response_format), result)
+        return result
+
+    async def stream(
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        on_snapshot: Callable[[str], None],
+        **kwarg,
+    ) -> LlmResult:
+        result = await self._backend.stream(model, messages, response_format, on_snapshot, **kwarg)
+        self._cassette.record(request_key(messages, response_format), result)
+        return result
+
+
+class ReplayBackend(LlmBackend):
+    """Backend which answers requests from `cassette` only.
+
+    Args:
+        cassette (Cassette): Recorded responses.
+    """
+
+    def __init__(self, cassette: Cassette) -> None:
+        self._cassette = cassette
+
+    async def parse(
+        self, model: str, messages: list[dict[str, str]], response_format: type[ResponseT], **kwarg,
+    ) -> LlmResult:
+        return self._cassette.play(request_key(messages, response_format), response_format)
+
+    async def stream(
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        on_snapshot: Callable[[str], None],
+        **kwarg,
+    ) -> LlmResult:
+        result = self._cassette.play(request_key(messages, response_format), response_format)
+        on_snapshot(result.raw if result.parsed is None else result.parsed.model_dump_json(warnings=False))
+        return result
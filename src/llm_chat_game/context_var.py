@@ -1,6 +1,58 @@
 """Context variables."""
 
+from __future__ import annotations
+
 from contextvars import ContextVar
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import random
+
+    from llm_chat_game.budget import Budget, SessionUsage
+    from llm_chat_game.llm_backend import LlmBackend
+    from llm_chat_game.request_scheduler import RequestScheduler
+    from llm_chat_game.resilience import Resilience
+    from llm_chat_game.response_cache import StoryResponseCache
+    from llm_chat_game.routing import ModelRouter
+    from llm_chat_game.situation_pool import SituationPool
+    from llm_chat_game.speculation import SpeculationBudget
+    from llm_chat_game.tracing import Tracer
 
 
 DEBUG_MODE: ContextVar[bool] = ContextVar("debug_mode", default=False)
+# "classic" asks result and phase end separately. "combined" gets both and next situation in one response.
+TURN_PROTOCOL: ContextVar[str] = ContextVar("turn_protocol", default="classic")
+# Estimated tokens of a random event conversation before old exchanges are summarized. None means no limit.
+CONTEXT_TOKEN_BUDGET: ContextVar[int | None] = ContextVar("context_token_budget", default=4000)
+STREAM_NARRATION: ContextVar[bool] = ContextVar("stream_narration", default=False)
+# Similarity needed to select an option from free text without LLM. None disables the fast path.
+FAST_PATH_THRESHOLD: ContextVar[float | None] = ContextVar("fast_path_threshold", default=0.6)
+RESPONSE_CACHE: ContextVar[StoryResponseCache | None] = ContextVar("response_cache", default=None)
+# Where LLM requests go. None means OpenAI.
+LLM_BACKEND: ContextVar[LlmBackend | None] = ContextVar("llm_backend", default=None)
+# Deadlines, hedging and circuit breaker of LLM requests. None means the default settings.
+LLM_RESILIENCE: ContextVar[Resilience | None] = ContextVar("llm_resilience", default=None)
+# Model tier of each call type. None means the default routes.
+MODEL_ROUTER: ContextVar[ModelRouter | None] = ContextVar("model_router", default=None)
+# Pre-generated openings of random events. None means every opening is requested when it's played.
+SITUATION_POOL: ContextVar[SituationPool | None] = ContextVar("situation_pool", default=None)
+# Speculative result requests allowed per session. None disables speculation.
+SPECULATIVE_RESULTS: ContextVar[int | None] = ContextVar("speculative_results", default=None)
+# Speculation budget of the session being played. It's set by each session.
+SPECULATION_BUDGET: ContextVar[SpeculationBudget | None] = ContextVar("speculation_budget", default=None)
+# Where spans of games are written. None disables tracing.
+TRACER: ContextVar[Tracer | None] = ContextVar("tracer", default=None)
+# Token and cost budget of each session. None means sessions are only accounted.
+SESSION_BUDGET: ContextVar[Budget | None] = ContextVar("session_budget", default=None)
+# Tokens and cost of the session being played. It's set by each session.
+SESSION_USAGE: ContextVar[SessionUsage | None] = ContextVar("session_usage", default=None)
+# Rate limits shared by LLM requests of every session in the process. None means requests are sent at once.
+REQUEST_SCHEDULER: ContextVar[RequestScheduler | None] = ContextVar("request_scheduler", default=None)
+# "interactive" if a player waits for the request, "background" otherwise. It's set by background tasks.
+REQUEST_PRIORITY: ContextVar[str] = ContextVar("request_priority", default="interactive")
+# Identifier of the session being played, which requests are queued fairly by. It's set by each session.
+SESSION_ID: ContextVar[str | None] = ContextVar("session_id", default=None)
+# Seed of story order and random rolls of each session, so that a recorded session can be replayed. None is unseeded.
+GAME_SEED: ContextVar[int | None] = ContextVar("game_seed", default=None)
+# Random generator of the session being played. It's set by each session. None means the `random` module.
+SESSION_RNG: ContextVar[random.Random | None] = ContextVar("session_rng", default=None)
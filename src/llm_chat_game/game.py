@@ -0,0 +1,273 @@
+"""Game session which plays stories day by day."""
+
+from __future__ import annotations
+
+import inspect
+import random
+import uuid
+from pathlib import Path
+from typing import Any, TYPE_CHECKING
+
+import llm_chat_game
+from llm_chat_game.banner import day_banner
+from llm_chat_game.budget import SessionUsage
+from llm_chat_game.context_var import (
+    GAME_SEED,
+    SESSION_BUDGET,
+    SESSION_ID,
+    SESSION_RNG,
+    SESSION_USAGE,
+    SPECULATION_BUDGET,
+    SPECULATIVE_RESULTS,
+    TRACER,
+)
+from llm_chat_game.game_io import ConsoleIO, GameIO
+from llm_chat_game.scheduler import DayScheduler
+from llm_chat_game.session_store import SessionStore
+from llm_chat_game.speculation import SpeculationBudget
+from llm_chat_game.status_entity import StatusManager
+from llm_chat_game.story import StoryIndex, StoryWithOptionNarrator, StoryWithoutOptionNarrator
+from llm_chat_game.story_db.random_events import situation_end_conditions, situations
+from llm_chat_game.tracing import span
+from rich.panel import Panel
+
+if TYPE_CHECKING:
+    from llm_chat_game.story import StoryNarrator
+
+
+def get_story_db_dir() -> Path:
+    return Path(inspect.getfile(llm_chat_game)).parent / "story_db"
+
+
+def load_story_narrators() -> list[StoryNarrator]:
+    story_db_dir = get_story_db_dir()
+    version = StoryIndex.for_dir(story_db_dir).current  # a session plays one version even if stories are reloaded
+    return [
+        StoryWithOptionNarrator(story_db_dir / file_name, start_id, version)
+        for file_name, start_id in version.start_events()
+    ]
+
+
+def load_sub_story_narrators() -> list[StoryNarrator] | None:
+    try:
+        return [
+            StoryWithoutOptionNarrator(
+                random_event,
+                end_condition,
+                situation_id,
+            ) for situation_id, (random_event, end_condition) in enumerate(zip(situations, situation_end_conditions))
+        ]
+    except Exception as e:
+        print(e)
+
+
+def narrator_from_reference(reference: dict[str, Any]) -> StoryNarrator:
+    """Make a narrator again from `StoryNarrator.reference`."""
+    if reference["kind"] == "event":
+        return StoryWithOptionNarrator(get_story_db_dir() / reference["story_file"], reference["start_id"])
+    if reference["kind"] == "random_event":
+        situation_id = reference["situation_id"]
+        return StoryWithoutOptionNarrator(situations[situation_id], situation_end_conditions[situation_id], situation_id)
+    msg = f"{reference['kind']} is unknown kind of narrator."
+    raise ValueError(msg)
+
+
+INTRODUCTION = "2050년 서울에 화성이 떨어졌다.\n별같은 것이 아니다. 그것은 북한에서 발사한 핵이다.\n2020년대 이래로 너나할것없이 모든 나라들은 자국우선주의 전략을 펼치기 시작했다.\n이러한 기조가 진행될 수록 세계 곳곳에서 전쟁이 터지기 시작했고 종국에는 한반도에도 전운이 감돌기 시작하더니 북한에서 선제타격을 한 것이다.\n현재 서울은 황폐화 되었고 현재는 무정부상태와 다름없다.\n각 나라가 그러했듯 모든 사람들은 자신의 생존을 최우선하며 다른 사람들을 약탈하고 있다.\n다행인 점은 현재 국군이 북한군을 밀어내며 서울을 곧 탈환할 수 있다는 소식을 들은 것이다. 당신은 그 날을 기다리며 하루하루 생존을 위해 분투해야 한다.\n"
+
+
+class _CheckpointIO(GameIO):
+    """IO which lets the session save a snapshot whenever the game waits for player's input."""
+
+    def __init__(self, io: GameIO, session: GameSession) -> None:
+        self._io = io
+        self._session = session
+        self.console = io.console
+
+    async def input(self, prompt: str) -> str:
+        await self._session.save()
+        return await self._io.input(prompt)
+
+
+class _TracedIO(GameIO):
+    """IO which records the time spent waiting for player's input as a span."""
+
+    def __init__(self, io: GameIO) -> None:
+        self._io = io
+        self.console = io.console
+
+    async def input(self, prompt: str) -> str:
+        with span("input_wait"):
+            return await self._io.input(prompt)
+
+
+class GameSession:
+    """A game of one player. Each session has its own status, story scheduler and narrators.
+
+    If `store` is given, a snapshot of the session is saved to it every time player's input is waited,
+    and the session can be resumed from it by `GameSession.restore` without replaying LLM calls.
+
+    Args:
+        io (GameIO): Where the game is played.
+        session_id (str | None): Identifier of the session. Random one is made if it's not given.
+        store (SessionStore | None): Where snapshots are saved.
+        scheduler (DayScheduler | None): Stories to play. Every story is scheduled if it's not given.
+    """
+
+    SNAPSHOT_VERSION: int = 2
+
+    def __init__(
+        self,
+        io: GameIO,
+        session_id: str | None = None,
+        store: SessionStore | None = None,
+        scheduler: DayScheduler | None = None,
+    ) -> None:
+        self.io = io
+        self.session_id = session_id or uuid.uuid4().hex
+        self.store = store
+        self.user_status = StatusManager()
+        self.day = 1
+        self.current_narrator: StoryNarrator | None = None
+        limit = SPECULATIVE_RESULTS.get()
+        self.speculation = SpeculationBudget(limit) if limit is not None else None
+        self.usage = SessionUsage(SESSION_BUDGET.get())
+        seed = GAME_SEED.get()
+        self.rng = random.Random(seed) if seed is not None else None
+        if scheduler is None:
+            scheduler = DayScheduler(self.rng)
+            for narrator in load_story_narrators() + (load_sub_story_narrators() or []):
+                scheduler.add(narrator)
+        self.scheduler = scheduler
+
+    def snapshot(self) -> dict[str, Any]:
+        current = None
+        if self.current_narrator is not None:
+            current = {"narrator": self.current_narrator.reference, "progress": self.current_narrator.progress}
+        return {
+            "version": self.SNAPSHOT_VERSION,
+            "session_id": self.session_id,
+            "day": self.day,
+            "status": self.user_status.to_dict(),
+            "current": current,
+            "scheduler": self.scheduler.state(),
+            "speculation_used": self.speculation.used if self.speculation is not None else 0,
+            "usage": self.usage.state(),
+            # a seeded session resumes with the same random rolls as if it wasn't interrupted
+            "rng": list(self.rng.getstate()) if self.rng is not None else None,
+        }
+
+    @classmethod
+    def restore(cls, io: GameIO, snapshot: dict[str, Any], store: SessionStore | None = None) -> GameSession:
+        seed = GAME_SEED.get()
+        rng = random.Random(seed) if seed is not None else None
+        if rng is not None and (rng_state := snapshot.get("rng")) is not None:
+            version, internal_state, gauss_next = rng_state
+            rng.setstate((version, tuple(internal_state), gauss_next))
+        version = snapshot.get("version")
+        if version == 1:  # story queue was a list
+            references = snapshot["queue"]
+            scheduler = DayScheduler.from_order([narrator_from_reference(reference) for reference in references], rng)
+        elif version == cls.SNAPSHOT_VERSION:
+            scheduler = DayScheduler.restore(snapshot["scheduler"], narrator_from_reference, rng)
+        else:
+            msg = f"Snapshot version {version} isn't supported."
+            raise ValueError(msg)
+        session = cls(io, snapshot["session_id"], store, scheduler)
+        session.rng = rng
+        session.day = snapshot["day"]
+        session.user_status = StatusManager.from_dict(snapshot["status"])
+        if session.speculation is not None:
+            session.speculation.used = snapshot.get("speculation_used", 0)
+        if (usage := snapshot.get("usage")) is not None:
+            session.usage.restore(usage)
+        if (current := snapshot["current"]) is not None:
+            session.current_narrator = narrator_from_reference(current["narrator"])
+            session.current_narrator.restore_progress(current["progress"])
+        return session
+
+    @property
+    def is_resumed(self) -> bool:
+        return self.current_narrator is not None or self.day > 1
+
+    async def save(self) -> None:
+        """Save a snapshot without blocking other sessions. It's taken at once, and written in a thread."""
+        if self.store is not None:
+            await self.store.save_async(self.session_id, self.snapshot())
+
+    async def play(self) -> bool:
+        """Play the game until the player dies or every story is played. Return whether the player survived."""
+        with span("session", session_id=self.session_id, resumed=self.is_resumed):
+            return await self._play()
+
+    async def _play(self) -> bool:
+        io = _TracedIO(self.io) if TRACER.get() is not None else self.io
+        if self.store is not None:
+            io = _CheckpointIO(io, self)
+        console = io.console
+        # every session is played in its own task, so the budget is seen only by narrators of this session
+        SPECULATION_BUDGET.set(self.speculation)
+        SESSION_RNG.set(self.rng)
+        SESSION_ID.set(self.session_id)
+        SESSION_USAGE.set(self.usage)
+        if not self.is_resumed:
+            console.print(Panel(INTRODUCTION))
+
+        scheduler = self.scheduler
+        while self.current_narrator is not None or scheduler:
+            with span("render", what="banner"):
+                console.print(day_banner(self.day), highlight=False)
+            if self.current_narrator is None:
+                self.current_narrator = scheduler.pop(self.day)
+            if self.current_narrator is None:  # every story left waits for a later day
+                console.print("오늘은 아무 일 없이 조용히 지나갔습니다.", style="italic")
+                self.day += 1
+                continue
+            # start preparing tomorrow's story while the player is busy with today's one
+            prefetched_narrator = scheduler.peek(self.day + 1)
+            if prefetched_narrator is not None:
+                prefetched_narrator.prefetch()
+            try:
+                with span("story", day=self.day, narrator=type(self.current_narrator).__name__):
+                    next_story = await self.current_narrator.play_story(self.user_status, io)
+            except BaseException:
+                if prefetched_narrator is not None:
+                    prefetched_narrator.cancel_prefetch()
+                raise
+            self.current_narrator = None
+
+            if self.user_status.is_die():
+                if prefetched_narrator is not None:
+                    prefetched_narrator.cancel_prefetch()
+                console.print(f"당신은 {self.day}일차에 죽었습니다.\nGame over.")
+                await self._finish()
+                return False
+
+            if next_story is not None:
+                scheduler.add(next_story, self.day + 1)
+                if prefetched_narrator is not None and scheduler.peek(self.day + 1) is not prefetched_narrator:
+                    prefetched_narrator.cancel_prefetch()
+            self.day += 1
+
+        console.print("국군이 서울을 탈환했습니다.\n많은 역경이 있었지만 당신은 당신의 능력을 증명하고 생존했습니다.\nGame end.")
+        await self._finish()
+        return True
+
+    async def _finish(self) -> None:
+        self.usage.report()
+        if self.store is not None:
+            await self.store.delete_async(self.session_id)
+
+
+async def play_game(io: GameIO | None = None, store: SessionStore | None = None, resume: str | None = None) -> bool:
+    """Play a game. If `resume` is given, the session is restored from `store`."""
+    io = io or ConsoleIO()
+    if resume is None:
+        session = GameSession(io, store=store)
+    elif store is None or (snapshot := await store.load_async(resume)) is None:
+        msg = f"There is no saved session {resume}."
+        raise RuntimeError(msg)
+    else:
+        session = GameSession.restore(io, snapshot, store)
+    if store is not None:
+        io.console.print(f"session id : {session.session_id}", style="italic")
+    return await session.play()
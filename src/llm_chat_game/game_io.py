@@ -0,0 +1,67 @@
+"""Input and output of a game."""
+
+from __future__ import annotations
+
+import asyncio
+import io
+from abc import ABC, abstractmethod
+from collections.abc import Awaitable, Callable
+
+from rich.console import Console
+
+
+class GameIO(ABC):
+    """Where a game prints to and reads player's input from.
+
+    Everything is rendered through `console`, and player's input is read by `input`.
+    """
+
+    console: Console
+
+    @abstractmethod
+    async def input(self, prompt: str) -> str:
+        pass
+
+
+class ConsoleIO(GameIO):
+    """Terminal of the current process."""
+
+    def __init__(self, console: Console | None = None) -> None:
+        self.console = console or Console()
+
+    async def input(self, prompt: str) -> str:
+        # blocking input() runs in a thread, so that background requests keep going while player reads
+        return await asyncio.to_thread(self.console.input, prompt)
+
+
+class RemoteIO(GameIO):
+    """Player connected through network.
+
+    Output is rendered as plain text into a buffer and handed to `send` whenever the game waits for input
+    or `flush` is called. Input is pushed by the transport with `feed`.
+
+    Args:
+        send (Callable[[str, str | None], Awaitable[None]]): Coroutine which delivers rendered text and input prompt.
+            Prompt is None when the game isn't waiting for input.
+        width (int): Width of rendered text.
+    """
+
+    def __init__(self, send: Callable[[str, str | None], Awaitable[None]], width: int = 80) -> None:
+        self._send = send
+        self._buffer = io.StringIO()
+        self.console = Console(file=self._buffer, width=width, force_terminal=False, color_system=None)
+        self._inputs: asyncio.Queue[str] = asyncio.Queue()
+
+    def feed(self, text: str) -> None:
+        self._inputs.put_nowait(text)
+
+    async def flush(self, prompt: str | None = None) -> None:
+        text = self._buffer.getvalue()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        if text or prompt is not None:
+            await self._send(text, prompt)
+
+    async def input(self, prompt: str) -> str:
+        await self.flush(prompt)
+        return await self._inputs.get()
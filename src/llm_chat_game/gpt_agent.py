@@ -2,25 +2,71 @@
 
 from __future__ import annotations
 
+import asyncio
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
 from pprint import pprint
-from typing import Any, TYPE_CHECKING
+from typing import Any, TYPE_CHECKING, TypeVar
 
-import openai
-from llm_chat_game.context_var import DEBUG_MODE
+from llm_chat_game.budget import request_cost, session_degraded
+from llm_chat_game.context_var import (
+    DEBUG_MODE,
+    LLM_BACKEND,
+    LLM_RESILIENCE,
+    MODEL_ROUTER,
+    RESPONSE_CACHE,
+    SESSION_USAGE,
+)
+from llm_chat_game.llm_backend import LlmBackend, LlmResult, LlmUsage, OpenAIBackend
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.request_scheduler import current_grant, scheduled
+from llm_chat_game.resilience import LlmUnavailable, Resilience
+from llm_chat_game.response_repair import (
+    MalformedResponse,
+    follow_up_messages,
+    missing_fields_format,
+    repair_response,
+)
+from llm_chat_game.routing import ModelRouter, RouteChoice
+from llm_chat_game.tracing import current_span, span
 from pydantic import BaseModel
+from rich.panel import Panel
 
 if TYPE_CHECKING:
+    from collections.abc import Mapping
+
     from llm_chat_game.story import Story, StoryOption
+    from llm_chat_game.story.story_store import StoryNode
+    from rich.console import Console
+
+ResponseT = TypeVar("ResponseT", bound=BaseModel)
+
+_DEFAULT_BACKEND = OpenAIBackend()
+_DEFAULT_RESILIENCE = Resilience()
+_DEFAULT_ROUTER = ModelRouter()
+
 
-from os import environ
+@dataclass
+class LiveNarration:
+    """Streaming target. Text field `field` of a response is rendered in a panel on `console` while it grows."""
+    console: Console
+    field: str
+    style: str = ""
 
-try:
-    with open("../../openai_key.txt", "r") as f:
-        API_KEY = f.readline()
-except:
-    API_KEY = environ.get("OPENAI_API_KEY")
+    def panel(self, text: str) -> Panel:
+        return Panel(text, style=self.style)
 
-_OPEN_AI_CLIENT = openai.OpenAI(api_key=API_KEY)
+
+def _partial_field(snapshot: str, field: str) -> str | None:
+    """Extract a string field from incomplete JSON text."""
+    import jiter  # only needed while streaming
+
+    try:
+        parsed = jiter.from_json(snapshot.encode("utf-8"), partial_mode="trailing-strings")
+    except ValueError:
+        return None
+    return parsed.get(field) if isinstance(parsed, dict) else None
 
 
 class TrpgHostResponse(BaseModel):
@@ -51,50 +97,286 @@ HostSetting = """당신은 TRPG 사회자입니다. 현재 당신은 핵폭탄
 
 
 class GptAgent:
-    API_KEY = API_KEY
-    MODEL = "gpt-4o-mini"
-    # MODEL = "gpt-4o"
+    """Agent which talks to GPT. Every call is a coroutine so that several requests can be in flight at once.
 
-    def __init__(self, story_db: dict[int, Story] | None = None):
-        self._client = _OPEN_AI_CLIENT
+    Requests go to the backend in `LLM_BACKEND` context variable, or to OpenAI if it isn't set.
+    Model, temperature and max tokens of each request are selected by `MODEL_ROUTER` from its call type.
+    They run under deadlines, hedging and circuit breaker of `LLM_RESILIENCE`. If a request can't be answered,
+    `fallback` of the call makes the response instead. Without it, LlmUnavailable is raised.
+    """
+
+    def __init__(self, story_db: Mapping[int, Story | StoryNode] | None = None, story_name: str | None = None):
         self._story_db = story_db
+        self._story_name = story_name
+        # option blocks of a story never change, so they are built once per story
+        self._option_blocks: dict[int | str, str] = {
+            id: self._make_option_block(story.options) for id, story in (story_db or {}).items() if story.options
+        }
+
+    async def make_story(
+        self,
+        user_behavior: str,
+        accumulated_story: str,
+        options: list[StoryOption],
+        story_id: int | str | None = None,
+        live: LiveNarration | None = None,
+        fallback: Callable[[], TrpgHostResponse] | None = None,
+    ) -> TrpgHostResponse:
+        """Select an option for user's behavior and make a story.
 
-    def make_story(self, user_behavior: str, accumulated_story: str, options: list[StoryOption]) -> TrpgHostResponse:
-        message = self._make_message(user_behavior, accumulated_story, options)
+        If `story_id` is given, response cache is used. If `live` is given, the story is rendered while it's generated.
+        Responses made by `fallback` aren't cached.
+        """
+        cache = RESPONSE_CACHE.get()
+        cache_key = None
+        if cache is not None and self._story_name is not None and story_id is not None:
+            cache_key = cache.make_key(self._story_name, story_id, options, user_behavior)
+            # sqlite is read in a thread so that other sessions aren't blocked
+            if (cached := await asyncio.to_thread(cache.get, cache_key)) is not None:
+                response = TrpgHostResponse.model_validate_json(cached)
+                if live is not None:
+                    live.console.print(live.panel(getattr(response, live.field)))
+                return response
+
+        try:
+            response = await self._request_story(user_behavior, accumulated_story, options, story_id, live)
+        except LlmUnavailable as e:
+            return self._fall_back(fallback, live, e)
+        if cache_key is not None and response is not None:
+            await asyncio.to_thread(cache.put, cache_key, response.model_dump_json())
+        return response
+
+    async def _request_story(
+        self,
+        user_behavior: str,
+        accumulated_story: str,
+        options: list[StoryOption],
+        story_id: int | str | None = None,
+        live: LiveNarration | None = None,
+    ) -> TrpgHostResponse:
+        with span("prompt_build"):
+            message = self._make_message(user_behavior, accumulated_story, options, story_id)
         if DEBUG_MODE.get():
             pprint(message)
-        completion = self._client.beta.chat.completions.parse(
-            model=self.MODEL,
-            messages=message,
-            response_format=TrpgHostResponse,
-            temperature=0.3,  # 0.0 ~ 2.0
-            # top_p=1.0, # 0.0 ~ 1.0  do not change both temperature and top_p
-            # frequency_penalty=0, # -2.0 ~ 2.0
-            # presence_penalty=0, # -2.0 ~ 2.0
-        )
-        return completion.choices[0].message.parsed
+        # temperature and max tokens come from the narration route of MODEL_ROUTER
+        response = await self._parse(message, TrpgHostResponse, live)
+        if not 1 <= response.option <= len(options):
+            METRICS.incr("llm.repair.option_clamped")
+            response = response.model_copy(update={"option": min(max(response.option, 1), len(options))})
+        return response
 
-    def _make_message(self, user_behavior: str, accumulated_story: str, options: list[StoryOption]) -> list[dict[str, str]]:
-        system_message = HostSetting + "\n" + "<상황>" + accumulated_story + "</상황>\n"
+    def _make_message(
+        self,
+        user_behavior: str,
+        accumulated_story: str,
+        options: list[StoryOption],
+        story_id: int | str | None = None,
+    ) -> list[dict[str, str]]:
+        """Make messages for make_story.
 
-        system_message += "<선택지>\n"
-        for i, option in enumerate(options, start=1):
-            system_message += f"<{i}>\n"
-            system_message += f"<설명>{option.description}</설명>\n"
-            if option.goto is not None:
-                system_message += f"<결과>{option.next_description or self._story_db[option.goto].description}</결과>\n"
-            system_message += f"</{i}>\n"
-        system_message += "</선택지>\n"
+        HostSetting is sent alone as the first message so that it's a byte-identical prefix of every request,
+        which lets provider-side prompt caching reuse it. Situation and options follow in a separate message.
+        """
+        option_block = self._option_blocks.get(story_id) if story_id is not None else None
+        if option_block is None:
+            option_block = self._make_option_block(options)
 
         return [
-            {"role" : "system", "content" : system_message},
+            {"role" : "system", "content" : HostSetting},
+            {"role" : "system", "content" : "<상황>" + accumulated_story + "</상황>\n" + option_block},
             {"role" : "user", "content" : f"<주인공의 행동>{user_behavior}</주인공의 행동>"},
         ]
 
-    def talk(self, messages: list[dict[str, str]], **kwarg) -> Any:
-        res = self._client.beta.chat.completions.parse(
-            model=self.MODEL,
-            messages=messages,
-            **kwarg
+    def _make_option_block(self, options: list[StoryOption]) -> str:
+        option_block = "<선택지>\n"
+        for i, option in enumerate(options, start=1):
+            option_block += f"<{i}>\n"
+            option_block += f"<설명>{option.description}</설명>\n"
+            if option.goto is not None:
+                option_block += f"<결과>{option.next_description or self._story_db[option.goto].description}</결과>\n"
+            option_block += f"</{i}>\n"
+        option_block += "</선택지>\n"
+        return option_block
+
+    async def talk(
+        self,
+        messages: list[dict[str, str]],
+        live: LiveNarration | None = None,
+        fallback: Callable[[], Any] | None = None,
+        **kwarg,
+    ) -> Any:
+        response_format = kwarg.pop("response_format")
+        try:
+            return await self._parse(messages, response_format, live, **kwarg)
+        except LlmUnavailable as e:
+            return self._fall_back(fallback, live, e)
+
+    @staticmethod
+    def _fall_back(fallback: Callable[[], ResponseT] | None, live: LiveNarration | None, error: LlmUnavailable) -> ResponseT:
+        if fallback is None:
+            raise error
+        METRICS.incr("llm.fallback")
+        if DEBUG_MODE.get():
+            pprint(f"fallback : {error}")
+        response = fallback()
+        if live is not None:
+            live.console.print(live.panel(getattr(response, live.field)))
+        return response
+
+    @property
+    def _backend(self) -> LlmBackend:
+        return LLM_BACKEND.get() or _DEFAULT_BACKEND
+
+    @property
+    def _resilience(self) -> Resilience:
+        return LLM_RESILIENCE.get() or _DEFAULT_RESILIENCE
+
+    @property
+    def _router(self) -> ModelRouter:
+        return MODEL_ROUTER.get() or _DEFAULT_ROUTER
+
+    async def _parse(
+        self,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        live: LiveNarration | None = None,
+        **kwarg,
+    ) -> ResponseT:
+        call_type = response_format.__name__
+        max_tokens = kwarg.get("max_completion_tokens") or self._router.route(call_type)[1].max_tokens
+        # the call waits for rate limits before its deadline starts, so that waiting in the queue isn't a timeout
+        async with scheduled(messages, max_tokens) as grant:
+            with span("llm.call", call_type=call_type, streamed=live is not None, retries=0):
+                if live is not None:  # a stream is rendered as it comes, so it can't be hedged
+                    return await self._resilience.call(
+                        call_type, lambda: self._parse_streaming(messages, response_format, live, **kwarg), hedge=False
+                    )
+                return await self._resilience.call(
+                    call_type, lambda: self._request(messages, response_format, **kwarg), may_hedge=grant.may_hedge
+                )
+
+    async def _request(self, messages: list[dict[str, str]], response_format: type[ResponseT], **kwarg) -> ResponseT:
+        result = await self._send(messages, response_format, **kwarg)
+        return await self._validated(messages, response_format, result)
+
+    async def _send(
+        self,
+        messages: list[dict[str, str]],
+        response_format: type[BaseModel],
+        route_as: str | None = None,
+        **kwarg,
+    ) -> LlmResult:
+        """Send a request to the tier selected for `route_as`, which is the name of `response_format` by default."""
+        # a tier is selected per attempt, so that a hedge of a slow request can go to a less loaded tier
+        router = self._router
+        choice = router.select(route_as or response_format.__name__, economy=self._economy)
+        start = time.perf_counter()
+        with current_grant().attempt(), router.track(choice), span("llm.request", **choice.span_attributes()):
+            result = await self._backend.parse(choice.model, messages, response_format, **{**choice.kwarg, **kwarg})
+            self._record_usage(choice, result.usage, time.perf_counter() - start)
+        return result
+
+    async def _validated(
+        self, messages: list[dict[str, str]], response_format: type[ResponseT], result: LlmResult,
+    ) -> ResponseT:
+        """Response of `result`, repaired locally if it can be.
+
+        Only fields which can't be recovered are asked again, after the recovered ones. MalformedResponse is raised
+        if the response is refused, nothing can be recovered or the follow-up doesn't help either, so that
+        resilience sends the whole request again.
+        """
+        name = response_format.__name__
+        if result.parsed is None:
+            METRICS.incr("llm.response.parse_failed")
+        if result.refusal:
+            METRICS.incr("llm.response.refused")
+            msg = f"{name} request is refused : {result.refusal}"
+            raise MalformedResponse(msg)
+        repair = repair_response(response_format, result.parsed, result.raw)
+        if repair.response is not None:
+            if repair.changed:
+                METRICS.incr("llm.repair.local")
+            return repair.response
+        if not repair.data:
+            METRICS.incr("llm.repair.failed")
+            msg = f"{name} response can't be parsed : {(result.raw or '')[:200]!r}"
+            raise MalformedResponse(msg)
+
+        METRICS.incr("llm.repair.follow_up")
+        with span("llm.repair", call_type=name, missing=",".join(repair.missing)):
+            missing_format = missing_fields_format(response_format, tuple(repair.missing))
+            follow_up = await self._send(follow_up_messages(messages, repair), missing_format, route_as=name)
+        answered = repair_response(missing_format, follow_up.parsed, follow_up.raw).data
+        merged = response_format.model_construct(**{**repair.data, **answered})
+        if (response := repair_response(response_format, merged, None).response) is not None:
+            METRICS.incr("llm.repair.follow_up_ok")
+            return response
+        METRICS.incr("llm.repair.failed")
+        msg = f"{name} response misses {repair.missing} even after a follow-up."
+        raise MalformedResponse(msg)
+
+    @property
+    def _economy(self) -> bool:
+        """Whether the session spent enough of its budget that requests go to the economy tier."""
+        return session_degraded("cheap_model")
+
+    def _record_usage(self, choice: RouteChoice, usage: LlmUsage | None, latency: float) -> None:
+        tier = choice.tier.name
+        self._router.record_latency(choice, latency)
+        METRICS.incr("llm.calls")
+        METRICS.incr(f"llm.tier.{tier}.calls")
+        METRICS.incr(f"llm.route.{choice.call_type}.{tier}")
+        METRICS.observe("llm.latency", latency)
+        METRICS.observe(f"llm.tier.{tier}.latency", latency)
+        if usage is None:
+            return
+        METRICS.incr("llm.prompt_tokens", usage.prompt_tokens)
+        METRICS.incr("llm.completion_tokens", usage.completion_tokens)
+        METRICS.incr("llm.cached_tokens", usage.cached_tokens)
+        current_grant().add(usage)
+        cost = request_cost(choice.model, usage)
+        METRICS.incr("llm.cost_micro_usd", round(cost * 1e6))
+        if (session_usage := SESSION_USAGE.get()) is not None:
+            session_usage.add(usage, cost)
+        current_span().set(
+            prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, cached_tokens=usage.cached_tokens
         )
-        return res.choices[0].message.parsed
+        METRICS.incr(f"llm.tier.{tier}.prompt_tokens", usage.prompt_tokens)
+        METRICS.incr(f"llm.tier.{tier}.completion_tokens", usage.completion_tokens)
+        if usage.cached_tokens:
+            METRICS.observe("llm.latency.prompt_cache_hit", latency)
+        else:
+            METRICS.observe("llm.latency.prompt_cache_miss", latency)
+
+    async def _parse_streaming(
+        self,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        live: LiveNarration,
+        **kwarg,
+    ) -> ResponseT:
+        """Stream the response, rendering `live.field` as it grows. Returned object is validated after the stream ends."""
+        from rich.live import Live  # only needed while streaming
+
+        router = self._router
+        choice = router.select(response_format.__name__, economy=self._economy)
+        start = time.perf_counter()
+        with (
+            router.track(choice),
+            span("llm.request", **choice.span_attributes()),
+            Live(live.panel(""), console=live.console, refresh_per_second=12) as live_panel,
+        ):
+            def on_snapshot(snapshot: str) -> None:
+                if (text := _partial_field(snapshot, live.field)) is not None:
+                    live_panel.update(live.panel(text))
+
+            with current_grant().attempt():
+                result = await self._backend.stream(
+                    choice.model, messages, response_format, on_snapshot, **{**choice.kwarg, **kwarg}
+                )
+            self._record_usage(choice, result.usage, time.perf_counter() - start)
+            response = await self._validated(messages, response_format, result)
+            live_panel.update(live.panel(getattr(response, live.field)))
+        if not live.console.is_terminal:  # Live doesn't end the last line when it isn't a terminal
+            live.console.line()
+        return response
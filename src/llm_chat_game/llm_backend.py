@@ -0,0 +1,336 @@
+"""Backends which answer chat completion requests of GptAgent."""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import math
+import random
+import re
+from abc import ABC, abstractmethod
+from collections.abc import Callable
+from dataclasses import dataclass
+from functools import cache
+from os import environ
+from typing import Any, Literal, TYPE_CHECKING, TypeVar, get_args, get_origin
+
+from llm_chat_game.util import estimate_tokens
+from pydantic import BaseModel
+
+if TYPE_CHECKING:
+    import openai
+
+ResponseT = TypeVar("ResponseT", bound=BaseModel)
+
+
+@cache
+def read_api_key() -> str | None:
+    """Read OpenAI key from `../../openai_key.txt` or OPENAI_API_KEY environment variable, once when it's first needed."""
+    try:
+        with open("../../openai_key.txt", "r") as f:
+            return f.readline().strip() or environ.get("OPENAI_API_KEY")
+    except OSError:
+        return environ.get("OPENAI_API_KEY")
+
+
+@dataclass
+class LlmUsage:
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+
+
+@dataclass
+class LlmResult:
+    """Parsed response of a request and tokens it used. `usage` is None when the backend doesn't report it.
+
+    `parsed` is None when the response couldn't be parsed. Then `raw` has the JSON text as far as it was received,
+    or `refusal` has the reason the model refused to answer.
+    """
+    parsed: Any
+    usage: LlmUsage | None = None
+    raw: str | None = None
+    refusal: str | None = None
+
+
+class RateLimited(Exception):
+    """Raised by a backend when the provider refused a request for its rate limit.
+
+    Args:
+        retry_after (float | None): Seconds after which the provider accepts requests again, if it told.
+    """
+
+    def __init__(self, retry_after: float | None = None) -> None:
+        super().__init__(f"rate limited, retry after {retry_after} seconds")
+        self.retry_after = retry_after
+
+
+class LlmBackend(ABC):
+    """Where GptAgent sends requests. A backend returns a validated `response_format` object for messages."""
+
+    @abstractmethod
+    async def parse(
+        self, model: str, messages: list[dict[str, str]], response_format: type[ResponseT], **kwarg,
+    ) -> LlmResult:
+        pass
+
+    @abstractmethod
+    async def stream(
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        on_snapshot: Callable[[str], None],
+        **kwarg,
+    ) -> LlmResult:
+        """Same as `parse`, but `on_snapshot` is called with the JSON text received so far whenever it grows."""
+
+
+class OpenAIBackend(LlmBackend):
+    """OpenAI chat completions API.
+
+    `openai` is imported and the client is made on the first request, so that neither the import cost
+    nor a key is needed until then.
+
+    Args:
+        client (openai.AsyncOpenAI | None): Client to use. Default is a client shared in the process.
+    """
+
+    _shared_client: openai.AsyncOpenAI | None = None
+
+    def __init__(self, client: openai.AsyncOpenAI | None = None) -> None:
+        self._client = client
+
+    @property
+    def client(self) -> openai.AsyncOpenAI:
+        if self._client is None:
+            if OpenAIBackend._shared_client is None:
+                import openai
+
+                OpenAIBackend._shared_client = openai.AsyncOpenAI(api_key=read_api_key())
+            self._client = OpenAIBackend._shared_client
+        return self._client
+
+    @staticmethod
+    def _rate_limited(error: openai.RateLimitError) -> RateLimited:
+        retry_after = error.response.headers.get("retry-after")
+        try:
+            return RateLimited(float(retry_after) if retry_after is not None else None)
+        except ValueError:  # an http date
+            return RateLimited()
+
+    @staticmethod
+    def _usage(usage: Any) -> LlmUsage | None:
+        if usage is None:
+            return None
+        details = getattr(usage, "prompt_tokens_details", None)
+        return LlmUsage(usage.prompt_tokens, usage.completion_tokens, getattr(details, "cached_tokens", None) or 0)
+
+    async def parse(
+        self, model: str, messages: list[dict[str, str]], response_format: type[ResponseT], **kwarg,
+    ) -> LlmResult:
+        import openai
+
+        try:
+            completion = await self.client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                **kwarg
+            )
+        except openai.LengthFinishReasonError as e:  # cut off by max tokens, which GptAgent can repair
+            message = e.completion.choices[0].message
+            return LlmResult(None, self._usage(e.completion.usage), raw=message.content, refusal=message.refusal)
+        except openai.RateLimitError as e:
+            raise self._rate_limited(e) from e
+        message = completion.choices[0].message
+        return LlmResult(message.parsed, self._usage(completion.usage), raw=message.content, refusal=message.refusal)
+
+    async def stream(
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        on_snapshot: Callable[[str], None],
+        **kwarg,
+    ) -> LlmResult:
+        import openai
+        from pydantic import ValidationError
+
+        snapshot = ""
+        try:
+            async with self.client.beta.chat.completions.stream(
+                model=model,
+                messages=messages,
+                response_format=response_format,
+                stream_options={"include_usage": True},
+                **kwarg
+            ) as stream:
+                async for event in stream:
+                    if event.type != "content.delta":
+                        continue
+                    snapshot = event.snapshot
+                    on_snapshot(snapshot)
+                try:
+                    completion = await stream.get_final_completion()
+                except openai.LengthFinishReasonError as e:
+                    return LlmResult(None, self._usage(e.completion.usage), raw=snapshot)
+        except openai.RateLimitError as e:
+            raise self._rate_limited(e) from e
+        refusal = completion.choices[0].message.refusal
+        try:
+            parsed = response_format.model_validate_json(snapshot)
+        except ValidationError:
+            parsed = None
+        return LlmResult(parsed, self._usage(completion.usage), raw=snapshot, refusal=refusal)
+
+
+class LocalBackend(LlmBackend):
+    """Deterministic stand-in of LLM which needs no network.
+
+    A response is generated from fields of `response_format` with a random generator seeded by the request,
+    so the same request always gets the same response. `option` fields choose one of the `<설명>` options in
+    the messages. Latency of a request is lognormal, `latency * exp(N(0, jitter))` seconds.
+    Usage is estimated, and leading messages which were sent before are reported as cached tokens.
+
+    Args:
+        latency (float): Median seconds of a request.
+        jitter (float): Standard deviation of log latency. 0 makes every request take `latency`.
+        seed (int): Seed of responses and latencies.
+        phase_over_rate (float): Probability that a bool field is true, which ends random event phases.
+        chunk_size (int): Characters of a streamed chunk.
+        malformed_rate (float): Probability that a response is cut off or has values out of range,
+            like a real model sometimes does.
+    """
+
+    SENTENCES = [
+        "무너진 건물 사이로 매캐한 연기가 피어오릅니다.",
+        "멀리서 총성이 들리더니 이내 조용해집니다.",
+        "주인공은 숨을 죽이고 주변을 살핍니다.",
+        "부서진 간판이 바람에 삐걱거립니다.",
+        "발밑에서 깨진 유리가 바스락거립니다.",
+        "어딘가에서 사람의 목소리가 희미하게 들려옵니다.",
+        "하늘은 잿빛 구름으로 뒤덮여 있습니다.",
+        "주인공은 조심스럽게 한 걸음 앞으로 나아갑니다.",
+    ]
+    SELECTIONS = ["주변을 수색한다", "조용히 자리를 피한다", "소리가 나는 쪽으로 다가간다", "잠시 숨어서 기다린다"]
+    MAX_PREFIXES = 10000
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        jitter: float = 0.3,
+        seed: int = 0,
+        phase_over_rate: float = 0.4,
+        chunk_size: int = 16,
+        malformed_rate: float = 0.0,
+    ) -> None:
+        self._latency = latency
+        self._jitter = jitter
+        self._seed = seed
+        self._phase_over_rate = phase_over_rate
+        self._chunk_size = chunk_size
+        self._malformed_rate = malformed_rate
+        self._latency_rng = random.Random(seed)
+        self._seen_prefixes: set[str] = set()
+
+    async def parse(
+        self, model: str, messages: list[dict[str, str]], response_format: type[ResponseT], **kwarg,
+    ) -> LlmResult:
+        result = self._generate(model, messages, response_format)
+        await asyncio.sleep(self._delay())
+        return result
+
+    async def stream(
+        self,
+        model: str,
+        messages: list[dict[str, str]],
+        response_format: type[ResponseT],
+        on_snapshot: Callable[[str], None],
+        **kwarg,
+    ) -> LlmResult:
+        result = self._generate(model, messages, response_format)
+        text = result.raw if result.parsed is None else result.parsed.model_dump_json()
+        n_chunks = max(1, math.ceil(len(text) / self._chunk_size))
+        chunk_delay = self._delay() / n_chunks
+        for end in range(self._chunk_size, len(text) + self._chunk_size, self._chunk_size):
+            await asyncio.sleep(chunk_delay)
+            on_snapshot(text[:end])
+        return result
+
+    def _delay(self) -> float:
+        if self._latency <= 0:
+            return 0.0
+        return self._latency * math.exp(self._latency_rng.gauss(0, self._jitter))
+
+    def _generate(self, model: str, messages: list[dict[str, str]], response_format: type[ResponseT]) -> LlmResult:
+        request = json.dumps([model, response_format.__name__, messages], ensure_ascii=False, sort_keys=True)
+        digest = hashlib.sha256(f"{self._seed}:{request}".encode("utf-8")).digest()
+        rng = random.Random(int.from_bytes(digest[:8], "big"))
+        n_options = len(re.findall(r"<설명>", messages[-2]["content"])) if len(messages) >= 2 else 0
+        values = {
+            name: self._value(rng, name, field.annotation, n_options)
+            for name, field in response_format.model_fields.items()
+        }
+        parsed = response_format.model_validate(values)
+        prompt_tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        completion_tokens = estimate_tokens(parsed.model_dump_json())
+        usage = LlmUsage(prompt_tokens, completion_tokens, self._cached_tokens(messages))
+        # drawn per attempt rather than per request, so that sending a request again can fix it like with real models
+        if self._malformed_rate and self._latency_rng.random() < self._malformed_rate:
+            return self._malform(self._latency_rng, parsed, usage, n_options)
+        return LlmResult(parsed, usage)
+
+    @staticmethod
+    def _malform(rng: random.Random, parsed: BaseModel, usage: LlmUsage, n_options: int) -> LlmResult:
+        """Break a response the way models do: cut it off, or put values out of range which the schema allows."""
+        values = parsed.model_dump()
+        lists = [name for name, val in values.items() if isinstance(val, list)]
+        if rng.random() < 0.5 and ("option" in values or lists):
+            if "option" in values:
+                values["option"] = rng.choice([0, n_options + 1])
+            for name in lists:
+                values[name] = values[name][:2]
+            return LlmResult(type(parsed).model_construct(**values), usage)
+        text = parsed.model_dump_json()
+        return LlmResult(None, usage, raw=text[:rng.randint(len(text) // 3, len(text) - 2)])
+
+    def _cached_tokens(self, messages: list[dict[str, str]]) -> int:
+        """Tokens of the longest run of leading system messages which was sent before."""
+        if len(self._seen_prefixes) > self.MAX_PREFIXES:
+            self._seen_prefixes.clear()
+        cached = 0
+        tokens = 0
+        prefix = hashlib.sha256()
+        for message in messages:
+            if message["role"] != "system":
+                break
+            prefix.update(message["content"].encode("utf-8"))
+            key = prefix.hexdigest()
+            tokens += estimate_tokens(message["content"])
+            if key in self._seen_prefixes:
+                cached = tokens
+            else:
+                self._seen_prefixes.add(key)
+        return cached
+
+    def _value(self, rng: random.Random, name: str, annotation: Any, n_options: int) -> Any:
+        origin = get_origin(annotation)
+        if origin is Literal:
+            # choices near the middle are more likely, so that status changes stay small
+            choices = get_args(annotation)
+            center = len(choices) // 2
+            return rng.choices(choices, weights=[1 + center - abs(i - center) for i in range(len(choices))])[0]
+        if origin is list:
+            return rng.sample(self.SELECTIONS, 3)
+        if annotation is bool:
+            return rng.random() < self._phase_over_rate
+        if annotation is int:
+            return rng.randint(1, max(1, n_options)) if name == "option" else rng.randint(0, 3)
+        if annotation is float:
+            return rng.random()
+        if annotation is str:
+            return " ".join(rng.choices(self.SENTENCES, k=1 if name == "reason" else rng.randint(2, 4)))
+        msg = f"LocalBackend can't generate {name} field of {annotation} type."
+        raise TypeError(msg)
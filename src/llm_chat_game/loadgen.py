@@ -0,0 +1,136 @@
+"""Load generator which plays many scripted bot sessions against the local LLM backend.
+
+Every session is played by `play_game` in one event loop, with the same code path as real players.
+Report has sessions per second, turn latency percentiles and memory per session, which are used to size hosts.
+Turn latency is the time from a bot's input until the game asks for the next input.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import io
+import random
+import time
+
+from llm_chat_game.game import play_game
+from llm_chat_game.game_io import GameIO
+from llm_chat_game.main import add_game_args, apply_game_args
+from llm_chat_game.metrics import METRICS
+from rich.console import Console
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+
+class _NullFile(io.TextIOBase):
+    def write(self, s: str) -> int:
+        return len(s)
+
+
+class BotIO(GameIO):
+    """Scripted player. Output is rendered and thrown away, input is a number or a behavior chosen at random.
+
+    Args:
+        rng (random.Random): Random generator of inputs.
+        think_time (float): Seconds a bot waits before it answers.
+    """
+
+    BEHAVIORS = [
+        "1",
+        "1",
+        "주변을 조심스럽게 살펴본다",
+        "가방에서 무기를 꺼내 든다",
+        "조용히 뒤로 물러난다",
+        "큰 소리로 도움을 요청한다",
+        "아무것도 하지 않고 기다린다",
+    ]
+
+    def __init__(self, rng: random.Random, think_time: float = 0.0) -> None:
+        self.console = Console(file=_NullFile(), width=80, force_terminal=False, color_system=None)
+        self._rng = rng
+        self._think_time = think_time
+        self._last_input: float | None = None
+        self.turns = 0
+
+    async def input(self, prompt: str) -> str:
+        if self._last_input is not None:
+            METRICS.observe("loadgen.turn_latency", time.perf_counter() - self._last_input)
+        if self._think_time > 0:
+            await asyncio.sleep(self._think_time)
+        self.turns += 1
+        self._last_input = time.perf_counter()
+        return self._rng.choice(self.BEHAVIORS)
+
+
+def _max_rss_mb() -> float | None:
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on linux
+
+
+async def run_sessions(n_sessions: int, concurrency: int, seed: int = 0, think_time: float = 0.0) -> dict[str, float]:
+    """Play `n_sessions` bot sessions with at most `concurrency` of them at once, and return the report."""
+    semaphore = asyncio.Semaphore(concurrency)
+    turns = 0
+
+    async def play_one(i: int) -> None:
+        nonlocal turns
+        async with semaphore:
+            bot = BotIO(random.Random(seed * 1_000_003 + i), think_time)
+            try:
+                survived = await play_game(io=bot)
+            except Exception:
+                METRICS.incr("loadgen.session.error")
+            else:
+                METRICS.incr("loadgen.session.survived" if survived else "loadgen.session.died")
+            turns += bot.turns
+
+    rss_before = _max_rss_mb()
+    start = time.perf_counter()
+    await asyncio.gather(*(play_one(i) for i in range(n_sessions)))
+    elapsed = time.perf_counter() - start
+    rss_after = _max_rss_mb()
+
+    report = {
+        "sessions": n_sessions,
+        "concurrency": concurrency,
+        "seconds": elapsed,
+        "sessions_per_sec": n_sessions / elapsed,
+        "turns_per_sec": turns / elapsed,
+        "errors": METRICS.counter("loadgen.session.error"),
+    }
+    for q in (50, 95, 99):
+        report[f"turn_latency.p{q}"] = METRICS.percentile("loadgen.turn_latency", q)
+    if rss_before is not None:
+        report["max_rss_mb"] = rss_after
+        report["memory_per_session_mb"] = (rss_after - rss_before) / min(concurrency, n_sessions)
+    return report
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sessions', type=int, default=1000, help="Number of bot sessions to play.")
+    parser.add_argument('--concurrency', type=int, default=200, help="Sessions played at once.")
+    parser.add_argument('--think-time', type=float, default=0.0, help="Seconds a bot waits before it answers.")
+    add_game_args(parser)
+    parser.set_defaults(backend="local")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+    apply_game_args(args)
+    random.seed(args.seed)
+
+    report = asyncio.run(run_sessions(args.sessions, args.concurrency, args.seed, args.think_time))
+    for name, val in report.items():
+        print(f"{name} : {val:.3f}" if isinstance(val, float) else f"{name} : {val}")
+    if args.stats:
+        print(METRICS)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,105 +3,201 @@
 from __future__ import annotations
 
 import argparse
-import random
-import inspect
-from pathlib import Path
-from typing import TYPE_CHECKING
-
-import pyfiglet
-import llm_chat_game
-from llm_chat_game.context_var import DEBUG_MODE
-from llm_chat_game.status_entity import StatusManager
-from llm_chat_game.story import StoryWithOptionNarrator, StoryWithoutOptionNarrator
-from llm_chat_game.story_db.random_events import situation_end_conditions, situations
-from rich.console import Console
-from rich.panel import Panel
-
-console = Console()
-
-if TYPE_CHECKING:
-    from llm_chat_game.story import StoryNarrator
-
-
-def load_story_narrators() -> list[StoryNarrator]:
-    story_db_dir = Path(inspect.getfile(llm_chat_game)).parent / "story_db"
-    narrators = []
-    for story_file in story_db_dir.glob("event*.yaml"):
-        narrator = StoryWithOptionNarrator(story_file)
-        if narrator.is_start_event:
-            narrators.append(narrator)
-    return narrators
-
-
-def load_sub_story_narrators() -> list[StoryNarrator] | None:
-    try:
-        return [
-            StoryWithoutOptionNarrator(
-                random_event,
-                end_condition
-            ) for random_event, end_condition in zip(situations, situation_end_conditions)
-        ]
-    except Exception as e:
-        print(e)
-
-
-def get_total_stories(
-    story_narrators: list[StoryNarrator],
-    sub_story_narrators: list[StoryNarrator],
-) -> list[StoryNarrator]:
-    arr = []
-    while story_narrators and sub_story_narrators:
-        if random.choice([True, False]):
-            arr.append(story_narrators.pop())
-        else:
-            arr.append(sub_story_narrators.pop())
-
-    arr.extend(story_narrators)
-    arr.extend(sub_story_narrators)
-
-    return arr
-
-
-def play_game():
-    story_narrators = load_story_narrators()
-    sub_story_narrators = load_sub_story_narrators()
-
-    user_status = StatusManager()
-
-    console.print(Panel("2050년 서울에 화성이 떨어졌다.\n별같은 것이 아니다. 그것은 북한에서 발사한 핵이다.\n2020년대 이래로 너나할것없이 모든 나라들은 자국우선주의 전략을 펼치기 시작했다.\n이러한 기조가 진행될 수록 세계 곳곳에서 전쟁이 터지기 시작했고 종국에는 한반도에도 전운이 감돌기 시작하더니 북한에서 선제타격을 한 것이다.\n현재 서울은 황폐화 되었고 현재는 무정부상태와 다름없다.\n각 나라가 그러했듯 모든 사람들은 자신의 생존을 최우선하며 다른 사람들을 약탈하고 있다.\n다행인 점은 현재 국군이 북한군을 밀어내며 서울을 곧 탈환할 수 있다는 소식을 들은 것이다. 당신은 그 날을 기다리며 하루하루 생존을 위해 분투해야 한다.\n"))
-
-    story_narrators_combined = get_total_stories(story_narrators, sub_story_narrators)
-    random.shuffle(story_narrators_combined)
-    day = 1
-    while story_narrators_combined:
-        ascii_art = pyfiglet.figlet_format(f"Day {day}...")
-        print(ascii_art)
-        story_narrator = story_narrators_combined.pop(0)
-        next_story = story_narrator.play_story(user_status)
-
-        if user_status.is_die():
-            print(f"당신은 {day}일차에 죽었습니다.\nGame over.")
-            break
-
-        if next_story is not None:
-            idx_to_insert = random.randint(0, len(story_narrators_combined)-1) if story_narrators_combined else 0
-            story_narrators_combined.insert(idx_to_insert, next_story)
-        day += 1
-    else:
-        print("국군이 서울을 탈환했습니다.\n많은 역경이 있었지만 당신은 당신의 능력을 증명하고 생존했습니다.\nGame end.")
+import asyncio
+
+from llm_chat_game.budget import Budget
+from llm_chat_game.cassette import Cassette, RecordingBackend, ReplayBackend
+from llm_chat_game.context_var import (
+    CONTEXT_TOKEN_BUDGET,
+    DEBUG_MODE,
+    FAST_PATH_THRESHOLD,
+    GAME_SEED,
+    LLM_BACKEND,
+    LLM_RESILIENCE,
+    MODEL_ROUTER,
+    REQUEST_SCHEDULER,
+    RESPONSE_CACHE,
+    SESSION_BUDGET,
+    SITUATION_POOL,
+    SPECULATIVE_RESULTS,
+    STREAM_NARRATION,
+    TRACER,
+    TURN_PROTOCOL,
+)
+from llm_chat_game.game import get_story_db_dir, play_game
+from llm_chat_game.llm_backend import LocalBackend, OpenAIBackend
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.request_scheduler import RequestScheduler
+from llm_chat_game.resilience import CircuitBreaker, Resilience
+from llm_chat_game.routing import ModelRouter
+from llm_chat_game.response_cache import StoryResponseCache
+from llm_chat_game.session_store import SessionStore
+from llm_chat_game.situation_pool import SituationPool
+from llm_chat_game.startup_report import startup_report
+from llm_chat_game.story import StoryIndex
+from llm_chat_game.story.story_watcher import watch_stories
+from llm_chat_game.tracing import Tracer
+
+
+def add_game_args(parser: argparse.ArgumentParser) -> None:
+    """Add arguments which configure how games are played."""
+    parser.add_argument('-d', '--debug', action="store_true")
+    parser.add_argument('--stream', action="store_true", help="Render stories while they are generated.")
+    parser.add_argument(
+        '--turn-protocol', choices=["classic", "combined"], default=TURN_PROTOCOL.get(),
+        help="How a random event phase talks to LLM. 'combined' needs one request per phase.",
+    )
+    parser.add_argument(
+        '--context-budget', type=int, default=CONTEXT_TOKEN_BUDGET.get(),
+        help="Estimated tokens of a random event conversation before old turns are summarized. 0 means no limit.",
+    )
+    parser.add_argument('--response-cache', action="store_true", help="Cache stories made from free text on local disk.")
+    parser.add_argument('--cache-size', type=int, default=10000, help="Maximum number of cached stories.")
+    parser.add_argument('--cache-ttl', type=float, default=7 * 24 * 3600, help="Seconds a cached story stays valid.")
+    parser.add_argument(
+        '--fast-path-threshold', type=float, default=FAST_PATH_THRESHOLD.get(),
+        help="Similarity needed to select an option from free text without LLM. Negative value disables it.",
+    )
+    parser.add_argument(
+        '--situation-pool', action="store_true",
+        help="Draw openings of random events from the pool made by chat-game-pool, and refill it in background.",
+    )
+    parser.add_argument('--pool-low-water', type=int, default=3, help="Variants of a situation below which the pool is refilled.")
+    parser.add_argument('--pool-max-uses', type=int, default=3, help="Times a pooled opening is drawn before it's evicted.")
+    parser.add_argument(
+        '--backend', choices=["openai", "local"], default="openai",
+        help="Where LLM requests go. 'local' is a deterministic stand-in which needs no network.",
+    )
+    parser.add_argument('--local-latency', type=float, default=0.5, help="Median seconds of a request to local backend.")
+    parser.add_argument('--local-jitter', type=float, default=0.3, help="Standard deviation of log latency of local backend.")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of local backend.")
+    parser.add_argument(
+        '--local-malformed-rate', type=float, default=0.0,
+        help="Probability that local backend answers with a cut off or out of range response.",
+    )
+    parser.add_argument(
+        '--deadline-scale', type=float, default=1.0,
+        help="Multiplier of deadlines of LLM requests. 0 removes deadlines.",
+    )
+    parser.add_argument(
+        '--hedge-percentile', type=float, default=95,
+        help="Latency percentile after which a duplicate LLM request is sent. Negative value disables hedging.",
+    )
+    parser.add_argument('--breaker-failures', type=int, default=5, help="Consecutive LLM failures which open the circuit.")
+    parser.add_argument('--breaker-reset', type=float, default=30.0, help="Seconds the circuit stays open.")
+    parser.add_argument(
+        '--model-routes', metavar="PATH",
+        help="Yaml or json file of model tiers and routes of call types, merged over the default routes.",
+    )
+    parser.add_argument(
+        '--speculate', type=int, default=0, metavar="BUDGET",
+        help="Request results of the shown selections while the player chooses, "
+        "up to BUDGET speculative requests per session. 0 disables it.",
+    )
+    parser.add_argument(
+        '--profile', nargs="?", const="spans.jsonl", metavar="PATH",
+        help="Write spans of every phase of a turn to a JSONL file (default spans.jsonl). "
+        "Summarize them with chat-game-trace.",
+    )
+    parser.add_argument(
+        '--rate-limit-rpm', type=int, metavar="REQUESTS",
+        help="Requests a minute sent to LLM from every session of the process. "
+        "Requests which a player waits for go before prefetches, speculation and pool refills.",
+    )
+    parser.add_argument('--rate-limit-tpm', type=int, metavar="TOKENS", help="Tokens a minute sent to LLM from every session.")
+    parser.add_argument(
+        '--session-token-budget', type=int, metavar="TOKENS",
+        help="Prompt and completion tokens a session may use. As a session spends it, requests go to a cheaper model, "
+        "context gets shorter, twists stop and random events end early.",
+    )
+    parser.add_argument(
+        '--session-cost-budget', type=float, metavar="USD",
+        help="Dollars a session may spend, which degrades a session the same way as --session-token-budget.",
+    )
+    parser.add_argument(
+        '--game-seed', type=int, metavar="SEED",
+        help="Seed of story order and random rolls of each session, so that a recorded session replays the same way.",
+    )
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', metavar="PATH", help="Record every LLM response to a cassette file.")
+    cassette.add_argument(
+        '--replay', metavar="PATH",
+        help="Answer LLM requests only from a cassette file written by --record. Use the same --game-seed.",
+    )
+    parser.add_argument(
+        '--watch-stories', type=float, default=0, metavar="SECONDS",
+        help="Reload story files every SECONDS while the game runs. New sessions play them once they are valid. "
+        "0 disables it.",
+    )
+    parser.add_argument('--stats', action="store_true", help="Print metrics when game ends.")
+
+
+def apply_game_args(args: argparse.Namespace) -> None:
+    """Set context variables from arguments added by `add_game_args`."""
+    DEBUG_MODE.set(args.debug)
+    STREAM_NARRATION.set(args.stream)
+    TURN_PROTOCOL.set(args.turn_protocol)
+    CONTEXT_TOKEN_BUDGET.set(args.context_budget or None)
+    FAST_PATH_THRESHOLD.set(args.fast_path_threshold if args.fast_path_threshold >= 0 else None)
+    if args.response_cache:
+        RESPONSE_CACHE.set(StoryResponseCache(max_entries=args.cache_size, ttl=args.cache_ttl))
+    LLM_RESILIENCE.set(Resilience(
+        deadline_scale=args.deadline_scale,
+        hedge_percentile=args.hedge_percentile if args.hedge_percentile >= 0 else None,
+        breaker=CircuitBreaker(args.breaker_failures, args.breaker_reset),
+    ))
+    SPECULATIVE_RESULTS.set(args.speculate or None)
+    if args.profile:
+        TRACER.set(Tracer(args.profile))
+    if args.model_routes:
+        MODEL_ROUTER.set(ModelRouter.from_file(args.model_routes))
+    if args.situation_pool:
+        SITUATION_POOL.set(SituationPool(max_uses=args.pool_max_uses, low_water=args.pool_low_water))
+    if args.backend == "local":
+        LLM_BACKEND.set(LocalBackend(
+            args.local_latency, args.local_jitter, args.seed, malformed_rate=args.local_malformed_rate
+        ))
+    GAME_SEED.set(args.game_seed)
+    if args.rate_limit_rpm or args.rate_limit_tpm:
+        REQUEST_SCHEDULER.set(RequestScheduler(args.rate_limit_rpm, args.rate_limit_tpm))
+    if args.session_token_budget or args.session_cost_budget:
+        SESSION_BUDGET.set(Budget(args.session_token_budget, args.session_cost_budget))
+    if args.record:
+        LLM_BACKEND.set(RecordingBackend(LLM_BACKEND.get() or OpenAIBackend(), Cassette(args.record)))
+    elif args.replay:
+        LLM_BACKEND.set(ReplayBackend(Cassette(args.replay)))
 
 
 def get_args():
     parser = argparse.ArgumentParser()
-    parser.add_argument('-d', '--debug', action="store_true")
+    add_game_args(parser)
+    parser.add_argument('--save', action="store_true", help="Save the session after every turn so that it can be resumed.")
+    parser.add_argument('--resume', metavar="SESSION_ID", help="Resume a saved session.")
+    parser.add_argument(
+        '--startup-report', nargs="?", const="llm_chat_game.main", metavar="MODULE",
+        help="Print import cost of MODULE (default is the game) in a fresh interpreter and exit.",
+    )
     return parser.parse_args()
 
 
+async def _play(store: SessionStore | None, resume: str | None, watch_interval: float | None) -> bool:
+    async with watch_stories(StoryIndex.for_dir(get_story_db_dir()), watch_interval):
+        return await play_game(store=store, resume=resume)
+
+
 def main() -> None:
     args = get_args()
-    DEBUG_MODE.set(args.debug)
+    if args.startup_report:
+        print(startup_report(args.startup_report))
+        return
+    apply_game_args(args)
 
-    play_game()
+    try:
+        store = SessionStore() if args.save or args.resume else None
+        asyncio.run(_play(store, args.resume, args.watch_stories or None))
+    finally:
+        if args.stats:
+            print(METRICS)
 
 
 if __name__ == "__main__":
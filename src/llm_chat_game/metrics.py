@@ -0,0 +1,56 @@
+"""In-process counters and latency samples."""
+
+from __future__ import annotations
+
+from collections import defaultdict, deque
+
+
+class Metrics:
+    """Registry of named counters and sampled values.
+
+    Samples are kept in a bounded window so that long running processes don't grow without limit.
+    """
+
+    MAX_SAMPLES: int = 10000
+
+    def __init__(self) -> None:
+        self._counters: dict[str, int] = defaultdict(int)
+        self._samples: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=self.MAX_SAMPLES))
+
+    def incr(self, name: str, val: int = 1) -> None:
+        self._counters[name] += val
+
+    def observe(self, name: str, val: float) -> None:
+        self._samples[name].append(val)
+
+    def counter(self, name: str) -> int:
+        return self._counters.get(name, 0)
+
+    def percentile(self, name: str, q: float) -> float | None:
+        """Return q-th percentile (0 ~ 100) of samples of `name`. If there is no sample, return None."""
+        samples = self._samples.get(name)
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        idx = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+        return ordered[idx]
+
+    def reset(self) -> None:
+        self._counters.clear()
+        self._samples.clear()
+
+    def snapshot(self) -> dict[str, float | int]:
+        ret: dict[str, float | int] = dict(sorted(self._counters.items()))
+        for name in sorted(self._samples):
+            if not self._samples[name]:
+                continue
+            ret[f"{name}.count"] = len(self._samples[name])
+            for q in (50, 95, 99):
+                ret[f"{name}.p{q}"] = self.percentile(name, q)
+        return ret
+
+    def __str__(self):
+        return "\n".join(f"{name} : {val:.3f}" if isinstance(val, float) else f"{name} : {val}" for name, val in self.snapshot().items())
+
+
+METRICS = Metrics()
@@ -0,0 +1,321 @@
+"""Scheduler which keeps LLM requests of every session in the process under the rate limits of the provider.
+
+A request waits until both a request and its estimated tokens are available from token buckets which refill
+at the per minute limits. Waiting requests are granted in order of priority: `interactive` requests, which a player
+is waiting on, before `background` ones such as prefetches, speculation and situation pool refills.
+Once a player waits on a background task, the task is promoted and its requests are granted as interactive.
+Within a priority, sessions take turns, so a session which sends many requests doesn't hold up the others.
+
+A call waits for its grant before its deadline and hedge timer start, so time spent in the queue isn't counted
+as a slow or failed request. Retries and repair follow-ups of a granted call are sent at once and charged to
+the buckets, and a hedge is sent only if the scheduler could grant it without waiting.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+import weakref
+from collections import OrderedDict, deque
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterator
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import TypeVar
+
+from llm_chat_game.context_var import REQUEST_PRIORITY, REQUEST_SCHEDULER, SESSION_ID
+from llm_chat_game.llm_backend import LlmUsage, RateLimited
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.tracing import span
+from llm_chat_game.util import estimate_tokens
+
+T = TypeVar("T")
+
+PRIORITIES = ("interactive", "background")
+# completion tokens assumed for a request which doesn't limit them
+DEFAULT_COMPLETION_TOKENS = 500
+
+
+async def in_background(request: Callable[[], Awaitable[T]]) -> T:
+    """Make and await `request()` in a task of its own with background priority. Requests of the caller aren't affected.
+
+    The awaitable is made inside the task, so nothing is left unawaited if the task is cancelled before it starts.
+    """
+    REQUEST_PRIORITY.set("background")
+    return await request()
+
+
+class TokenBucket:
+    """Bucket which holds up to `per_minute` units and refills at `per_minute` units a minute.
+
+    Args:
+        per_minute (float): Limit per minute.
+    """
+
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.level = per_minute
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` is available. A request larger than the bucket waits until it's full."""
+        self._refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.level -= amount
+
+    def adjust(self, amount: float) -> None:
+        """Give back `amount`, or take it if it's negative. The level may go below zero, which delays later requests."""
+        self.level = min(self.capacity, self.level + amount)
+
+
+@dataclass
+class _Waiter:
+    tokens: int
+    priority: str
+    future: asyncio.Future = field(repr=False)
+    task: asyncio.Task | None = field(default=None, repr=False)
+    enqueued: float = field(default_factory=time.monotonic)
+
+
+class Grant:
+    """A request and its estimated tokens granted to one LLM call, which may send several attempts.
+
+    The first attempt is covered by the grant. Later ones, i.e. hedges, retries and repair follow-ups, take a request
+    from the scheduler at once. Reserved tokens are corrected with the tokens every attempt used when the call ends.
+
+    Args:
+        scheduler (RequestScheduler | None): Scheduler which granted the call. None means there is no limit.
+        tokens (int): Estimated tokens reserved.
+    """
+
+    def __init__(self, scheduler: RequestScheduler | None, tokens: int) -> None:
+        self.scheduler = scheduler
+        self.tokens = tokens
+        self.attempts = 0
+        self.used = 0
+
+    def may_hedge(self) -> bool:
+        """Whether a hedge can be sent without waiting for other requests or the rate limits."""
+        return self.scheduler is None or self.scheduler.available(self.tokens)
+
+    @contextmanager
+    def attempt(self) -> Iterator[None]:
+        """Count an attempt which is sent while the block runs, and back off if it's refused for the rate limit."""
+        if self.scheduler is None:
+            yield
+            return
+        if self.attempts:
+            self.scheduler.charge()
+        self.attempts += 1
+        try:
+            yield
+        except RateLimited as e:
+            self.scheduler.back_off(e.retry_after if e.retry_after is not None else self.scheduler.DEFAULT_BACK_OFF)
+            raise
+
+    def add(self, usage: LlmUsage | None) -> None:
+        if self.scheduler is not None and usage is not None:
+            self.used += usage.prompt_tokens + usage.completion_tokens
+
+    def close(self) -> None:
+        if self.scheduler is not None:
+            self.scheduler.settle(self.tokens, self.used)
+
+
+_NO_GRANT = Grant(None, 0)
+_CURRENT_GRANT: ContextVar[Grant | None] = ContextVar("current_grant", default=None)
+
+
+def current_grant() -> Grant:
+    """Grant of the LLM call being made. Attempts of calls which aren't scheduled get a grant without limits."""
+    return _CURRENT_GRANT.get() or _NO_GRANT
+
+
+class RequestScheduler:
+    """Grant LLM requests under requests per minute and tokens per minute limits.
+
+    When the provider refuses a request for its rate limit anyway, e.g. because other processes share the key,
+    nothing is granted until it's retried after.
+
+    Args:
+        requests_per_minute (int | None): Requests allowed a minute. None means no limit.
+        tokens_per_minute (int | None): Prompt and completion tokens allowed a minute. None means no limit.
+    """
+
+    # seconds nothing is granted after a rate limit error which doesn't say when to retry
+    DEFAULT_BACK_OFF = 5.0
+
+    def __init__(self, requests_per_minute: int | None = None, tokens_per_minute: int | None = None) -> None:
+        self._requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self._tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self._queues: dict[str, OrderedDict[str | None, deque[_Waiter]]] = {
+            priority: OrderedDict() for priority in PRIORITIES
+        }
+        self._paused_until = 0.0
+        self._timer: asyncio.TimerHandle | None = None
+        self._promoted: weakref.WeakSet[asyncio.Task] = weakref.WeakSet()
+
+    @property
+    def depth(self) -> int:
+        return sum(len(waiters) for queue in self._queues.values() for waiters in queue.values())
+
+    def depth_of(self, priority: str) -> int:
+        return sum(len(waiters) for waiters in self._queues[priority].values())
+
+    def _wait_time(self, tokens: int, now: float) -> float:
+        wait = max(0.0, self._paused_until - now)
+        if self._requests is not None:
+            wait = max(wait, self._requests.wait_time(1, now))
+        if self._tokens is not None:
+            wait = max(wait, self._tokens.wait_time(tokens, now))
+        return wait
+
+    def _take(self, tokens: int, now: float) -> None:
+        if self._requests is not None:
+            self._requests.take(1, now)
+        if self._tokens is not None:
+            self._tokens.take(tokens, now)
+
+    async def acquire(self, tokens: int, priority: str = "interactive", session: str | None = None) -> None:
+        """Wait until a request of `tokens` estimated tokens can be sent."""
+        now = time.monotonic()
+        ahead = any(self.depth_of(other) for other in PRIORITIES[:PRIORITIES.index(priority) + 1])
+        if not ahead and self._wait_time(tokens, now) == 0:
+            self._take(tokens, now)
+            METRICS.observe(f"llm.queue.wait.{priority}", 0.0)
+            return
+
+        waiter = _Waiter(tokens, priority, asyncio.get_running_loop().create_future(), asyncio.current_task())
+        self._queues[priority].setdefault(session, deque()).append(waiter)
+        METRICS.incr("llm.queue.throttled")
+        METRICS.observe("llm.queue.depth", self.depth)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():  # granted, but the request won't be sent
+                self.settle(tokens, 0)
+            else:
+                self._remove(waiter, session)
+            raise
+        METRICS.observe(f"llm.queue.wait.{waiter.priority}", time.monotonic() - waiter.enqueued)
+
+    def promote(self, task: asyncio.Future) -> None:
+        """Grant requests of `task` as interactive from now on, because a player is waiting on it."""
+        if not isinstance(task, asyncio.Task) or task.done() or task in self._promoted:
+            return
+        self._promoted.add(task)
+        METRICS.incr("llm.queue.promoted")
+        background, interactive = self._queues["background"], self._queues["interactive"]
+        for session, waiters in list(background.items()):
+            for waiter in [waiter for waiter in waiters if waiter.task is task]:
+                waiters.remove(waiter)
+                waiter.priority = "interactive"
+                interactive.setdefault(session, deque()).append(waiter)
+            if not waiters:
+                del background[session]
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter, session: str | None) -> None:
+        queue = self._queues[waiter.priority]
+        if (waiters := queue.get(session)) is not None and waiter in waiters:
+            waiters.remove(waiter)
+            if not waiters:
+                del queue[session]
+        self._dispatch()
+
+    def _next(self) -> tuple[OrderedDict[str | None, deque[_Waiter]], str | None] | None:
+        for priority in PRIORITIES:
+            if queue := self._queues[priority]:
+                return queue, next(iter(queue))
+        return None
+
+    def _dispatch(self) -> None:
+        """Grant waiting requests as far as the buckets allow, and come back when the next one can be granted."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while (head := self._next()) is not None:
+            queue, session = head
+            waiter = queue[session][0]
+            now = time.monotonic()
+            if waiter.future.done():  # cancelled, and its task hasn't removed it yet
+                self._pop(queue, session)
+                continue
+            if (wait := self._wait_time(waiter.tokens, now)) > 0:
+                self._timer = asyncio.get_running_loop().call_later(wait, self._dispatch)
+                return
+            self._pop(queue, session)
+            self._take(waiter.tokens, now)
+            waiter.future.set_result(None)
+
+    @staticmethod
+    def _pop(queue: OrderedDict[str | None, deque[_Waiter]], session: str | None) -> None:
+        queue[session].popleft()
+        if queue[session]:
+            queue.move_to_end(session)  # the next request of the session waits for other sessions
+        else:
+            del queue[session]
+
+    def available(self, tokens: int) -> bool:
+        """Whether a request of `tokens` tokens would be granted at once."""
+        return not self.depth and self._wait_time(tokens, time.monotonic()) == 0
+
+    def charge(self) -> None:
+        """Take a request which is sent without waiting. The bucket may go below zero, which delays later requests."""
+        if self._requests is not None:
+            self._requests.take(1, time.monotonic())
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct tokens reserved for a request with tokens it used."""
+        if self._tokens is not None:
+            self._tokens.adjust(reserved - used)
+
+    def back_off(self, seconds: float) -> None:
+        """Grant nothing for `seconds`, after the provider refused a request for its rate limit."""
+        METRICS.incr("llm.rate_limited")
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    @asynccontextmanager
+    async def slot(
+        self, messages: list[dict[str, str]], max_tokens: int | None = None,
+    ) -> AsyncIterator[Grant]:
+        """Wait for the rate limits, with priority and session of the current context, and hold the request's tokens."""
+        tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        tokens += max_tokens or DEFAULT_COMPLETION_TOKENS
+        priority = "interactive" if asyncio.current_task() in self._promoted else REQUEST_PRIORITY.get()
+        with span("llm.queue", priority=priority, tokens=tokens):
+            await self.acquire(tokens, priority, SESSION_ID.get())
+        grant = Grant(self, tokens)
+        token = _CURRENT_GRANT.set(grant)
+        try:
+            yield grant
+        finally:
+            _CURRENT_GRANT.reset(token)
+            grant.close()
+
+
+@asynccontextmanager
+async def _unlimited() -> AsyncIterator[Grant]:
+    yield _NO_GRANT
+
+
+def promote(task: asyncio.Future) -> None:
+    """Promote `task` on `REQUEST_SCHEDULER`, if it's set, because the player is now waiting on it."""
+    if (scheduler := REQUEST_SCHEDULER.get()) is not None:
+        scheduler.promote(task)
+
+
+def scheduled(messages: list[dict[str, str]], max_tokens: int | None = None):
+    """Context manager which waits for `REQUEST_SCHEDULER` before an LLM call is made, if it's set."""
+    if (scheduler := REQUEST_SCHEDULER.get()) is None:
+        return _unlimited()
+    return scheduler.slot(messages, max_tokens)
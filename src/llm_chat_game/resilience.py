@@ -0,0 +1,208 @@
+"""Deadlines, hedged requests and circuit breaker for LLM requests."""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import defaultdict, deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.tracing import current_span
+
+T = TypeVar("T")
+
+
+class LlmUnavailable(RuntimeError):
+    """Raised when a request isn't answered before its deadline, fails, or is refused by an open circuit."""
+
+
+class CircuitBreaker:
+    """Stop sending requests for a while after consecutive failures.
+
+    After `reset_timeout` seconds one trial request is let through. The circuit closes again if it succeeds.
+
+    Args:
+        failure_threshold (int): Consecutive failures which open the circuit.
+        reset_timeout (float): Seconds the circuit stays open before a trial request.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: float | None = None
+        self._trial = False
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return "closed"
+        if self._trial or time.monotonic() - self._opened_at >= self._reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        if self._opened_at is not None:
+            METRICS.incr("llm.breaker.closed")
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    def abandon(self) -> None:
+        """Forget a request which was cancelled before it succeeded or failed."""
+        self._trial = False
+
+    def record_failure(self) -> None:
+        self._failures += 1
+        if self._trial or (self._opened_at is None and self._failures >= self._failure_threshold):
+            METRICS.incr("llm.breaker.opened")
+            self._opened_at = time.monotonic()
+        self._trial = False
+
+
+class Resilience:
+    """Run LLM requests with a deadline per call type, hedging and a circuit breaker.
+
+    Call type is the name of the response format. Once `hedge_min_samples` latencies of a call type are known,
+    a duplicate request is sent when the first one is slower than their `hedge_percentile`-th percentile,
+    and whichever finishes first is used. A request which fails early is sent again in the same way.
+
+    Args:
+        deadlines (dict[str, float] | None): Seconds allowed per call type. Missing ones use `default_deadline`.
+        default_deadline (float | None): Seconds allowed for other call types. None means no deadline.
+        deadline_scale (float): Multiplier of every deadline. 0 removes deadlines.
+        hedge_percentile (float | None): Latency percentile (0 ~ 100) after which a duplicate is sent.
+            None disables hedging.
+        hedge_min_samples (int): Latencies of a call type needed before it's hedged.
+        min_hedge_delay (float): Shortest wait before a duplicate is sent.
+        breaker (CircuitBreaker | None): Circuit breaker shared by every call type.
+    """
+
+    DEADLINES: dict[str, float] = {
+        "TrpgHostResponse": 30.0,
+        "SituationSuggestionResponse": 20.0,
+        "SituationResultResponse": 30.0,
+        "SituationTurnResponse": 40.0,
+        "PhaseEndResponse": 10.0,
+    }
+    MAX_SAMPLES = 500
+
+    def __init__(
+        self,
+        deadlines: dict[str, float] | None = None,
+        default_deadline: float | None = 30.0,
+        deadline_scale: float = 1.0,
+        hedge_percentile: float | None = 95,
+        hedge_min_samples: int = 20,
+        min_hedge_delay: float = 0.5,
+        breaker: CircuitBreaker | None = None,
+    ) -> None:
+        self._deadlines = {**self.DEADLINES, **(deadlines or {})}
+        self._default_deadline = default_deadline
+        self._deadline_scale = deadline_scale
+        self._hedge_percentile = hedge_percentile
+        self._hedge_min_samples = hedge_min_samples
+        self._min_hedge_delay = min_hedge_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=self.MAX_SAMPLES))
+
+    def deadline(self, call_type: str) -> float | None:
+        deadline = self._deadlines.get(call_type, self._default_deadline)
+        if deadline is None or not self._deadline_scale:
+            return None
+        return deadline * self._deadline_scale
+
+    def hedge_delay(self, call_type: str) -> float | None:
+        """Seconds after which a duplicate of the request is sent. None means it isn't hedged."""
+        latencies = self._latencies.get(call_type)
+        if self._hedge_percentile is None or latencies is None or len(latencies) < self._hedge_min_samples:
+            return None
+        ordered = sorted(latencies)
+        idx = min(len(ordered) - 1, round(self._hedge_percentile / 100 * (len(ordered) - 1)))
+        return max(self._min_hedge_delay, ordered[idx])
+
+    async def call(
+        self,
+        call_type: str,
+        request: Callable[[], Awaitable[T]],
+        hedge: bool = True,
+        may_hedge: Callable[[], bool] | None = None,
+    ) -> T:
+        """Run `request`. Raise LlmUnavailable if it can't be answered in time.
+
+        `may_hedge` is asked when the hedge timer fires. The hedge isn't sent if it returns False.
+        """
+        if not self.breaker.allow():
+            METRICS.incr("llm.breaker.rejected")
+            msg = f"{call_type} request is refused because the circuit is open."
+            raise LlmUnavailable(msg)
+
+        start = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(self._race(call_type, request, hedge, may_hedge), self.deadline(call_type))
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            METRICS.incr("llm.timeout")
+            msg = f"{call_type} request isn't answered in {self.deadline(call_type)} seconds."
+            raise LlmUnavailable(msg) from None
+        except asyncio.CancelledError:
+            self.breaker.abandon()
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            METRICS.incr("llm.error")
+            msg = f"{call_type} request failed : {e!r}"
+            raise LlmUnavailable(msg) from e
+
+        self.breaker.record_success()
+        self._latencies[call_type].append(time.perf_counter() - start)
+        return result
+
+    async def _race(
+        self, call_type: str, request: Callable[[], Awaitable[T]], hedge: bool, may_hedge: Callable[[], bool] | None,
+    ) -> T:
+        first = asyncio.ensure_future(request())
+        pending = {first}
+        delay = self.hedge_delay(call_type) if hedge else None
+        hedged = False
+        second = ""  # "hedge" if the second request is a hedge, "retry" if the first one failed
+        try:
+            while True:
+                done, pending = await asyncio.wait(
+                    pending, timeout=None if hedged else delay, return_when=asyncio.FIRST_COMPLETED
+                )
+                error = None
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            METRICS.incr(f"llm.{second}.won")
+                        return task.result()
+                    error = task.exception()
+
+                if not hedged and error is None and may_hedge is not None and not may_hedge():
+                    METRICS.incr("llm.hedge.skipped")
+                    delay = None  # wait for the first request, which is still retried if it fails
+                    continue
+                if not hedged and (error is None or hedge):
+                    # hedge timer fired, or the first request failed early
+                    second = "hedge" if error is None else "retry"
+                    METRICS.incr(f"llm.{second}.sent")
+                    current_span().set(retries=1, retry_kind=second)
+                    pending.add(asyncio.ensure_future(request()))
+                    hedged = True
+                elif not pending:
+                    raise error
+        finally:
+            for task in pending:
+                task.cancel()
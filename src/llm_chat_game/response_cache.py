@@ -0,0 +1,103 @@
+"""Persistent cache of make_story responses."""
+
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.util import get_cache_dir, normalize_text
+
+if TYPE_CHECKING:
+    from llm_chat_game.story import StoryOption
+
+
+class StoryResponseCache:
+    """SQLite backed LRU cache with TTL for make_story responses.
+
+    `make_story` calls it in a thread so that sessions aren't blocked by sqlite. The connection is used by one thread
+    at a time.
+
+    Args:
+        path (Path | None): Database file. Default is `make_story_cache.sqlite3` under the cache directory.
+        max_entries (int): Maximum number of entries. Least recently used entries are evicted beyond it.
+        ttl (float | None): Seconds an entry stays valid. None means entries never expire.
+    """
+
+    def __init__(self, path: Path | None = None, max_entries: int = 10000, ttl: float | None = 7 * 24 * 3600) -> None:
+        self._path = path or get_cache_dir() / "make_story_cache.sqlite3"
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS story_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS story_cache_last_access ON story_cache (last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(event: str, story_id: int | str, options: list[StoryOption], user_behavior: str) -> str:
+        option_set = "\x1f".join(f"{option.description}\x1e{option.goto}" for option in options)
+        raw = "\x1d".join([event, str(story_id), option_set, normalize_text(user_behavior)])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            return self._get(key)
+
+    def _get(self, key: str) -> str | None:
+        now = time.time()
+        row = self._conn.execute("SELECT response, created_at FROM story_cache WHERE key = ?", (key,)).fetchone()
+        if row is not None and self._ttl is not None and now - row[1] > self._ttl:
+            self._conn.execute("DELETE FROM story_cache WHERE key = ?", (key,))
+            self._conn.commit()
+            row = None
+
+        if row is None:
+            self.misses += 1
+            METRICS.incr("response_cache.miss")
+            return None
+
+        self._conn.execute("UPDATE story_cache SET last_access = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        self.hits += 1
+        METRICS.incr("response_cache.hit")
+        return row[0]
+
+    def put(self, key: str, response: str) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO story_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        if self._ttl is not None:
+            self._conn.execute("DELETE FROM story_cache WHERE created_at < ?", (now - self._ttl,))
+        self._conn.execute(
+            "DELETE FROM story_cache WHERE key IN "
+            "(SELECT key FROM story_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)",
+            (self._max_entries,),
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM story_cache").fetchone()[0]
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self)}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,147 @@
+"""Validation and local repair of structured responses of LLM.
+
+A response which is truncated, has a list of the wrong length or a value out of its range is fixed here
+when it can be, so that it doesn't cost another request. Fields which can't be recovered are reported as missing,
+and only those are asked again.
+"""
+
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass, field
+from functools import cache
+from typing import Any, Literal, get_args, get_origin
+
+from pydantic import BaseModel, ValidationError, create_model
+
+SELECTION_COUNT = 3
+# shown when a response has less than SELECTION_COUNT selections
+DEFAULT_SELECTIONS = ["주변을 조심스럽게 살펴본다", "조용히 자리를 피한다", "잠시 숨어서 상황을 지켜본다"]
+# lists which have to have exactly SELECTION_COUNT items. Other lists are only trimmed.
+PADDED_LISTS = {"selections"}
+_SENTENCE_ENDS = ".!?…\"'”’"
+FOLLOW_UP_PROMPT = "응답이 중간에 끊겼거나 형식에 맞지 않습니다. 위 응답에 이어서 {fields} 항목만 JSON으로 답해주세요."
+
+
+class MalformedResponse(ValueError):
+    """Raised when a response can't be repaired."""
+
+
+@dataclass
+class Repair:
+    """Result of `repair_response`.
+
+    Args:
+        response (BaseModel | None): Valid response. None if some fields are missing.
+        data (dict[str, Any]): Fields which were recovered.
+        missing (list[str]): Fields which have to be asked again.
+        changed (bool): Whether anything was fixed.
+    """
+    response: BaseModel | None
+    data: dict[str, Any] = field(default_factory=dict)
+    missing: list[str] = field(default_factory=list)
+    changed: bool = False
+
+
+def partial_json(text: str) -> dict[str, Any] | None:
+    """Fields of a JSON object which may be cut off. The last string is kept as far as it was received."""
+    import jiter
+
+    try:
+        parsed = jiter.from_json(text.encode("utf-8"), partial_mode="trailing-strings")
+    except ValueError:
+        return None
+    return parsed if isinstance(parsed, dict) else None
+
+
+def _cut_to_sentence(text: str) -> str:
+    """Drop an unfinished sentence at the end of `text`."""
+    end = max(text.rfind(ch) for ch in _SENTENCE_ENDS)
+    return text[:end + 1].rstrip() if end >= 0 else ""
+
+
+def _repair_field(name: str, annotation: Any, val: Any, cut_off: bool) -> tuple[Any, bool]:
+    """Repaired value of a field and whether it's usable. `cut_off` means it's the last field of a truncated response."""
+    origin = get_origin(annotation)
+    if origin is Literal:
+        choices = get_args(annotation)
+        if val in choices:
+            return val, not cut_off
+        if isinstance(val, (int, float)) and not isinstance(val, bool) and not cut_off:
+            numbers = [choice for choice in choices if isinstance(choice, (int, float))]
+            if numbers:
+                return min(numbers, key=lambda choice: abs(choice - val)), True
+        return None, False
+    if origin is list:
+        if not isinstance(val, list):
+            return None, False
+        items = [item for item in val if isinstance(item, str) and item.strip()]
+        if cut_off and items:  # the last item may be cut off
+            items.pop()
+        items = items[:SELECTION_COUNT]
+        if name in PADDED_LISTS:
+            if not items:
+                return None, False
+            items += [selection for selection in DEFAULT_SELECTIONS if selection not in items][:SELECTION_COUNT - len(items)]
+        # a shorter list of other fields is still usable, e.g. fewer next selections end the phase
+        return items, True
+    if annotation is str:
+        if not isinstance(val, str):
+            return None, False
+        text = _cut_to_sentence(val) if cut_off else val
+        return text, bool(text.strip())
+    if annotation is bool:
+        return val, isinstance(val, bool) and not cut_off
+    if annotation is int:
+        return val, isinstance(val, int) and not isinstance(val, bool) and not cut_off
+    return val, not cut_off
+
+
+def repair_response(response_format: type[BaseModel], parsed: BaseModel | None, raw: str | None) -> Repair:
+    """Validate `parsed`, or recover fields from `raw` JSON text if the response couldn't be parsed."""
+    if parsed is not None:
+        data = parsed.model_dump()
+        truncated = False
+    else:
+        data = partial_json(raw) if raw else None
+        if data is None:
+            return Repair(None, {}, list(response_format.model_fields), True)
+        truncated = True
+
+    last = next(reversed(data), None) if truncated else None
+    repaired: dict[str, Any] = {}
+    missing = []
+    for name, model_field in response_format.model_fields.items():
+        if name not in data:
+            missing.append(name)
+            continue
+        val, usable = _repair_field(name, model_field.annotation, data[name], name == last)
+        if usable:
+            repaired[name] = val
+        else:
+            missing.append(name)
+    changed = truncated or repaired != {name: data.get(name) for name in repaired}
+    if missing:
+        return Repair(None, repaired, missing, True)
+
+    try:
+        response = response_format.model_validate(repaired)
+    except ValidationError as e:
+        invalid = sorted({str(error["loc"][0]) for error in e.errors() if error["loc"]})
+        return Repair(None, {name: val for name, val in repaired.items() if name not in invalid}, invalid, True)
+    return Repair(response, repaired, [], changed)
+
+
+@cache
+def missing_fields_format(response_format: type[BaseModel], missing: tuple[str, ...]) -> type[BaseModel]:
+    """Response format which has only `missing` fields of `response_format`."""
+    fields = {name: (response_format.model_fields[name].annotation, ...) for name in missing}
+    return create_model("RepairResponse", **fields)
+
+
+def follow_up_messages(messages: list[dict[str, str]], repair: Repair) -> list[dict[str, str]]:
+    """Messages which ask only the missing fields, after the fields which were recovered."""
+    return messages + [
+        {"role": "assistant", "content": json.dumps(repair.data, ensure_ascii=False)},
+        {"role": "user", "content": FOLLOW_UP_PROMPT.format(fields=", ".join(repair.missing))},
+    ]
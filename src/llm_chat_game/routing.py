@@ -0,0 +1,209 @@
+"""Model tiers and routing of LLM requests by call type."""
+
+from __future__ import annotations
+
+import json
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from llm_chat_game.metrics import METRICS
+
+
+@dataclass(frozen=True)
+class ModelTier:
+    """A model and the load it takes before requests move to the next tier of their route.
+
+    Args:
+        name (str): Name used in routes and metrics.
+        model (str): Model requested from the backend.
+        max_in_flight (int | None): Requests of the tier in flight at once. None means no limit.
+        max_latency (float | None): Seconds of 95th percentile latency of recent requests. None means no limit.
+    """
+    name: str
+    model: str
+    max_in_flight: int | None = None
+    max_latency: float | None = None
+
+
+@dataclass(frozen=True)
+class Route:
+    """How requests of a call type are sent.
+
+    Args:
+        tiers (tuple[str, ...]): Tiers to try in order. A request goes to the first one which isn't overloaded,
+            or to the last one if all of them are.
+        temperature (float | None): Sampling temperature. None means the model default.
+        max_tokens (int | None): Maximum completion tokens. None means the model default.
+    """
+    tiers: tuple[str, ...]
+    temperature: float | None = None
+    max_tokens: int | None = None
+
+
+@dataclass(frozen=True)
+class RouteChoice:
+    """Tier and request arguments selected for one request."""
+    call_type: str
+    tier: ModelTier
+    downgraded: bool
+    kwarg: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def model(self) -> str:
+        return self.tier.model
+
+    def span_attributes(self) -> dict[str, Any]:
+        return {"call_type": self.call_type, "model": self.model, "tier": self.tier.name, "downgraded": self.downgraded}
+
+
+class ModelRouter:
+    """Select a model tier per request from its call type and the load of each tier.
+
+    Call type of a request is looked up from the name of its response format in `call_types`.
+    There is no route of option choice. Free text which the local `OptionMatcher` can't match is answered by one
+    `TrpgHostResponse`, which chooses the option and narrates the player's action together, so it's narration.
+    Configuration is a dict, or a yaml or json file, of this shape. Every part is merged over `DEFAULT_CONFIG`.
+
+        tiers:
+          standard: {model: gpt-4o-mini, max_in_flight: 64, max_latency: 15}
+        routes:
+          phase_end: {tiers: [fast, standard], temperature: 0, max_tokens: 20}
+        call_types:
+          PhaseEndResponse: phase_end
+        economy_tier: fast
+
+    Args:
+        config (dict[str, Any] | None): Configuration merged over `DEFAULT_CONFIG`.
+    """
+
+    DEFAULT_CONFIG: dict[str, Any] = {
+        "tiers": {
+            "flagship": {"model": "gpt-4o", "max_in_flight": 16, "max_latency": 20.0},
+            "standard": {"model": "gpt-4o-mini", "max_in_flight": 64, "max_latency": 15.0},
+            "fast": {"model": "gpt-4.1-nano"},
+        },
+        "routes": {
+            "narration": {"tiers": ["standard", "fast"], "temperature": 0.3, "max_tokens": 1500},
+            "situation_suggestion": {"tiers": ["standard", "fast"], "max_tokens": 800},
+            "result": {"tiers": ["standard", "fast"], "max_tokens": 800},
+            # result and next suggestion in one response, so it has room for both
+            "turn": {"tiers": ["standard", "fast"], "max_tokens": 1600},
+            "phase_end": {"tiers": ["fast", "standard"], "temperature": 0.0, "max_tokens": 20},
+        },
+        "call_types": {
+            # chooses an option and narrates it in one response, so choosing isn't a call of its own
+            "TrpgHostResponse": "narration",
+            "SituationSuggestionResponse": "situation_suggestion",
+            "SituationResultResponse": "result",
+            "SituationTurnResponse": "turn",
+            "PhaseEndResponse": "phase_end",
+        },
+        # route of call types which aren't in call_types
+        "default_route": "narration",
+        # tier of every request of a session which spent much of its budget
+        "economy_tier": "fast",
+    }
+    MAX_SAMPLES = 200
+    MIN_SAMPLES = 20
+
+    def __init__(self, config: dict[str, Any] | None = None) -> None:
+        config = config or {}
+        merged = {
+            key: {**self.DEFAULT_CONFIG[key], **(config.get(key) or {})} for key in ("tiers", "routes", "call_types")
+        }
+        self.tiers = {name: ModelTier(name, **tier) for name, tier in merged["tiers"].items()}
+        self.routes = {
+            name: Route(tuple(route["tiers"]), route.get("temperature"), route.get("max_tokens"))
+            for name, route in merged["routes"].items()
+        }
+        self.call_types: dict[str, str] = merged["call_types"]
+        self.default_route: str = config.get("default_route", self.DEFAULT_CONFIG["default_route"])
+        self.economy_tier: str = config.get("economy_tier", self.DEFAULT_CONFIG["economy_tier"])
+        if self.economy_tier not in self.tiers:
+            msg = f"economy tier {self.economy_tier} is unknown."
+            raise ValueError(msg)
+
+        for name, route in self.routes.items():
+            if not route.tiers or (unknown := set(route.tiers) - set(self.tiers)):
+                msg = f"route {name} has unknown tiers {sorted(unknown)}." if route.tiers else f"route {name} has no tier."
+                raise ValueError(msg)
+        for call_type, name in [*self.call_types.items(), ("default_route", self.default_route)]:
+            if name not in self.routes:
+                msg = f"{call_type} is routed to unknown route {name}."
+                raise ValueError(msg)
+
+        self._in_flight: dict[str, int] = defaultdict(int)
+        self._latencies: dict[str, deque[float]] = defaultdict(lambda: deque(maxlen=self.MAX_SAMPLES))
+
+    @classmethod
+    def from_file(cls, path: Path | str) -> ModelRouter:
+        """Router configured by a yaml or json file."""
+        path = Path(path)
+        with path.open("r", encoding="utf-8") as f:
+            if path.suffix == ".json":
+                config = json.load(f)
+            else:
+                import yaml
+
+                config = yaml.safe_load(f)
+        if not isinstance(config, dict):
+            msg = f"{path} isn't a mapping of model routes."
+            raise ValueError(msg)
+        return cls(config)
+
+    def route(self, response_format_name: str) -> tuple[str, Route]:
+        name = self.call_types.get(response_format_name, self.default_route)
+        return name, self.routes[name]
+
+    def overloaded(self, tier: ModelTier) -> bool:
+        if tier.max_in_flight is not None and self._in_flight[tier.name] >= tier.max_in_flight:
+            return True
+        if tier.max_latency is not None:
+            latencies = self._latencies.get(tier.name)
+            if latencies is not None and len(latencies) >= self.MIN_SAMPLES:
+                ordered = sorted(latencies)
+                return ordered[round(0.95 * (len(ordered) - 1))] > tier.max_latency
+        return False
+
+    def select(self, response_format_name: str, economy: bool = False) -> RouteChoice:
+        """Tier and request arguments of the next request of a response format.
+
+        If `economy` is True, the request goes to the economy tier regardless of its route.
+        """
+        call_type, route = self.route(response_format_name)
+        tiers = [self.tiers[name] for name in route.tiers]
+        if economy:
+            tier = self.tiers[self.economy_tier]
+            METRICS.incr("llm.route.economy")
+        else:
+            tier = next((tier for tier in tiers if not self.overloaded(tier)), tiers[-1])
+        downgraded = tier is not tiers[0]
+        if downgraded:
+            METRICS.incr("llm.route.downgraded")
+            METRICS.incr(f"llm.route.downgraded.{call_type}")
+
+        kwarg: dict[str, Any] = {}
+        if route.temperature is not None:
+            kwarg["temperature"] = route.temperature
+        if route.max_tokens is not None:
+            kwarg["max_completion_tokens"] = route.max_tokens
+        return RouteChoice(call_type, tier, downgraded, kwarg)
+
+    @contextmanager
+    def track(self, choice: RouteChoice) -> Iterator[None]:
+        """Count a request of `choice` as in flight while the block runs."""
+        self._in_flight[choice.tier.name] += 1
+        try:
+            yield
+        finally:
+            self._in_flight[choice.tier.name] -= 1
+
+    def record_latency(self, choice: RouteChoice, latency: float) -> None:
+        self._latencies[choice.tier.name].append(latency)
+
+    def in_flight(self, tier_name: str) -> int:
+        return self._in_flight.get(tier_name, 0)
@@ -0,0 +1,139 @@
+"""Scheduler which decides the story of each day."""
+
+from __future__ import annotations
+
+import heapq
+import random
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from typing import Any, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from llm_chat_game.story import StoryNarrator
+
+
+@dataclass(frozen=True)
+class ScheduleHints:
+    """How a story is scheduled.
+
+    Args:
+        weight (float): Relative chance of being played earlier than others.
+        not_before_day (int): First day the story can be played.
+        group (str | None): Group of stories which share `cooldown`.
+        cooldown (int): Days which have to pass after a story of the same group is played.
+    """
+    weight: float = 1.0
+    not_before_day: int = 1
+    group: str | None = None
+    cooldown: int = 0
+
+
+@dataclass(slots=True)
+class _Entry:
+    narrator: StoryNarrator
+    hints: ScheduleHints
+    priority: float
+    available_day: int
+
+
+class DayScheduler:
+    """Weighted randomized priority queue of stories.
+
+    Every story gets an exponentially distributed priority with rate `weight` when it's added, and the eligible
+    story with the smallest one is played first. That is same as drawing stories one by one with probability
+    proportional to their weights. Stories which aren't eligible yet wait in a heap ordered by the day they can
+    be played, so scheduling a story and taking the story of a day are O(log n).
+
+    Args:
+        rng (random.Random | None): Random generator of priorities. Default is the `random` module.
+    """
+
+    def __init__(self, rng: random.Random | None = None) -> None:
+        self._rng = rng or random
+        self._seq = 0
+        self._ready: list[tuple[float, int, _Entry]] = []
+        self._waiting: list[tuple[int, float, int, _Entry]] = []
+        self._last_played: dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._ready) + len(self._waiting)
+
+    def add(self, narrator: StoryNarrator, day: int = 1, hints: ScheduleHints | None = None) -> None:
+        """Schedule `narrator` to be played on `day` or later."""
+        hints = hints or narrator.schedule_hints
+        priority = self._rng.expovariate(hints.weight)
+        self._push(_Entry(narrator, hints, priority, max(day, hints.not_before_day)))
+
+    def _push(self, entry: _Entry) -> None:
+        self._seq += 1
+        heapq.heappush(self._waiting, (entry.available_day, entry.priority, self._seq, entry))
+
+    def _cooldown_until(self, entry: _Entry) -> int:
+        if entry.hints.group is None or (last_played := self._last_played.get(entry.hints.group)) is None:
+            return 0
+        return last_played + entry.hints.cooldown + 1
+
+    def _prepare(self, day: int) -> None:
+        """Move stories which became eligible on `day` to the ready heap, so that its top can be played."""
+        while self._waiting and self._waiting[0][0] <= day:
+            _, priority, seq, entry = heapq.heappop(self._waiting)
+            heapq.heappush(self._ready, (priority, seq, entry))
+        # stories of a group in cooldown wait until it ends. Each one is moved at most once per cooldown.
+        while self._ready and (until := self._cooldown_until(self._ready[0][2])) > day:
+            _, _, entry = heapq.heappop(self._ready)
+            entry.available_day = until
+            self._push(entry)
+
+    def peek(self, day: int) -> StoryNarrator | None:
+        """Story which would be played on `day`. None if no story can be played that day."""
+        self._prepare(day)
+        return self._ready[0][2].narrator if self._ready else None
+
+    def pop(self, day: int) -> StoryNarrator | None:
+        """Take the story of `day`. None if no story can be played that day, even if some are left for later."""
+        self._prepare(day)
+        if not self._ready:
+            return None
+        _, _, entry = heapq.heappop(self._ready)
+        if entry.hints.group is not None:
+            self._last_played[entry.hints.group] = day
+        return entry.narrator
+
+    def state(self) -> dict[str, Any]:
+        """Json serializable state. Narrators are kept as their references."""
+        entries = [entry for *_, entry in self._ready] + [entry for *_, entry in self._waiting]
+        return {
+            "entries": [
+                {
+                    "narrator": entry.narrator.reference,
+                    "hints": asdict(entry.hints),
+                    "priority": entry.priority,
+                    "available_day": entry.available_day,
+                }
+                for entry in entries
+            ],
+            "last_played": dict(self._last_played),
+        }
+
+    @classmethod
+    def restore(
+        cls,
+        state: dict[str, Any],
+        narrator_from_reference: Callable[[dict[str, Any]], StoryNarrator],
+        rng: random.Random | None = None,
+    ) -> DayScheduler:
+        scheduler = cls(rng)
+        for item in state["entries"]:
+            narrator = narrator_from_reference(item["narrator"])
+            scheduler._push(_Entry(narrator, ScheduleHints(**item["hints"]), item["priority"], item["available_day"]))
+        scheduler._last_played = dict(state["last_played"])
+        return scheduler
+
+    @classmethod
+    def from_order(cls, narrators: list[StoryNarrator], rng: random.Random | None = None) -> DayScheduler:
+        """Scheduler which plays `narrators` in the given order, as far as their hints allow."""
+        scheduler = cls(rng)
+        for priority, narrator in enumerate(narrators):
+            hints = narrator.schedule_hints
+            scheduler._push(_Entry(narrator, hints, float(priority), hints.not_before_day))
+        return scheduler
@@ -0,0 +1,173 @@
+"""Headless game server which hosts many sessions in one process over WebSocket.
+
+Each WebSocket connection on `/ws` is one game session. Server first sends `{"type": "session", "session_id": ...}`,
+then json messages `{"type": "output", "text": ..., "prompt": ...}` where prompt is given when the game waits for input,
+and `{"type": "end", "survived": ...}` when the game ends.
+Client sends player's input as `{"type": "input", "text": ...}` or as plain text.
+If the server saves sessions, connecting to `/ws?session=(session id)` resumes a suspended session.
+Sessions idle for too long are closed and evicted from memory. Their snapshots are kept for resuming.
+`/health` and `/metrics` are served over HTTP.
+
+aiohttp is needed: `pip install -e .[server]`
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+from collections.abc import AsyncIterator
+
+from aiohttp import WSMsgType, web
+from llm_chat_game.game import GameSession, get_story_db_dir
+from llm_chat_game.game_io import RemoteIO
+from llm_chat_game.main import add_game_args, apply_game_args
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.session_store import SessionStore
+from llm_chat_game.story import StoryIndex
+from llm_chat_game.story.story_watcher import watch_stories
+
+
+class GameServer:
+    """Server which runs every session as a task in one event loop.
+
+    Args:
+        max_sessions (int): Maximum number of concurrent sessions. More connections are refused.
+        store (SessionStore | None): Where session snapshots are saved. Sessions can't be resumed without it.
+        idle_timeout (float | None): Seconds without player's input after which a session is evicted.
+        watch_interval (float | None): Seconds between reloads of story files. None means they aren't reloaded.
+    """
+
+    def __init__(
+        self, max_sessions: int = 500, store: SessionStore | None = None, idle_timeout: float | None = 600,
+        watch_interval: float | None = None,
+    ) -> None:
+        self._max_sessions = max_sessions
+        self._store = store
+        self._idle_timeout = idle_timeout
+        self._watch_interval = watch_interval
+        self._sessions: dict[str, GameSession] = {}
+
+    @property
+    def session_count(self) -> int:
+        return len(self._sessions)
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/ws", self.handle_session),
+            web.get("/health", self.handle_health),
+            web.get("/metrics", self.handle_metrics),
+        ])
+        app.cleanup_ctx.append(self._watch_stories)
+        return app
+
+    async def _watch_stories(self, app: web.Application) -> AsyncIterator[None]:
+        async with watch_stories(StoryIndex.for_dir(get_story_db_dir()), self._watch_interval):
+            yield
+
+    async def handle_health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok", "sessions": self.session_count})
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        sessions = self._sessions.values()
+        return web.json_response({
+            "sessions": self.session_count,
+            # spend of sessions being played, which finished sessions add to session.tokens and session.cost_usd
+            "live_tokens": sum(session.usage.tokens for session in sessions),
+            "live_cost_usd": sum(session.usage.cost for session in sessions),
+            **METRICS.snapshot(),
+        })
+
+    async def handle_session(self, request: web.Request) -> web.StreamResponse:
+        if self.session_count >= self._max_sessions:
+            METRICS.incr("server.session.refused")
+            return web.json_response({"error": "too many sessions"}, status=503)
+
+        resume = request.query.get("session")
+        if resume is not None:
+            if resume in self._sessions:
+                return web.json_response({"error": "session is already connected"}, status=409)
+            if self._store is None or (snapshot := await self._store.load_async(resume)) is None:
+                return web.json_response({"error": "unknown session"}, status=404)
+
+        ws = web.WebSocketResponse(heartbeat=30)
+        await ws.prepare(request)
+
+        async def send(text: str, prompt: str | None) -> None:
+            if not ws.closed:
+                await ws.send_json({"type": "output", "text": text, "prompt": prompt})
+
+        io = RemoteIO(send)
+        if resume is None:
+            session = GameSession(io, store=self._store)
+            METRICS.incr("server.session.started")
+        else:
+            session = GameSession.restore(io, snapshot, self._store)
+            METRICS.incr("server.session.resumed")
+        self._sessions[session.session_id] = session
+        await ws.send_json({"type": "session", "session_id": session.session_id})
+        game = asyncio.create_task(self._play(session, io, ws))
+        try:
+            while True:
+                try:
+                    msg = await ws.receive(timeout=self._idle_timeout)
+                except asyncio.TimeoutError:
+                    METRICS.incr("server.session.evicted")
+                    await ws.close()
+                    break
+                if msg.type == WSMsgType.TEXT:
+                    io.feed(self._parse_input(msg.data))
+                elif msg.type in (WSMsgType.CLOSE, WSMsgType.CLOSING, WSMsgType.CLOSED, WSMsgType.ERROR):
+                    break
+        finally:
+            game.cancel()
+            del self._sessions[session.session_id]
+        return ws
+
+    @staticmethod
+    def _parse_input(data: str) -> str:
+        try:
+            msg = json.loads(data)
+        except ValueError:
+            return data
+        if isinstance(msg, dict):
+            return str(msg.get("text", ""))
+        return data
+
+    @staticmethod
+    async def _play(session: GameSession, io: RemoteIO, ws: web.WebSocketResponse) -> None:
+        try:
+            survived = await session.play()
+        except Exception as e:
+            METRICS.incr("server.session.error")
+            await io.flush()
+            await ws.send_json({"type": "error", "message": repr(e)})
+        else:
+            METRICS.incr("server.session.finished")
+            await io.flush()
+            await ws.send_json({"type": "end", "survived": survived})
+        await ws.close()
+
+
+def get_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default="0.0.0.0")
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-sessions', type=int, default=500)
+    parser.add_argument('--save', action="store_true", help="Save sessions after every turn so that they can be resumed.")
+    parser.add_argument('--idle-timeout', type=float, default=600, help="Seconds without input before a session is evicted.")
+    add_game_args(parser)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+    apply_game_args(args)
+    store = SessionStore() if args.save else None
+    server = GameServer(args.max_sessions, store, args.idle_timeout, args.watch_stories or None)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
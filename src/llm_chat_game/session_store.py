@@ -0,0 +1,94 @@
+"""Local store of game session snapshots."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Any
+
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.util import get_cache_dir
+
+
+class SessionStore:
+    """SQLite store which keeps the latest snapshot of each session as zlib compressed json.
+
+    Sessions of a server share one event loop, so they use the `_async` methods, which compress and commit
+    in a thread. The connection is used by one thread at a time.
+
+    Args:
+        path (Path | None): Database file. Default is `sessions.sqlite3` under the cache directory.
+    """
+
+    def __init__(self, path: Path | None = None) -> None:
+        self._path = path or get_cache_dir() / "sessions.sqlite3"
+        self._conn = sqlite3.connect(self._path, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, snapshot BLOB NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def encode(snapshot: dict[str, Any]) -> bytes:
+        return zlib.compress(json.dumps(snapshot, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+    @staticmethod
+    def decode(blob: bytes) -> dict[str, Any]:
+        return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+    def _write(self, session_id: str, snapshot: dict[str, Any]) -> int:
+        """Store `snapshot` and return its compressed size."""
+        blob = self.encode(snapshot)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, snapshot, updated_at) VALUES (?, ?, ?)",
+                (session_id, blob, time.time()),
+            )
+            self._conn.commit()
+        return len(blob)
+
+    @staticmethod
+    def _saved(size: int) -> None:
+        METRICS.incr("session_store.save")
+        METRICS.observe("session_store.snapshot_bytes", size)
+
+    def save(self, session_id: str, snapshot: dict[str, Any]) -> None:
+        self._saved(self._write(session_id, snapshot))
+
+    async def save_async(self, session_id: str, snapshot: dict[str, Any]) -> None:
+        """`save` in a thread. `snapshot` mustn't change until it returns."""
+        self._saved(await asyncio.to_thread(self._write, session_id, snapshot))
+
+    def load(self, session_id: str) -> dict[str, Any] | None:
+        with self._lock:
+            row = self._conn.execute("SELECT snapshot FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        return None if row is None else self.decode(row[0])
+
+    async def load_async(self, session_id: str) -> dict[str, Any] | None:
+        return await asyncio.to_thread(self.load, session_id)
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._conn.commit()
+
+    async def delete_async(self, session_id: str) -> None:
+        await asyncio.to_thread(self.delete, session_id)
+
+    def session_ids(self, idle_for: float = 0.0) -> list[str]:
+        """Ids of sessions whose snapshot hasn't been updated for `idle_for` seconds."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id FROM sessions WHERE updated_at <= ?", (time.time() - idle_for,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
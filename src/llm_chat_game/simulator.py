@@ -0,0 +1,349 @@
+"""Monte Carlo balance simulator over the story graph.
+
+Millions of players are simulated in batches of NumPy arrays, one row per player, following the same rules as
+the game: stories are drawn by the day scheduler's weighted priorities and constraints, statuses are clamped as
+`StatusManager` does, and a player dies when health or mental hits its minimum.
+Options are chosen by a policy. Random events are played by LLM in the game, so they are modeled as phases with
+random status changes which end with a fixed probability.
+
+NumPy is needed: `pip install -e .[sim]`
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+from llm_chat_game.game import get_story_db_dir
+from llm_chat_game.status_entity import StatusManager
+from llm_chat_game.story import StoryIndex
+from llm_chat_game.story.story_index import parse_event_ref
+from llm_chat_game.story_db.random_events import situations
+
+POLICIES = ("visible", "any", "greedy")
+
+
+class StatusArray:
+    """Array form of `StatusManager`. Row i is the status of player i, with the same clamping and death rules.
+
+    Args:
+        n (int): Number of players.
+    """
+
+    def __init__(self, n: int) -> None:
+        statuses = StatusManager().statuses
+        self.names = list(statuses)
+        self.vals = np.tile(np.array([status.val for status in statuses.values()], dtype=np.int16), (n, 1))
+        self._min = np.array([status.min for status in statuses.values()], dtype=np.int16)
+        self._max = np.array([status.max for status in statuses.values()], dtype=np.int16)
+        self._life = [self.names.index(name) for name in StatusManager.LIFE_STATUS]
+
+    def add(self, rows: np.ndarray, deltas: np.ndarray) -> None:
+        self.vals[rows] = np.clip(self.vals[rows] + deltas, self._min, self._max)
+
+    def is_die(self, rows: np.ndarray) -> np.ndarray:
+        return (self.vals[rows][:, self._life] == self._min[self._life]).any(axis=1)
+
+
+@dataclass
+class StoryTables:
+    """Story graph flattened into arrays. Nodes of every file share one index space.
+
+    A slot is something the scheduler can queue: a start event, a follow-up event or a random event.
+    """
+    labels: list[str]
+    affect: np.ndarray  # (nodes, statuses) status changes applied on entering a node
+    goto: np.ndarray  # next node or -1
+    option_ptr: dict[str, np.ndarray]  # first option of a node, per policy
+    option_count: dict[str, np.ndarray]
+    option_goto: dict[str, np.ndarray]  # target node of each option, per policy
+    follow_slot: np.ndarray  # slot queued when a story ends at the node, or -1
+    slot_labels: list[str] = field(default_factory=list)
+    slot_node: np.ndarray | None = None  # start node of a slot, -1 for random events
+    slot_weight: np.ndarray | None = None
+    slot_not_before: np.ndarray | None = None
+    slot_group: np.ndarray | None = None  # index of cooldown group, -1 if none
+    slot_cooldown: np.ndarray | None = None
+    slot_initial: np.ndarray | None = None  # queued when a game starts
+    n_groups: int = 0
+
+    @classmethod
+    def build(cls, story_index: StoryIndex, status_names: list[str]) -> StoryTables:
+        graphs = {name: story_index.load(name) for name in story_index.file_names()}
+        node_of = {}
+        labels = []
+        for name, graph in graphs.items():
+            for id in graph:
+                node_of[(name, id)] = len(labels)
+                labels.append(f"{name}:{id}")
+
+        n = len(labels)
+        affect = np.zeros((n, len(status_names)), dtype=np.int16)
+        goto = np.full(n, -1, dtype=np.int32)
+        options: dict[str, list[list[int]]] = {policy: [] for policy in POLICIES}
+        follow_refs: list[str | None] = []
+        for name, graph in graphs.items():
+            for id, story in graph.items():
+                idx = node_of[(name, id)]
+                for status_name, val in story.affect_status.items():
+                    affect[idx, status_names.index(status_name)] = val
+                if story.goto is not None:
+                    goto[idx] = node_of[(name, story.goto)]
+                targets = [(node_of[(name, option.goto)], option.visible) for option in story.options]
+                options["any"].append([target for target, _ in targets])
+                options["visible"].append([target for target, visible in targets if visible])
+                follow_refs.append(story.next_event)
+
+        # greedy looks one node ahead and takes the option whose node is best for health and mental
+        score = affect @ np.array([1.0 if name in StatusManager.LIFE_STATUS else 0.1 for name in status_names])
+        options["greedy"] = [[max(targets, key=lambda target: score[target])] if targets else [] for targets in options["any"]]
+
+        option_ptr, option_count, option_goto = {}, {}, {}
+        for policy, per_node in options.items():
+            option_count[policy] = np.array([len(targets) for targets in per_node], dtype=np.int32)
+            option_ptr[policy] = np.concatenate([[0], np.cumsum(option_count[policy])[:-1]]).astype(np.int32)
+            option_goto[policy] = np.array([target for targets in per_node for target in targets], dtype=np.int32)
+
+        tables = cls(labels, affect, goto, option_ptr, option_count, option_goto, np.full(n, -1, dtype=np.int32))
+        slots: list[tuple[str, int, dict, bool]] = []
+        for name, start_id in story_index.start_events():
+            slots.append((f"{name}:{start_id}", node_of[(name, start_id)], cls._schedule(story_index, name, start_id), True))
+        follow_slot_of: dict[str, int] = {}
+        for idx, ref in enumerate(follow_refs):
+            if ref is None:
+                continue
+            if ref not in follow_slot_of:
+                name, start_id = parse_event_ref(ref)
+                follow_slot_of[ref] = len(slots)
+                slots.append((f"{name}:{start_id}", node_of[(name, start_id)], cls._schedule(story_index, name, start_id), False))
+            tables.follow_slot[idx] = follow_slot_of[ref]
+        for situation_id in range(len(situations)):
+            slots.append((f"random_event:{situation_id}", -1, {"group": "random_event"}, True))
+
+        groups = sorted({schedule.get("group") for *_, schedule, _ in slots} - {None})
+        tables.slot_labels = [label for label, *_ in slots]
+        tables.slot_node = np.array([node for _, node, _, _ in slots], dtype=np.int32)
+        tables.slot_weight = np.array([schedule.get("weight", 1.0) for _, _, schedule, _ in slots])
+        tables.slot_not_before = np.array([schedule.get("not_before_day", 1) for _, _, schedule, _ in slots], dtype=np.int32)
+        tables.slot_group = np.array(
+            [groups.index(schedule["group"]) if schedule.get("group") else -1 for _, _, schedule, _ in slots], dtype=np.int32
+        )
+        tables.slot_cooldown = np.array([schedule.get("cooldown", 0) for _, _, schedule, _ in slots], dtype=np.int32)
+        tables.slot_initial = np.array([initial for *_, initial in slots])
+        tables.n_groups = len(groups)
+        return tables
+
+    @staticmethod
+    def _schedule(story_index: StoryIndex, name: str, start_id: int) -> dict:
+        return story_index.nodes(name).get(str(start_id), {}).get("schedule", {})
+
+
+@dataclass
+class SimulationResult:
+    players: int
+    survive_day: int
+    death_day: np.ndarray  # day each player died, 0 if survived
+    node_visits: np.ndarray
+    node_deaths: np.ndarray
+    slot_deaths: np.ndarray  # deaths in random events by slot
+    slot_plays: np.ndarray
+    seconds: float
+
+    def report(self, tables: StoryTables, top: int = 10) -> str:
+        dead = self.death_day > 0
+        survived_to = (~dead) | (self.death_day > self.survive_day)
+        lines = [
+            f"players : {self.players} ({self.players / self.seconds:,.0f} players/sec)",
+            f"survived the game : {1 - dead.mean():.2%}",
+            f"survived to day {self.survive_day} : {survived_to.mean():.2%}",
+            "",
+            "death day : share of players (cumulative survival)",
+        ]
+        counts = np.bincount(self.death_day[dead], minlength=1)
+        alive = 1.0
+        for day in range(1, len(counts)):
+            alive -= counts[day] / self.players
+            lines.append(f"  day {day:>3} : {counts[day] / self.players:7.2%} ({alive:7.2%})")
+
+        lethal = [
+            (deaths, tables.labels[idx], self.node_visits[idx]) for idx, deaths in enumerate(self.node_deaths) if deaths
+        ] + [
+            (deaths, tables.slot_labels[idx], self.slot_plays[idx]) for idx, deaths in enumerate(self.slot_deaths) if deaths
+        ]
+        total_deaths = max(1, int(dead.sum()))
+        lines += ["", "most lethal nodes : deaths share (death rate per visit)"]
+        for deaths, label, visits in sorted(lethal, reverse=True)[:top]:
+            lines.append(f"  {label:<24} {deaths / total_deaths:7.2%} ({deaths / max(1, visits):7.2%})")
+        return "\n".join(lines)
+
+
+class Simulator:
+    """Simulate players in batches.
+
+    Args:
+        tables (StoryTables): Story graph.
+        policy (str): How options are chosen. "visible" picks one of the shown options at random, "any" also picks
+            hidden options which free text can reach, and "greedy" picks the option best for health and mental.
+        phase_over_rate (float): Probability that a random event ends after a phase.
+        max_phases (int): Phases after which a random event always ends.
+        delta_weights (tuple[float, ...]): Weights of -2, -1, 0, 1, 2 changes of each status in a random event phase.
+        seed (int | None): Seed of random generator.
+    """
+
+    DELTAS = np.array([-2, -1, 0, 1, 2], dtype=np.int16)
+    MAX_STEPS = 10000
+
+    def __init__(
+        self,
+        tables: StoryTables,
+        policy: str = "visible",
+        phase_over_rate: float = 0.4,
+        max_phases: int = 4,
+        delta_weights: tuple[float, ...] = (1, 2, 3, 2, 1),
+        seed: int | None = None,
+    ) -> None:
+        if policy not in POLICIES:
+            msg = f"{policy} isn't a policy. Choose one of {POLICIES}."
+            raise ValueError(msg)
+        self._tables = tables
+        self._policy = policy
+        self._phase_over_rate = phase_over_rate
+        self._max_phases = max_phases
+        self._delta_p = np.asarray(delta_weights, dtype=float) / sum(delta_weights)
+        self._rng = np.random.default_rng(seed)
+
+    def run(self, players: int, batch_size: int = 200_000, survive_day: int = 15) -> SimulationResult:
+        tables = self._tables
+        start = time.perf_counter()
+        result = SimulationResult(
+            players,
+            survive_day,
+            np.zeros(players, dtype=np.int32),
+            np.zeros(len(tables.labels), dtype=np.int64),
+            np.zeros(len(tables.labels), dtype=np.int64),
+            np.zeros(len(tables.slot_labels), dtype=np.int64),
+            np.zeros(len(tables.slot_labels), dtype=np.int64),
+            0.0,
+        )
+        for begin in range(0, players, batch_size):
+            end = min(players, begin + batch_size)
+            result.death_day[begin:end] = self._run_batch(end - begin, result)
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def _run_batch(self, n: int, result: SimulationResult) -> np.ndarray:
+        tables = self._tables
+        rng = self._rng
+        status = StatusArray(n)
+        death_day = np.zeros(n, dtype=np.int32)
+        alive = np.ones(n, dtype=bool)
+        # same as DayScheduler, exponential priorities with rate of weight and the smallest eligible one goes first
+        priority = np.where(
+            tables.slot_initial, rng.exponential(1 / tables.slot_weight, (n, len(tables.slot_weight))), np.inf
+        )
+        available = np.tile(tables.slot_not_before, (n, 1))
+        last_played = np.full((n, max(1, tables.n_groups)), -(10 ** 6), dtype=np.int32)
+        grouped = tables.slot_group >= 0
+        cooldown_until = np.where(grouped, tables.slot_cooldown, 0)
+
+        day = 1
+        while (playing := alive & np.isfinite(priority).any(axis=1)).any():
+            rows = np.flatnonzero(playing)
+            eligible = np.isfinite(priority[rows]) & (available[rows] <= day)
+            group_last = last_played[rows][:, np.maximum(tables.slot_group, 0)]
+            eligible &= ~grouped | (day > group_last + cooldown_until)
+            masked = np.where(eligible, priority[rows], np.inf)
+            slot = masked.argmin(axis=1)
+            has_story = np.isfinite(masked[np.arange(len(rows)), slot])  # others have a quiet day
+            rows, slot = rows[has_story], slot[has_story]
+            priority[rows, slot] = np.inf
+            group = tables.slot_group[slot]
+            last_played[rows[group >= 0], group[group >= 0]] = day
+
+            node = tables.slot_node[slot]
+            is_event = node >= 0
+            self._walk(rows[is_event], node[is_event], day, status, alive, death_day, priority, available, result)
+            self._random_events(rows[~is_event], slot[~is_event], day, status, alive, death_day, result)
+            day += 1
+        return death_day
+
+    def _die(self, rows: np.ndarray, day: int, alive: np.ndarray, death_day: np.ndarray) -> None:
+        alive[rows] = False
+        death_day[rows] = day
+
+    def _walk(self, rows, node, day, status, alive, death_day, priority, available, result) -> None:
+        tables = self._tables
+        ptr = tables.option_ptr[self._policy]
+        count = tables.option_count[self._policy]
+        option_goto = tables.option_goto[self._policy]
+        for _ in range(self.MAX_STEPS):
+            if not len(rows):
+                return
+            np.add.at(result.node_visits, node, 1)
+            status.add(rows, tables.affect[node])
+            dead = status.is_die(rows)
+            if dead.any():
+                self._die(rows[dead], day, alive, death_day)
+                np.add.at(result.node_deaths, node[dead], 1)
+                rows, node = rows[~dead], node[~dead]
+
+            goto = tables.goto[node]
+            has_options = (goto < 0) & (count[node] > 0)
+            choice = ptr[node] + (self._rng.random(len(node)) * np.maximum(count[node], 1)).astype(np.int32)
+            next_node = np.where(has_options, option_goto[np.minimum(choice, max(0, len(option_goto) - 1))], goto)
+
+            ended = next_node < 0
+            follow = tables.follow_slot[node[ended]]
+            queued = follow >= 0
+            if queued.any():
+                follow_rows, follow = rows[ended][queued], follow[queued]
+                priority[follow_rows, follow] = self._rng.exponential(1 / tables.slot_weight[follow])
+                available[follow_rows, follow] = np.maximum(day + 1, tables.slot_not_before[follow])
+            rows, node = rows[~ended], next_node[~ended]
+        msg = "Story graph has a loop which never ends."
+        raise RuntimeError(msg)
+
+    def _random_events(self, rows, slot, day, status, alive, death_day, result) -> None:
+        np.add.at(result.slot_plays, slot, 1)
+        for phase in range(self._max_phases):
+            if not len(rows):
+                return
+            deltas = self._rng.choice(self.DELTAS, size=(len(rows), len(status.names)), p=self._delta_p)
+            status.add(rows, deltas)
+            dead = status.is_die(rows)
+            if dead.any():
+                self._die(rows[dead], day, alive, death_day)
+                np.add.at(result.slot_deaths, slot[dead], 1)
+            go_on = ~dead & (self._rng.random(len(rows)) >= self._phase_over_rate)
+            rows, slot = rows[go_on], slot[go_on]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Simulate players over the story graph to check game balance.")
+    parser.add_argument('--players', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=200_000, help="Players simulated at once.")
+    parser.add_argument('--policy', choices=POLICIES, default="visible", help="How simulated players choose options.")
+    parser.add_argument('--phase-over-rate', type=float, default=0.4, help="Probability that a random event ends after a phase.")
+    parser.add_argument('--max-phases', type=int, default=4, help="Phases after which a random event always ends.")
+    parser.add_argument(
+        '--delta-weights', type=float, nargs=5, default=(1, 2, 3, 2, 1), metavar="W",
+        help="Weights of -2, -1, 0, 1, 2 status changes in a random event phase.",
+    )
+    parser.add_argument('--survive-day', type=int, default=15)
+    parser.add_argument('--top', type=int, default=10, help="Number of lethal nodes to show.")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+    tables = StoryTables.build(StoryIndex.for_dir(get_story_db_dir()), StatusArray(0).names)
+    simulator = Simulator(tables, args.policy, args.phase_over_rate, args.max_phases, tuple(args.delta_weights), args.seed)
+    result = simulator.run(args.players, args.batch_size, args.survive_day)
+    print(result.report(tables, args.top))
+
+
+if __name__ == "__main__":
+    main()
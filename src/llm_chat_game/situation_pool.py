@@ -0,0 +1,183 @@
+"""Pool of pre-generated opening situations of random events.
+
+Run `chat-game-pool` (or `python -m llm_chat_game.situation_pool`) to fill the pool offline before a release.
+While playing, the first phase of a random event is drawn from the pool, and the pool is refilled in background
+when a situation runs low. A refill is shared by every session, so it's accounted to the pool rather than
+to the session which happened to start it, and isn't degraded by that session's budget.
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import sqlite3
+import time
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from llm_chat_game.budget import SessionUsage
+from llm_chat_game.context_var import SESSION_ID, SESSION_RNG, SESSION_USAGE
+from llm_chat_game.game import load_sub_story_narrators
+from llm_chat_game.llm_backend import LlmUsage
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.request_scheduler import in_background
+from llm_chat_game.util import get_cache_dir
+
+if TYPE_CHECKING:
+    from llm_chat_game.story import StoryWithoutOptionNarrator
+
+
+class SituationPool:
+    """SQLite store of generated situation variants, grouped by key of the situation prompt.
+
+    A variant is drawn from the least used ones and evicted after it's drawn `max_uses` times,
+    so that players rarely see the same opening twice.
+
+    Args:
+        path (Path | None): Database file. Default is `situation_pool.sqlite3` under the cache directory.
+        max_uses (int): Times a variant is drawn before it's evicted.
+        low_water (int): Variants of a situation below which a background refill starts.
+        target (int): Variants of a situation which a refill fills up to.
+    """
+
+    def __init__(self, path: Path | None = None, max_uses: int = 3, low_water: int = 3, target: int = 10) -> None:
+        self._path = path or get_cache_dir() / "situation_pool.sqlite3"
+        self._max_uses = max_uses
+        self._low_water = low_water
+        self._target = target
+        self._refills: dict[str, asyncio.Task[int]] = {}
+        # spend of every background refill of this pool
+        self.usage = SessionUsage()
+        self._conn = sqlite3.connect(self._path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS situation_pool ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, response TEXT NOT NULL, "
+            "uses INTEGER NOT NULL DEFAULT 0, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS situation_pool_key ON situation_pool (key, uses)")
+        self._conn.commit()
+
+    def count(self, key: str) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM situation_pool WHERE key = ?", (key,)).fetchone()[0]
+
+    def keys(self) -> list[str]:
+        return [row[0] for row in self._conn.execute("SELECT DISTINCT key FROM situation_pool")]
+
+    def add(self, key: str, responses: list[str]) -> None:
+        now = time.time()
+        self._conn.executemany(
+            "INSERT INTO situation_pool (key, response, created_at) VALUES (?, ?, ?)",
+            [(key, response, now) for response in responses],
+        )
+        self._conn.commit()
+
+    def draw(self, key: str) -> str | None:
+        """Take one of the least used variants of `key`. Return None if there is none."""
+        rows = self._conn.execute(
+            "SELECT id, response, uses FROM situation_pool WHERE key = ? "
+            "AND uses = (SELECT MIN(uses) FROM situation_pool WHERE key = ?)",
+            (key, key),
+        ).fetchall()
+        if not rows:
+            METRICS.incr("situation_pool.miss")
+            return None
+
+        id, response, uses = (SESSION_RNG.get() or random).choice(rows)
+        if uses + 1 >= self._max_uses:
+            self._conn.execute("DELETE FROM situation_pool WHERE id = ?", (id,))
+            METRICS.incr("situation_pool.evicted")
+        else:
+            self._conn.execute("UPDATE situation_pool SET uses = ? WHERE id = ?", (uses + 1, id))
+        self._conn.commit()
+        METRICS.incr("situation_pool.hit")
+        return response
+
+    def prune(self, keep_keys: set[str]) -> int:
+        """Delete variants of situations which aren't in `keep_keys`. Return number of deleted variants."""
+        deleted = 0
+        for key in set(self.keys()) - keep_keys:
+            deleted += self._conn.execute("DELETE FROM situation_pool WHERE key = ?", (key,)).rowcount
+        self._conn.commit()
+        return deleted
+
+    async def fill(self, key: str, generate: Callable[[], Awaitable[str]], target: int | None = None) -> int:
+        """Generate variants of `key` concurrently until there are `target` of them. Return number of added variants."""
+        missing = (target or self._target) - self.count(key)
+        if missing <= 0:
+            return 0
+        results = await asyncio.gather(*(generate() for _ in range(missing)), return_exceptions=True)
+        responses = [result for result in results if isinstance(result, str)]
+        METRICS.incr("situation_pool.generated", len(responses))
+        METRICS.incr("situation_pool.generate_failed", len(results) - len(responses))
+        self.add(key, responses)
+        return len(responses)
+
+    def refill_if_low(self, key: str, generate: Callable[[], Awaitable[str]]) -> None:
+        """Start a background refill of `key` if it's below the low-water mark and no refill of it is running."""
+        if key in self._refills or self.count(key) >= self._low_water:
+            return
+        METRICS.incr("situation_pool.refill")
+        task = asyncio.create_task(in_background(lambda: self._refill(key, generate)))
+        self._refills[key] = task
+        task.add_done_callback(lambda _: self._refills.pop(key, None))
+
+    async def _refill(self, key: str, generate: Callable[[], Awaitable[str]]) -> int:
+        """Fill `key` outside the session which started the refill. Its spend is added to `usage` of the pool."""
+        SESSION_ID.set(None)
+        SESSION_RNG.set(None)
+        usage = SessionUsage()
+        SESSION_USAGE.set(usage)
+        try:
+            return await self.fill(key, generate)
+        finally:
+            self.usage.add(LlmUsage(usage.prompt_tokens, usage.completion_tokens, usage.cached_tokens), usage.cost)
+            METRICS.incr("situation_pool.tokens", usage.tokens)
+            METRICS.incr("situation_pool.cost_micro_usd", round(usage.cost * 1e6))
+
+    def close(self) -> None:
+        for task in self._refills.values():
+            task.cancel()
+        self._conn.close()
+
+
+def get_args():
+    from llm_chat_game.main import add_game_args  # main imports this module
+
+    parser = argparse.ArgumentParser(description="Pre-generate opening situations of every random event.")
+    parser.add_argument('--variants', type=int, default=10, help="Variants generated per situation.")
+    parser.add_argument('--concurrency', type=int, default=8, help="Situations generated at once.")
+    parser.add_argument('--prune', action="store_true", help="Delete variants of situations which no longer exist.")
+    add_game_args(parser)
+    return parser.parse_args()
+
+
+async def build_pool(pool: SituationPool, variants: int, concurrency: int = 8, prune: bool = False) -> None:
+    narrators = load_sub_story_narrators() or []
+    if prune:
+        print(f"pruned : {pool.prune({narrator.pool_key for narrator in narrators})}")
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fill(narrator: StoryWithoutOptionNarrator) -> None:
+        async with semaphore:
+            added = await pool.fill(narrator.pool_key, narrator.generate_opening, variants)
+            print(f"situation {narrator.situation_id} : +{added} ({pool.count(narrator.pool_key)} in pool)")
+
+    await asyncio.gather(*(fill(narrator) for narrator in narrators))
+
+
+def main() -> None:
+    from llm_chat_game.main import apply_game_args  # main imports this module
+
+    args = get_args()
+    apply_game_args(args)
+    pool = SituationPool(target=args.variants)
+    try:
+        asyncio.run(build_pool(pool, args.variants, args.concurrency, args.prune))
+    finally:
+        pool.close()
+
+
+if __name__ == "__main__":
+    main()
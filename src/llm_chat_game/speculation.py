@@ -0,0 +1,87 @@
+"""Requests made speculatively for the choices shown to a player, before the player chooses."""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import Awaitable, Callable
+from typing import Generic, TypeVar
+
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.request_scheduler import in_background, promote
+
+T = TypeVar("T")
+
+
+class SpeculationBudget:
+    """Speculative requests a session may send. Speculation stops once they are used up.
+
+    Args:
+        limit (int): Speculative requests allowed.
+        used (int): Requests already sent, which is restored when a session is resumed.
+    """
+
+    def __init__(self, limit: int, used: int = 0) -> None:
+        self.limit = limit
+        self.used = used
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.limit - self.used)
+
+    def take(self, n: int) -> int:
+        """Use up to `n` requests of the budget and return how many are granted."""
+        granted = min(n, self.remaining)
+        self.used += granted
+        if granted < n:
+            METRICS.incr("speculation.budget_exhausted")
+        return granted
+
+
+class Speculation(Generic[T]):
+    """Requests for each choice, started at once in background. Only the chosen one is used.
+
+    Args:
+        requests (list[Callable[[], Awaitable[T]]]): Request of each choice, in the order of the choices.
+    """
+
+    def __init__(self, requests: list[Callable[[], Awaitable[T]]]) -> None:
+        # the player isn't waiting for them yet, so they give way to requests which a player is waiting for
+        self._tasks = [asyncio.ensure_future(in_background(request)) for request in requests]
+        METRICS.incr("speculation.sent", len(self._tasks))
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    async def take(self, choice: int | None) -> T | None:
+        """Result of the request of `choice`, and cancel the others.
+
+        None if `choice` wasn't speculated or its request failed, in which case it has to be requested normally.
+        """
+        task = self._tasks[choice] if choice is not None and 0 <= choice < len(self._tasks) else None
+        self.cancel(keep=task)
+        if task is None:
+            METRICS.incr("speculation.miss")
+            return None
+        promote(task)  # the player is waiting on it now
+        try:
+            result = await task
+        except asyncio.CancelledError:
+            if not task.cancelled():  # the caller itself is being cancelled
+                raise
+            return None
+        except Exception:
+            METRICS.incr("speculation.failed")
+            return None
+        METRICS.incr("speculation.hit")
+        return result
+
+    def cancel(self, keep: asyncio.Future | None = None) -> None:
+        """Cancel every request except `keep`. Requests already answered are discarded."""
+        for task in self._tasks:
+            if task is not keep:
+                if not task.done():
+                    task.cancel()
+                    METRICS.incr("speculation.cancelled")
+                elif not task.cancelled() and task.exception() is None:
+                    METRICS.incr("speculation.discarded")
+        self._tasks = [task for task in self._tasks if task is keep] if keep is not None else []
@@ -0,0 +1,58 @@
+"""Report of import cost at startup, made from `python -X importtime`."""
+
+from __future__ import annotations
+
+import re
+import subprocess
+import sys
+from collections import defaultdict
+from dataclasses import dataclass
+
+_LINE = re.compile(r"import time:\s*(\d+)\s*\|\s*(\d+)\s*\|(\s*)(\S+)")
+
+
+@dataclass
+class ImportTime:
+    module: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def measure_imports(module: str) -> list[ImportTime]:
+    """Import `module` in a fresh interpreter and return time of every module imported by it."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if proc.returncode != 0:
+        msg = f"importing {module} failed :\n{proc.stderr[-2000:]}"
+        raise RuntimeError(msg)
+    times = []
+    for line in proc.stderr.splitlines():
+        if (ret := _LINE.match(line)) is not None:
+            self_us, cumulative_us, indent, name = ret.groups()
+            times.append(ImportTime(name, int(self_us), int(cumulative_us), len(indent) // 2))
+    return times
+
+
+def format_report(times: list[ImportTime], top: int = 15) -> str:
+    """Total import time, time per top level package and the slowest modules."""
+    total = sum(time.self_us for time in times)
+    per_package: dict[str, int] = defaultdict(int)
+    for time in times:
+        per_package[time.module.split(".")[0]] += time.self_us
+
+    lines = [f"total import time : {total / 1000:.1f} ms ({len(times)} modules)", "", "by package :"]
+    for package, self_us in sorted(per_package.items(), key=lambda item: -item[1])[:top]:
+        lines.append(f"  {package:<32} {self_us / 1000:8.1f} ms  {self_us / total:6.1%}")
+    lines += ["", "slowest modules (self) :"]
+    for time in sorted(times, key=lambda time: -time.self_us)[:top]:
+        lines.append(f"  {time.module:<48} {time.self_us / 1000:8.1f} ms")
+    return "\n".join(lines)
+
+
+def startup_report(module: str = "llm_chat_game.main", top: int = 15) -> str:
+    return format_report(measure_imports(module), top)
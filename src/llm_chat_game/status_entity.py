@@ -41,6 +41,9 @@ class Status:
         elif self._val < self._min:
             self._val = self._min
 
+    def set(self, val: int) -> None:
+        self._val = min(self._max, max(self._min, val))
+
     def set_to_max(self) -> None:
         self._val = self._max
 
@@ -61,6 +64,10 @@ class StatusManager:
             "money" : Status(name="money"),
         }
         
+    @property
+    def statuses(self) -> dict[str, Status]:
+        return dict(self._statuses)
+
     def add_status(self, status_name: str, val: int = 1) -> None:
         if status_name not in self._statuses:
             msg = f"{status_name} doesn't exist."
@@ -75,6 +82,19 @@ class StatusManager:
 
         self._statuses[status_name].subtract(val)
     
+    def to_dict(self) -> dict[str, int]:
+        return {status_name: status.val for status_name, status in self._statuses.items()}
+
+    @classmethod
+    def from_dict(cls, statuses: dict[str, int]) -> StatusManager:
+        status_manager = cls()
+        for status_name, val in statuses.items():
+            if status_name not in status_manager._statuses:
+                msg = f"{status_name} doesn't exist."
+                raise ValueError(msg)
+            status_manager._statuses[status_name].set(val)
+        return status_manager
+
     def is_die(self) -> bool:
         for status_name in self.LIFE_STATUS:
             if self._statuses[status_name].val == self._statuses[status_name].min:
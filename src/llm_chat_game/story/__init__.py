@@ -6,5 +6,6 @@ from .story import (
     StoryWithoutOptionNarrator
 )
 from .story_entity import Story, StoryOption
+from .story_index import StoryIndex
 
-__all__ = ["StoryNarrator", "StoryWithOptionNarrator", "StoryWithoutOptionNarrator","Story", "StoryOption"]
+__all__ = ["StoryNarrator", "StoryWithOptionNarrator", "StoryWithoutOptionNarrator","Story", "StoryOption", "StoryIndex"]
@@ -0,0 +1,120 @@
+"""Conversation with LLM kept under a token budget."""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any
+
+from llm_chat_game.util import estimate_tokens
+
+
+@dataclass
+class _Exchange:
+    """Messages from a user message until the next one."""
+    messages: list[dict[str, str]] = field(default_factory=list)
+    tokens: int = 0
+
+    def summary_line(self, max_len: int) -> str:
+        behavior = next((message["content"] for message in self.messages if message["role"] == "user"), "")
+        result = next((message["content"] for message in self.messages if message["role"] == "assistant"), "")
+        if len(result) > max_len:
+            result = result[:max_len] + "..."
+        return f"- 행동: {behavior.strip()} / 결과: {result.strip()}"
+
+
+class Conversation:
+    """Messages of a story which are sent to LLM.
+
+    Static prefix (messages before the first user message) and the last `keep_exchanges` exchanges are kept verbatim.
+    Once estimated tokens exceed `token_budget`, older exchanges are folded into a rolling summary.
+
+    Args:
+        prefix (list[dict[str, str]]): Messages which are always sent first.
+        token_budget (int | None): Estimated tokens allowed. None means no limit.
+        keep_exchanges (int): Number of recent exchanges which are never folded.
+        summary_result_len (int): Characters of a result kept in the summary.
+    """
+
+    SUMMARY_HEADER = "## 지금까지의 진행 요약 ##\n"
+
+    def __init__(
+        self,
+        prefix: list[dict[str, str]],
+        token_budget: int | None = None,
+        keep_exchanges: int = 2,
+        summary_result_len: int = 120,
+    ) -> None:
+        self._prefix = list(prefix)
+        self._prefix_tokens = sum(estimate_tokens(message["content"]) for message in self._prefix)
+        self._token_budget = token_budget
+        self._keep_exchanges = keep_exchanges
+        self._summary_result_len = summary_result_len
+        self._summary_lines: list[str] = []
+        self._summary_tokens = 0
+        self._exchanges: list[_Exchange] = []
+
+    def append(self, role: str, content: str) -> None:
+        if role == "user":
+            self._exchanges.append(_Exchange())
+        elif not self._exchanges:
+            self._prefix.append({"role": role, "content": content})
+            self._prefix_tokens += estimate_tokens(content)
+            return
+        exchange = self._exchanges[-1]
+        exchange.messages.append({"role": role, "content": content})
+        exchange.tokens += estimate_tokens(content)
+        self._compact()
+
+    def set_token_budget(self, token_budget: int | None) -> None:
+        """Change the budget. Exchanges are folded at once if the conversation is over the new budget."""
+        self._token_budget = token_budget
+        self._compact()
+
+    @property
+    def token_count(self) -> int:
+        return self._prefix_tokens + self._summary_tokens + sum(exchange.tokens for exchange in self._exchanges)
+
+    @property
+    def messages(self) -> list[dict[str, str]]:
+        messages = list(self._prefix)
+        if self._summary_lines:
+            messages.append({"role": "system", "content": self.SUMMARY_HEADER + "\n".join(self._summary_lines)})
+        for exchange in self._exchanges:
+            messages.extend(exchange.messages)
+        return messages
+
+    def state(self) -> dict[str, Any]:
+        """Json serializable state except the prefix, which is given by the owner again when restored."""
+        return {
+            "summary": list(self._summary_lines),
+            "exchanges": [list(exchange.messages) for exchange in self._exchanges],
+        }
+
+    def fork(self) -> Conversation:
+        """Copy which can be appended to without changing this conversation."""
+        forked = Conversation(self._prefix, self._token_budget, self._keep_exchanges, self._summary_result_len)
+        forked.restore(self.state())
+        return forked
+
+    def restore(self, state: dict[str, Any]) -> None:
+        self._summary_lines = list(state["summary"])
+        self._summary_tokens = 0
+        if self._summary_lines:
+            self._summary_tokens = estimate_tokens(self.SUMMARY_HEADER) + sum(map(estimate_tokens, self._summary_lines))
+        self._exchanges = [
+            _Exchange(list(messages), sum(estimate_tokens(message["content"]) for message in messages))
+            for messages in state["exchanges"]
+        ]
+
+    def _compact(self) -> None:
+        if self._token_budget is None:
+            return
+        while self.token_count > self._token_budget and len(self._exchanges) > self._keep_exchanges:
+            line = self._exchanges.pop(0).summary_line(self._summary_result_len)
+            if not self._summary_lines:
+                self._summary_tokens += estimate_tokens(self.SUMMARY_HEADER)
+            self._summary_lines.append(line)
+            self._summary_tokens += estimate_tokens(line)
+        # summary itself rolls over, the oldest lines go first
+        while self.token_count > self._token_budget and len(self._summary_lines) > 1:
+            self._summary_tokens -= estimate_tokens(self._summary_lines.pop(0))
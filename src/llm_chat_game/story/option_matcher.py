@@ -0,0 +1,65 @@
+"""Local matcher which maps free text to a story option without LLM."""
+
+from __future__ import annotations
+
+import math
+from collections import Counter
+from typing import TYPE_CHECKING
+
+from llm_chat_game.util import normalize_text
+
+if TYPE_CHECKING:
+    from llm_chat_game.story.story_entity import StoryOption
+
+
+class OptionMatcher:
+    """Character n-gram TF-IDF matcher over options of a story.
+
+    Args:
+        options (list[StoryOption]): All options of a story including invisible ones.
+    """
+
+    NGRAM_SIZES: tuple[int, ...] = (2, 3)
+
+    def __init__(self, options: list[StoryOption]) -> None:
+        docs = [self._ngrams(option.description) for option in options]
+        doc_freq = Counter(gram for doc in docs for gram in doc)
+        # n-grams which don't appear in any option get the highest idf, so unrelated text lowers similarity
+        self._unknown_idf = math.log(1 + len(docs)) + 1
+        self._idf = {gram: math.log((1 + len(docs)) / (1 + cnt)) + 1 for gram, cnt in doc_freq.items()}
+        self._vectors = [self._vectorize(doc) for doc in docs]
+
+    @classmethod
+    def _ngrams(cls, text: str) -> Counter[str]:
+        grams: Counter[str] = Counter()
+        for word in normalize_text(text).split():
+            padded = f" {word} "
+            for n in cls.NGRAM_SIZES:
+                grams.update(padded[i:i+n] for i in range(len(padded) - n + 1))
+        return grams
+
+    def _vectorize(self, grams: Counter[str]) -> dict[str, float]:
+        vector = {gram: cnt * self._idf.get(gram, self._unknown_idf) for gram, cnt in grams.items()}
+        norm = math.sqrt(sum(val * val for val in vector.values()))
+        return {gram: val / norm for gram, val in vector.items()} if norm else {}
+
+    def scores(self, text: str) -> list[float]:
+        """Cosine similarity between text and each option."""
+        query = self._vectorize(self._ngrams(text))
+        return [sum(val * vector.get(gram, 0.0) for gram, val in query.items()) for vector in self._vectors]
+
+    def match(self, text: str, threshold: float, margin: float = 0.2) -> int | None:
+        """Return index of the option which text clearly means. If it's ambiguous, return None.
+
+        Text clearly means an option when its similarity is at least `threshold` and
+        it's higher than the second best one by at least `margin`.
+        """
+        scores = self.scores(text)
+        if not scores:
+            return None
+        ranked = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)
+        best = scores[ranked[0]]
+        second = scores[ranked[1]] if len(ranked) > 1 else 0.0
+        if best >= threshold and best - second >= margin:
+            return ranked[0]
+        return None
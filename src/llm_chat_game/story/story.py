@@ -2,30 +2,80 @@
 
 from __future__ import annotations
 
+import asyncio
+import functools
+import hashlib
 import random
-import re
 from abc import ABC, abstractmethod
 from pathlib import Path
 from pprint import pprint
-from typing import List, Literal
-
-import yaml
-from llm_chat_game.context_var import DEBUG_MODE
-from llm_chat_game.gpt_agent import GptAgent
+from typing import Any, List, Literal, TYPE_CHECKING
+
+from llm_chat_game.context_var import (
+    CONTEXT_TOKEN_BUDGET,
+    DEBUG_MODE,
+    FAST_PATH_THRESHOLD,
+    SESSION_RNG,
+    SESSION_USAGE,
+    SITUATION_POOL,
+    SPECULATION_BUDGET,
+    STREAM_NARRATION,
+    TURN_PROTOCOL,
+)
+from llm_chat_game.budget import session_degraded
+from llm_chat_game.gpt_agent import GptAgent, LiveNarration, TrpgHostResponse
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.request_scheduler import in_background, promote
+from llm_chat_game.resilience import LlmUnavailable
+from llm_chat_game.scheduler import ScheduleHints
+from llm_chat_game.speculation import Speculation
 from llm_chat_game.status_entity import StatusManager
+from llm_chat_game.story.conversation import Conversation
+from llm_chat_game.story.option_matcher import OptionMatcher
 from llm_chat_game.story.story_entity import Story, StoryOption
+from llm_chat_game.story.story_index import StoryIndex, StoryVersion, parse_event_ref
+from llm_chat_game.story.story_store import StoryGraph, StoryNode
+from llm_chat_game.tracing import span
 from pydantic import BaseModel
-from rich.console import Console
 from rich.panel import Panel
 
+if TYPE_CHECKING:
+    from llm_chat_game.game_io import GameIO
+    from rich.console import Console
+
 
 class StoryNarrator(ABC):
     """Class which progresses a story."""
 
     @abstractmethod
-    def play_story(self, user_status: StatusManager) -> StoryWithOptionNarrator | None:
+    async def play_story(self, user_status: StatusManager, io: GameIO) -> StoryWithOptionNarrator | None:
         pass
-    
+
+    def prefetch(self) -> None:
+        """Start requesting whatever the story needs first, before it is played. Default does nothing."""
+
+    def cancel_prefetch(self) -> None:
+        """Throw away a prefetch started by `prefetch`. Default does nothing."""
+
+    @property
+    @abstractmethod
+    def reference(self) -> dict[str, Any]:
+        """Json serializable reference from which the narrator can be made again."""
+
+    @property
+    def schedule_hints(self) -> ScheduleHints:
+        """How the story is scheduled among the others. Default is equal weight without constraints."""
+        return ScheduleHints()
+
+    @property
+    def progress(self) -> dict[str, Any] | None:
+        """Json serializable progress of the story being played. It's updated whenever player's input is waited."""
+        return self._progress
+
+    def restore_progress(self, progress: dict[str, Any] | None) -> None:
+        """Make the next `play_story` resume from `progress` instead of the beginning."""
+        self._progress = progress
+
 
 class SituationSuggestionResponse(BaseModel):
     situation: str
@@ -43,6 +93,17 @@ class PhaseEndResponse(BaseModel):
     is_phase_over: bool
 
 
+class SituationTurnResponse(BaseModel):
+    """Result, phase end decision and next situation of a turn in one response."""
+    result: str
+    health: Literal[-2, -1, 0, 1, 2]
+    mental: Literal[-2, -1, 0, 1, 2]
+    money: Literal[-2, -1, 0, 1, 2]
+    is_phase_over: bool
+    next_situation: str
+    next_selections: List[str]
+
+
 class StoryWithoutOptionNarrator(StoryNarrator):
     """ Class which progresses a story. There is no option to select. LLM automatically creates result of the story.
     This class is for story which does not belong to main story branch.
@@ -125,61 +186,248 @@ class StoryWithoutOptionNarrator(StoryNarrator):
 그 외의 입력은 절대로 하지 마세요.
 """
     
-    def __init__(self, situation: str, end_condition: str):
+    def _turn_instructions(cls):
+        return """
+## 다음 상황 ##
+결과를 알려준 뒤, 아래의 ##상황 종료 조건## 에 따라 이야기가 끝났는지 판단해 is_phase_over 에 입력해주세요.
+이야기가 계속되어야 한다면, 결과에 이어지는 다음 상황을 next_situation 에, 선택지 3개를 next_selections 에 입력해주세요.
+이야기가 끝났다면, next_situation 은 빈 문자열로, next_selections 는 빈 목록으로 입력해주세요.
+"""
+
+    SELECTION_KEYS: dict[str, int] = {"A": 0, "a": 0, "1": 0, "B": 1, "b": 1, "2": 1, "C": 2, "c": 2, "3": 2}
+
+    def __init__(self, situation: str, end_condition: str, situation_id: int | None = None):
         self._gpt_agent = GptAgent()
         self._situation = situation
         self._end_condition = end_condition
-        self.console = Console()
+        self._situation_id = situation_id
+        self._progress: dict[str, Any] | None = None
+        self._prefetched: asyncio.Task[SituationSuggestionResponse] | None = None
+        # introduction and restriction are same for every random event. Keeping them as the first message
+        # makes them a byte-identical prefix which provider-side prompt caching can reuse.
+        self._opening = (
+            {"role": "system", "content": self._introduction()  + self._restriction()},
+            {"role": "system", "content": self._situation + self._start()},
+        )
+
+    def _opening_messages(self) -> list[dict[str, str]]:
+        return [dict(message) for message in self._opening]
+
+    @property
+    def situation_id(self) -> int | None:
+        return self._situation_id
+
+    @property
+    def pool_key(self) -> str:
+        """Key of the opening in situation pool. It changes whenever the opening prompt changes."""
+        raw = "\x1d".join(message["content"] for message in self._opening)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    async def generate_opening(self) -> str:
+        """Request an opening situation and return it as json, which is how situation pool keeps it."""
+        res = await self._gpt_agent.talk(self._opening_messages(), response_format=SituationSuggestionResponse)
+        return res.model_dump_json()
+
+    def _draw_opening(self) -> SituationSuggestionResponse | None:
+        """Take an opening from situation pool, and start refilling it if it runs low."""
+        if (pool := SITUATION_POOL.get()) is None:
+            return None
+        drawn = pool.draw(self.pool_key)
+        pool.refill_if_low(self.pool_key, self.generate_opening)
+        return None if drawn is None else SituationSuggestionResponse.model_validate_json(drawn)
+
+    @property
+    def reference(self) -> dict[str, Any]:
+        if self._situation_id is None:
+            msg = "Random event narrator without situation_id can't be referenced."
+            raise RuntimeError(msg)
+        return {"kind": "random_event", "situation_id": self._situation_id}
 
-    def play_story(self, user_status: StatusManager) -> StoryWithOptionNarrator | None:
+    @property
+    def schedule_hints(self) -> ScheduleHints:
+        return ScheduleHints(group="random_event")
+
+    def prefetch(self) -> None:
+        """Request the opening situation in background. It is consumed by the next `play_story` call.
+
+        Nothing is requested if situation pool has an opening for the story.
+        """
+        if (pool := SITUATION_POOL.get()) is not None and pool.count(self.pool_key) > 0:
+            return
+        if self._prefetched is None:
+            messages = self._opening_messages()
+            self._prefetched = asyncio.create_task(in_background(
+                lambda: self._gpt_agent.talk(messages, response_format=SituationSuggestionResponse)
+            ))
+
+    def cancel_prefetch(self) -> None:
+        if self._prefetched is not None:
+            self._prefetched.cancel()
+            self._prefetched = None
+
+    async def _take_prefetched(self) -> SituationSuggestionResponse | None:
+        task, self._prefetched = self._prefetched, None
+        if task is None:
+            return None
+        promote(task)  # the player is waiting on it now
+        try:
+            return await task
+        except asyncio.CancelledError:
+            if not task.cancelled():  # play_story itself is being cancelled
+                raise
+        except Exception as e:
+            if DEBUG_MODE.get():
+                pprint(f"prefetch failed : {e!r}")
+        return None
+
+    async def play_story(self, user_status: StatusManager, io: GameIO) -> StoryWithOptionNarrator | None:
         """Play the story. If user dies during story, return False. If not, return True."""
-        prompt = self._introduction()  + self._restriction() + self._situation + self._start()
+        console = io.console
+        combined = TURN_PROTOCOL.get() == "combined"
         is_phase_over = False
-        messages = []
-        messages.append({"role": "system", "content": prompt})
-        phase_count = 0
-        while not is_phase_over:
-            res: SituationSuggestionResponse = self._gpt_agent.talk(messages, response_format=SituationSuggestionResponse)
-            self.console.print(Panel(res.situation), style="bold")
-            self.console.print("1 : " + res.selections[0], style="underline")
-            self.console.print("2 : " + res.selections[1], style="underline")
-            self.console.print("3 : " + res.selections[2], style="underline")
-            print("\n")
-            user_input = input("당신의 행동을 입력해주세요. ")
-            
-            
-            if user_input.strip() in ['A','a','1']:
-                user_ans = res.selections[0]
-            elif user_input.strip() in ['B','b','2']:
-                user_ans = res.selections[1]
-            elif user_input.strip() in ['C','c','3']:
-                user_ans = res.selections[2]
+        conversation = Conversation(self._opening_messages(), CONTEXT_TOKEN_BUDGET.get())
+        if (progress := self._progress) is not None:
+            conversation.restore(progress["conversation"])
+            phase_count = progress["phase_count"]
+            suggestion = SituationSuggestionResponse(**progress["suggestion"])
+        else:
+            phase_count = 0
+            if (suggestion := self._draw_opening()) is not None:
+                self.cancel_prefetch()
             else:
-                user_ans = user_input
-            self.console.print(user_ans, style="italic", end="\n\n")
-
-            result_prompt = self._result() if random.randint(1, 10) <= 7 else self._twist()
-            if phase_count > 2:
+                suggestion = await self._take_prefetched()
+        while not is_phase_over:
+            if suggestion is None:
+                try:
+                    suggestion = await self._gpt_agent.talk(conversation.messages, response_format=SituationSuggestionResponse)
+                except LlmUnavailable as e:
+                    if DEBUG_MODE.get():
+                        pprint(f"situation isn't made : {e}")
+                    console.print("주변이 다시 조용해졌습니다. 당신은 가던 길을 계속 갑니다.", style="italic")
+                    break
+            res: SituationSuggestionResponse = suggestion
+            suggestion = None
+            if (session_usage := SESSION_USAGE.get()) is not None:
+                conversation.set_token_budget(session_usage.context_budget(CONTEXT_TOKEN_BUDGET.get()))
+            with span("render", what="situation"):
+                console.print(Panel(res.situation), style="bold")
+                console.print("1 : " + res.selections[0], style="underline")
+                console.print("2 : " + res.selections[1], style="underline")
+                console.print("3 : " + res.selections[2], style="underline")
+                console.print("\n")
+            self._progress = {
+                "phase_count": phase_count,
+                "conversation": conversation.state(),
+                "suggestion": res.model_dump(),
+            }
+            # result prompt is decided before the choice, so that results of the selections can be requested meanwhile
+            twisted = (SESSION_RNG.get() or random).randint(1, 10) > 7 and not session_degraded("no_twist")
+            result_prompt = self._twist() if twisted else self._result()
+            # once the session is over its budget, the result ends the event without asking whether it's over
+            forced_end = session_degraded("end_phase")
+            if phase_count > 2 or forced_end:
                 result_prompt += self._end_result_instructions()
-            messages.append({"role": "user", "content": user_ans})
-            messages.append({"role": "system", "content": result_prompt + self._restriction()})
-
-            res: SituationResultResponse = self._gpt_agent.talk(messages, response_format=SituationResultResponse)
-            for status_name in ("health", "mental", "money"):
-                if (status_change := getattr(res, status_name)) != 0:
-                    print(f"{status_name} : {status_change:+}")
-                    user_status.add_status(status_name, status_change)
-
-            self.console.print(Panel(res.result))
-            self.console.print(user_status, style="italic")
+            if combined:
+                result_prompt += self._turn_instructions() + self._end_condition
+            result_prompt += self._restriction()
+            response_format = SituationTurnResponse if combined else SituationResultResponse
+            speculation = self._speculate(conversation, res.selections, result_prompt, response_format)
+            try:
+                user_input = await io.input("당신의 행동을 입력해주세요. ")
+            except BaseException:
+                if speculation is not None:
+                    speculation.cancel()
+                raise
+
+            choice = self.SELECTION_KEYS.get(user_input.strip())
+            user_ans = res.selections[choice] if choice is not None else user_input
+            console.print(user_ans, style="italic", end="\n\n")
+
+            phase_count += 1
+            METRICS.incr(f"random_event.phase.{TURN_PROTOCOL.get()}")
+            conversation.append("user", user_ans)
+            conversation.append("system", result_prompt)
+
+            live = LiveNarration(console, "result") if STREAM_NARRATION.get() else None
+            speculated = await speculation.take(choice) if speculation is not None else None
+            if speculated is not None:
+                live = None  # already answered, so there is nothing to stream
+                res = speculated
+            else:
+                res: SituationResultResponse | SituationTurnResponse = await self._gpt_agent.talk(
+                    conversation.messages, live=live, response_format=response_format,
+                    fallback=lambda: self._fallback_result(response_format),
+                )
+            with span("status_update"):
+                for status_name in ("health", "mental", "money"):
+                    if (status_change := getattr(res, status_name)) != 0:
+                        console.print(f"{status_name} : {status_change:+}")
+                        user_status.add_status(status_name, status_change)
+
+            with span("render", what="result"):
+                if live is None:
+                    console.print(Panel(res.result))
+                console.print(user_status, style="italic")
             
             if user_status.is_die():
+                self._progress = None
                 return
 
-            messages.append({"role": "assistant", "content": res.result})
-            messages.append({"role":"system", "content": self._phase_end_instructions() + self._end_condition})
-            res: PhaseEndResponse = self._gpt_agent.talk(messages, response_format=PhaseEndResponse)
+            conversation.append("assistant", res.result)
+            if forced_end:
+                METRICS.incr("budget.forced_phase_end")
+                break
+            if combined:
+                is_phase_over = res.is_phase_over or len(res.next_selections) < 3
+                if not is_phase_over:
+                    suggestion = SituationSuggestionResponse(situation=res.next_situation, selections=res.next_selections)
+                    conversation.append("assistant", res.next_situation)
+                continue
+
+            conversation.append("system", self._phase_end_instructions() + self._end_condition)
+            res: PhaseEndResponse = await self._gpt_agent.talk(
+                conversation.messages, response_format=PhaseEndResponse,
+                fallback=lambda: PhaseEndResponse(is_phase_over=True),  # end the phase rather than stall
+            )
             is_phase_over = res.is_phase_over
+        self._progress = None
+
+    def _speculate(
+        self,
+        conversation: Conversation,
+        selections: list[str],
+        result_prompt: str,
+        response_format: type[SituationResultResponse | SituationTurnResponse],
+    ) -> Speculation[SituationResultResponse | SituationTurnResponse] | None:
+        """Request results of `selections` in background while the player chooses.
+
+        Each request has the same messages as the one which is made if the player picks that selection.
+        None if speculation is off or the session used up its budget.
+        """
+        if (budget := SPECULATION_BUDGET.get()) is None or session_degraded("no_twist"):
+            return None
+        selections = selections[:3]  # only the first three can be chosen by their keys
+        if not (granted := budget.take(len(selections))):
+            return None
+        requests = []
+        for selection in selections[:granted]:
+            forked = conversation.fork()
+            forked.append("user", selection)
+            forked.append("system", result_prompt)
+            requests.append(functools.partial(self._gpt_agent.talk, forked.messages, response_format=response_format))
+        return Speculation(requests)
+
+    @staticmethod
+    def _fallback_result(
+        response_format: type[SituationResultResponse | SituationTurnResponse],
+    ) -> SituationResultResponse | SituationTurnResponse:
+        """Result which ends the phase without changing status, used when LLM can't answer."""
+        result = "잠시 망설이는 사이 상황이 흐지부지 끝나버렸습니다."
+        if response_format is SituationTurnResponse:
+            return SituationTurnResponse(
+                result=result, health=0, mental=0, money=0, is_phase_over=True, next_situation="", next_selections=[]
+            )
+        return SituationResultResponse(result=result, health=0, mental=0, money=0)
 
 
 class StoryWithOptionNarrator(StoryNarrator):
@@ -188,62 +436,88 @@ class StoryWithOptionNarrator(StoryNarrator):
     Args:
         story_file (Path): Story file path.
         user_status (StatusManager): User's status.
+        version (StoryVersion | None): Stories the narrator plays. Default is the current version of the directory.
+            Next events are played from the same version, even if stories are reloaded meanwhile.
 
     Raises:
         RuntimeError: If there is no start point, error is raised.
     """
 
-    def __init__(self, story_file: Path, start_id: str | None = None) -> None:
-        self._story = self._load_story_file(story_file)
-        self._gpt_agent = GptAgent(self._story)
-        self.console = Console()
+    def __init__(self, story_file: Path, start_id: str | int | None = None, version: StoryVersion | None = None) -> None:
+        self._story_file = story_file
+        self._version = version if version is not None else StoryIndex.for_dir(story_file.parent).current
+        # story body is loaded on first use
+        self._story: StoryGraph | None = None
+        self._gpt_agent: GptAgent | None = None
+        self._option_matchers: dict[int, OptionMatcher] = {}
+        self._progress: dict[str, Any] | None = None
         self._start_id = start_id
         if isinstance(self._start_id, str) and self._start_id.isdigit():  # TODO[@eunwoo] need to refine later
             self._start_id = int(self._start_id)
 
         if self._start_id is None:
-            for id, story in self._story.items():
-                if story.start_point:
-                    self._start_id = id
-                    break
+            self._start_id = self._version.start_id(story_file.name)
 
     @property
     def is_start_event(self) -> bool:
         return self._start_id is not None 
 
-    @staticmethod
-    def _load_story_file(story_file : Path) -> dict[int, Story]:
-        if not story_file.exists():
-            msg = f"{story_file} doesn't exist."
-            raise RuntimeError(msg)
-
-        with story_file.open("r", encoding="utf-8") as f:
-            game_stories = yaml.safe_load(f)
-
-        return {story_args["id"] : Story(**story_args) for story_args in game_stories}
+    @property
+    def reference(self) -> dict[str, Any]:
+        return {"kind": "event", "story_file": self._story_file.name, "start_id": self._start_id}
 
-    def play_story(self, user_status: StatusManager) -> StoryWithOptionNarrator | None:
+    @property
+    def schedule_hints(self) -> ScheduleHints:
+        """Hints from the start node, which are known from the story index without loading the story."""
+        node = self._version.nodes(self._story_file.name).get(str(self._start_id), {})
+        return ScheduleHints(**node.get("schedule", {}))
+
+    def _load(self) -> None:
+        if self._story is not None:
+            return
+        self._story = self._version.load(self._story_file.name)
+        self._gpt_agent = GptAgent(self._story, self._story_file.name)
+        self._option_matchers = {id: OptionMatcher(story.options) for id, story in self._story.items() if story.options}
+
+    def prefetch(self) -> None:
+        self._load()
+
+    async def play_story(self, user_status: StatusManager, io: GameIO) -> StoryWithOptionNarrator | None:
         """Play the story. If there is next_story, return it. If not, return None."""
+        console = io.console
+        self._load()
         cur_story_id = self._start_id
         accumulated_story: str = ""
         next_description: str = ""
+        next_description_shown = False  # already rendered while streaming
+        resumed_description = None
+        if (progress := self._progress) is not None:
+            cur_story_id = progress["story_id"]
+            accumulated_story = progress["accumulated_story"]
+            resumed_description = progress["description"]
 
         while True:
             cur_story = self._story[cur_story_id]
-            if next_description:
-                self.console.print(Panel(next_description), style="bold")
-                next_description = ""
-            else:
-                self.console.print(Panel(cur_story.description), style="bold")
-
-            self._update_status(user_status, cur_story)
-            if user_status.is_die():
-                return
-                
-            if not accumulated_story:
-                accumulated_story = cur_story.description
-            else:
-                accumulated_story = accumulated_story + " " + cur_story.description
+            description = resumed_description or next_description or cur_story.description
+            if not next_description_shown:
+                with span("render", what="description"):
+                    console.print(Panel(description), style="bold")
+            next_description = ""
+            next_description_shown = False
+
+            # status and accumulated story of a resumed node were already applied before it was suspended
+            if resumed_description is None:
+                with span("status_update"):
+                    self._update_status(user_status, cur_story, console)
+                if user_status.is_die():
+                    self._progress = None
+                    return
+
+                if not accumulated_story:
+                    accumulated_story = cur_story.description
+                else:
+                    accumulated_story = accumulated_story + " " + cur_story.description
+            resumed_description = None
 
             if cur_story.goto is not None:
                 cur_story_id = cur_story.goto
@@ -254,42 +528,77 @@ class StoryWithOptionNarrator(StoryNarrator):
 
             visible_options: list[StoryOption] = [option for option in cur_story.options if option.visible]
             for i, visible_option in enumerate(visible_options, start=1):
-                self.console.print(f"{i} : {visible_option.description}", style="underline")
-            print("\n")
-            user_input = self._get_user_input(len(visible_options))
+                console.print(f"{i} : {visible_option.description}", style="underline")
+            console.print("\n")
+            self._progress = {"story_id": cur_story_id, "accumulated_story": accumulated_story, "description": description}
+            user_input = await self._get_user_input(io, len(visible_options))
 
             if isinstance(user_input, int):
                 selected_option = visible_options[user_input - 1]
-                self.console.print(selected_option.description, end="\n\n", style="italic")
+                console.print(selected_option.description, end="\n\n", style="italic")
+                if selected_option.next_description:
+                    next_description = selected_option.next_description
+            elif (matched := self._match_option(cur_story_id, user_input)) is not None:
+                selected_option = cur_story.options[matched]
+                console.print(user_input, end="\n\n", style="italic")
+                if DEBUG_MODE.get():
+                    pprint(f"selected_option (fast path) : {matched + 1}\n")
                 if selected_option.next_description:
                     next_description = selected_option.next_description
             else:  # use llm selection
-                response = self._gpt_agent.make_story(user_input, accumulated_story, cur_story.options)
+                METRICS.incr("option_matcher.llm")
+                live = LiveNarration(console, "story", "bold") if STREAM_NARRATION.get() else None
+                if live is not None:
+                    console.print(user_input, end="\n\n", style="italic")
+                response = await self._gpt_agent.make_story(
+                    user_input, accumulated_story, cur_story.options, cur_story_id, live=live,
+                    fallback=lambda: self._fallback_story(cur_story_id, user_input),
+                )
                 selected_option = cur_story.options[response.option - 1]
-                self.console.print(user_input, end="\n\n", style="italic")
+                if live is None:
+                    console.print(user_input, end="\n\n", style="italic")
                 if DEBUG_MODE.get():
                     pprint(f"selected_option : {response.option}\n")
                     # pprint(f"reason : {response.reason}\n")
                 next_description = str(response.story)
+                next_description_shown = live is not None
             cur_story_id = selected_option.goto
 
+        self._progress = None
         return None if cur_story.next_event is None else self._get_next_event_narrator(cur_story.next_event)
 
-    def _update_status(self, user_status: StatusManager, cur_story: Story) -> None:
+    def _match_option(self, story_id: int, user_input: str) -> int | None:
+        """Find option which user input clearly means without LLM."""
+        if (threshold := FAST_PATH_THRESHOLD.get()) is None:
+            return None
+        if (matched := self._option_matchers[story_id].match(user_input, threshold)) is not None:
+            METRICS.incr("option_matcher.fast_path")
+        return matched
+
+    def _fallback_story(self, story_id: int, user_input: str) -> TrpgHostResponse:
+        """Pick the most similar option without LLM, used when LLM can't answer."""
+        cur_story = self._story[story_id]
+        scores = self._option_matchers[story_id].scores(user_input)
+        idx = max(range(len(scores)), key=scores.__getitem__)
+        option = cur_story.options[idx]
+        result = option.next_description or (self._story[option.goto].description if option.goto is not None else "")
+        return TrpgHostResponse(option=idx + 1, reason="fallback", story=f"{user_input}\n{option.description}\n{result}")
+
+    def _update_status(self, user_status: StatusManager, cur_story: Story | StoryNode, console: Console) -> None:
         for status_name, val in cur_story.affect_status.items():
-            print(f"{status_name} : {val:+}")
+            console.print(f"{status_name} : {val:+}")
             user_status.add_status(status_name, val)
-        self.console.print(user_status, end="\n\n", style="italic")
+        console.print(user_status, end="\n\n", style="italic")
 
     @staticmethod
-    def _get_user_input(max_val: int) -> int | str:
+    async def _get_user_input(io: GameIO, max_val: int) -> int | str:
         while True:
-            user_input = input("어떻게 하시겠습니까? ")
-            print()
+            user_input = await io.input("어떻게 하시겠습니까? ")
+            io.console.print()
             try:
                 user_input = int(user_input)
                 if user_input < 1 or max_val < user_input:
-                    print(f"1과 {max_val} 사이의 수를 선택하거나 당신만의 선택을 텍스트로 전달해주세요.")
+                    io.console.print(f"1과 {max_val} 사이의 수를 선택하거나 당신만의 선택을 텍스트로 전달해주세요.")
                 else:
                     break
             except ValueError: 
@@ -298,8 +607,5 @@ class StoryWithOptionNarrator(StoryNarrator):
         return user_input
 
     def _get_next_event_narrator(self, next_event: str) -> StoryWithOptionNarrator:
-        if (ret := re.search(r"(.*\.yaml)\:(\d)", next_event)) is None:
-            msg = f"{next_event} has wrong format. Format should be (file path):(start id)"
-            raise ValueError(msg)
-        file_path, start_id = ret.groups()
-        return StoryWithOptionNarrator(Path("story_db") / file_path, start_id)
+        file_name, start_id = parse_event_ref(next_event)
+        return StoryWithOptionNarrator(self._version.story_db_dir / file_name, start_id, self._version)
@@ -5,7 +5,7 @@ from __future__ import annotations
 from dataclasses import dataclass, field
 
 
-@dataclass
+@dataclass(slots=True)
 class Story:
     id: str
     description: str
@@ -14,11 +14,19 @@ class Story:
     affect_status: dict[str, int] = field(default_factory=dict)
     goto: str | None = field(default=None)
     next_event: str | None = field(default=None)
+    # scheduling of a story which starts from this node
+    weight: float = field(default=1.0)
+    not_before_day: int = field(default=1)
+    cooldown_group: str | None = field(default=None)
+    cooldown: int = field(default=0)
 
     def __post_init__(self):
         if sum([self.goto is not None, bool(self.options), self.next_event is not None]) > 1:
             msg = "You must choose and set only one among goto, options, or next_event."
             raise ValueError(msg)
+        if not self.weight > 0:  # weight is the rate of an exponential priority
+            msg = f"weight must be positive, but it's {self.weight}."
+            raise ValueError(msg)
 
         if self.options:
             for idx in range(len(self.options)):
@@ -28,13 +36,14 @@ class Story:
                 if isinstance(option, dict):
                     try:
                         self.options[idx] = StoryOption(**option)
-                    except:
-                        breakpoint()
+                    except TypeError as e:  # missing or unknown keys
+                        msg = f"story {self.id}: invalid option {option!r}"
+                        raise ValueError(msg) from e
                 else:
                     raise TypeError(type(option))
 
 
-@dataclass
+@dataclass(slots=True)
 class StoryOption:
     description: str
     goto: str
@@ -0,0 +1,299 @@
+"""Compiled index of story files, and versions of a story directory which are swapped when files change."""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.story.story_entity import Story
+from llm_chat_game.story.story_store import StoryGraph, StoryStore
+from llm_chat_game.util import get_cache_dir
+
+
+def load_story_file(story_file: Path) -> dict[int, Story]:
+    import yaml  # only needed when the index is rebuilt or a story is played
+
+    if not story_file.exists():
+        msg = f"{story_file} doesn't exist."
+        raise RuntimeError(msg)
+
+    with story_file.open("r", encoding="utf-8") as f:
+        game_stories = yaml.safe_load(f)
+
+    return {story_args["id"] : Story(**story_args) for story_args in game_stories}
+
+
+def parse_event_ref(next_event: str) -> tuple[str, int]:
+    """Split `next_event` reference such as `event_8.yaml:0` into file name and start id."""
+    if (ret := re.fullmatch(r"\s*(.*\.yaml)\:(\d+)\s*", next_event)) is None:
+        msg = f"{next_event} has wrong format. Format should be (file path):(start id)"
+        raise ValueError(msg)
+    file_name, start_id = ret.groups()
+    return file_name, int(start_id)
+
+
+def validate_entries(entries: dict[str, dict[str, Any]]) -> list[str]:
+    """Errors of story graphs in index entries: goto targets, next_event references, weights and the one-of rule."""
+    errors = []
+    for name, entry in entries.items():
+        nodes = entry["nodes"]
+        for id, node in nodes.items():
+            where = f"{name}:{id}"
+            if sum([node["goto"] is not None, bool(node["options"]), node["next_event"] is not None]) > 1:
+                errors.append(f"{where} has more than one of goto, options and next_event.")
+            if not (weight := node.get("schedule", {}).get("weight", 1.0)) > 0:
+                errors.append(f"{where} has weight {weight}, which isn't positive.")
+            if node["goto"] is not None and str(node["goto"]) not in nodes:
+                errors.append(f"{where} goes to {node['goto']} which doesn't exist.")
+            for idx, goto in enumerate(node["options"], start=1):
+                if goto is not None and str(goto) not in nodes:
+                    errors.append(f"{where} option {idx} goes to {goto} which doesn't exist.")
+            if node["next_event"] is None:
+                continue
+            try:
+                file_name, start_id = parse_event_ref(node["next_event"])
+            except ValueError as e:
+                errors.append(f"{where} : {e}")
+                continue
+            if file_name not in entries:
+                errors.append(f"{where} continues to {file_name} which doesn't exist.")
+            elif str(start_id) not in entries[file_name]["nodes"]:
+                errors.append(f"{where} continues to {file_name}:{start_id} which doesn't exist.")
+    return errors
+
+
+class StoryVersion:
+    """Stories of a directory at one point. It never changes, so a session plays every story from the same version.
+
+    Args:
+        number (int): Version number, which grows by one whenever files change.
+        story_db_dir (Path): Directory of the story files.
+        entries (dict[str, dict[str, Any]]): Index entry of each file.
+        graphs (dict[str, StoryGraph]): Stories of each file.
+    """
+
+    def __init__(
+        self, number: int, story_db_dir: Path, entries: dict[str, dict[str, Any]], graphs: dict[str, StoryGraph],
+    ) -> None:
+        self.number = number
+        self.story_db_dir = story_db_dir
+        self._entries = entries
+        self._graphs = graphs
+
+    def __repr__(self) -> str:
+        return f"StoryVersion(number={self.number}, files={len(self._entries)})"
+
+    def file_names(self) -> list[str]:
+        return list(self._entries)
+
+    def start_events(self) -> list[tuple[str, int]]:
+        """(file name, start id) of every file which has a start point."""
+        return [(name, entry["start_ids"][0]) for name, entry in self._entries.items() if entry["start_ids"]]
+
+    def start_id(self, file_name: str) -> int | None:
+        start_ids = self._entry(file_name)["start_ids"]
+        return start_ids[0] if start_ids else None
+
+    def nodes(self, file_name: str) -> dict[str, dict[str, Any]]:
+        return self._entry(file_name)["nodes"]
+
+    def next_events(self, file_name: str) -> list[str]:
+        return self._entry(file_name)["next_events"]
+
+    def load(self, file_name: str) -> StoryGraph:
+        """Stories of the file, from its memory-mapped store."""
+        self._entry(file_name)
+        return self._graphs[file_name]
+
+    def _entry(self, file_name: str) -> dict[str, Any]:
+        if file_name not in self._entries:
+            msg = f"{self.story_db_dir / file_name} doesn't exist in story version {self.number}."
+            raise RuntimeError(msg)
+        return self._entries[file_name]
+
+
+@dataclass
+class ReloadResult:
+    """What `StoryIndex.reload` did. If there are errors, the current version is kept."""
+    version: int
+    changed: list[str] = field(default_factory=list)
+    removed: list[str] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+
+
+class StoryIndex:
+    """Index of every event file in a story directory, and its current `StoryVersion`.
+
+    The index holds start points, a node table and next_event links of each file, so that
+    they are known without parsing the files. It's stored as a json file in the cache directory and
+    an entry is rebuilt only when mtime or size of its file changes.
+    Each file is compiled into its own memory-mapped `StoryStore`, so a change of one file re-parses only that file.
+
+    `reload` makes a new version from changed files and validates it before it replaces the current one,
+    which is a single assignment. Narrators keep the version they were made with, so sessions already started
+    aren't affected.
+
+    Args:
+        story_db_dir (Path): Directory which has `event*.yaml` files.
+        index_path (Path | None): Where the index is stored. Default is under the cache directory.
+
+    Raises:
+        ValueError: If the story files are invalid when the index is made.
+    """
+
+    VERSION: int = 2
+    FILE_PATTERN: str = "event*.yaml"
+    _instances: dict[Path, StoryIndex] = {}
+
+    def __init__(self, story_db_dir: Path, index_path: Path | None = None) -> None:
+        self._dir = story_db_dir.resolve()
+        if index_path is None:
+            dir_hash = hashlib.sha1(str(self._dir).encode("utf-8")).hexdigest()[:12]
+            index_path = get_cache_dir() / f"story_index_{dir_hash}.json"
+        self._index_path = index_path
+        self._entries: dict[str, dict[str, Any]] = self._read_index()
+        # keys of files when a reload was rejected. Nothing is parsed again until a file changes.
+        self._rejected: dict[str, list[int]] | None = None
+        self._current = StoryVersion(0, self._dir, {}, {})
+        result = self.reload(initial=True)
+        if result.errors:
+            msg = f"{self._dir} has invalid stories :\n" + "\n".join(result.errors)
+            raise ValueError(msg)
+
+    @classmethod
+    def for_dir(cls, story_db_dir: Path) -> StoryIndex:
+        """Return index shared by every caller in the process for the directory."""
+        story_db_dir = story_db_dir.resolve()
+        if story_db_dir not in cls._instances:
+            cls._instances[story_db_dir] = cls(story_db_dir)
+        return cls._instances[story_db_dir]
+
+    @property
+    def story_db_dir(self) -> Path:
+        return self._dir
+
+    @property
+    def current(self) -> StoryVersion:
+        return self._current
+
+    def _read_index(self) -> dict[str, dict[str, Any]]:
+        try:
+            with self._index_path.open("r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get("version") != self.VERSION or index.get("story_db") != str(self._dir):
+            return {}
+        return index["files"]
+
+    def _write_index(self) -> None:
+        tmp_path = self._index_path.with_suffix(".tmp")
+        try:
+            with tmp_path.open("w", encoding="utf-8") as f:
+                json.dump({"version": self.VERSION, "story_db": str(self._dir), "files": self._entries}, f, ensure_ascii=False)
+            tmp_path.replace(self._index_path)
+        except OSError:  # index is only a cache
+            pass
+
+    @staticmethod
+    def _file_key(story_file: Path) -> list[int]:
+        stat = story_file.stat()
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def _files(self) -> dict[str, Path]:
+        return {story_file.name: story_file for story_file in sorted(self._dir.glob(self.FILE_PATTERN))}
+
+    def reload(self, initial: bool = False) -> ReloadResult:
+        """Make a new version if files were added, changed or removed, and make it current if it's valid.
+
+        Only changed files are parsed. Unchanged files share their stores with the current version.
+        """
+        files = self._files()
+        keys = {name: self._file_key(story_file) for name, story_file in files.items()}
+        previous = self._current
+        if keys == self._rejected:
+            return ReloadResult(previous.number)
+        changed = [
+            name for name, key in keys.items()
+            if initial or name not in previous.file_names() or self._entries.get(name, {}).get("key") != key
+        ]
+        removed = [name for name in previous.file_names() if name not in files]
+        if not changed and not removed:
+            return ReloadResult(previous.number)
+
+        entries = {name: self._entries[name] for name in previous.file_names() if name in files}
+        graphs = {name: previous.load(name) for name in entries}
+        errors = []
+        for name in changed:
+            story_file, key = files[name], keys[name]
+            if initial and (entry := self._entries.get(name)) is not None and entry["key"] == key:
+                stories = None  # index entry is up to date, so the file is parsed only if its store is missing
+            else:
+                try:
+                    stories = load_story_file(story_file)
+                except Exception as e:
+                    errors.append(f"{name} : {e!r}")
+                    continue
+                entry = self._compile(stories, key)
+            entries[name] = entry
+            loader = (lambda stories=stories: stories) if stories is not None else (lambda story_file=story_file: load_story_file(story_file))
+            graphs[name] = StoryStore.build(self._dir, name, key, loader).graph(name)
+
+        errors += validate_entries(entries)
+        if errors:
+            self._rejected = keys
+            METRICS.incr("story_db.reload.rejected")
+            return ReloadResult(previous.number, changed, removed, errors)
+
+        self._rejected = None
+        self._entries = {name: entries[name] for name in files if name in entries}
+        self._write_index()
+        self._current = StoryVersion(previous.number + 1, self._dir, self._entries, graphs)
+        if not initial:
+            METRICS.incr("story_db.reload.applied")
+        return ReloadResult(self._current.number, changed, removed, [])
+
+    def _compile(self, stories: dict[int, Story], file_key: list[int]) -> dict[str, Any]:
+        return {
+            "key": file_key,
+            "start_ids": [id for id, story in stories.items() if story.start_point],
+            "nodes": {
+                str(id): {
+                    "goto": story.goto,
+                    "options": [option.goto for option in story.options],
+                    "next_event": story.next_event,
+                    "schedule": {
+                        "weight": story.weight,
+                        "not_before_day": story.not_before_day,
+                        "group": story.cooldown_group,
+                        "cooldown": story.cooldown,
+                    },
+                }
+                for id, story in stories.items()
+            },
+            "next_events": sorted({story.next_event for story in stories.values() if story.next_event is not None}),
+        }
+
+    def file_names(self) -> list[str]:
+        return self._current.file_names()
+
+    def start_events(self) -> list[tuple[str, int]]:
+        return self._current.start_events()
+
+    def start_id(self, file_name: str) -> int | None:
+        return self._current.start_id(file_name)
+
+    def nodes(self, file_name: str) -> dict[str, dict[str, Any]]:
+        return self._current.nodes(file_name)
+
+    def next_events(self, file_name: str) -> list[str]:
+        return self._current.next_events(file_name)
+
+    def load(self, file_name: str) -> StoryGraph:
+        """Stories of the file in the current version."""
+        return self._current.load(file_name)
@@ -0,0 +1,312 @@
+"""Compact read-only store of story graphs, memory-mapped from a compiled file."""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+from collections.abc import Callable, Iterator, Mapping
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from llm_chat_game.util import get_cache_dir
+
+if TYPE_CHECKING:
+    from llm_chat_game.story.story_entity import Story
+
+# header : magic, version, counts of files, nodes, options and key-value pairs, then offset of each table
+_HEADER = struct.Struct("<4sIIIIIIIIII")
+_MAGIC = b"LCGS"
+_VERSION = 1
+_NONE = 0xFFFFFFFF  # offset of a string which is None
+_NO_GOTO = -(2 ** 63)
+# name, first node, node count
+_FILE = struct.Struct("<IIII")
+# id, description, start_point, goto, next_event, first option, option count, first affect, affect count,
+# weight, not_before_day, cooldown_group, cooldown
+_NODE = struct.Struct("<qIIBqIIIIIIdiIIi")
+# description, goto, next_description, visible, first condition, condition count
+_OPTION = struct.Struct("<IIqIIBII")
+# key, value
+_PAIR = struct.Struct("<IIi")
+
+
+class _Builder:
+    """Lay out story graphs into tables. Every distinct string is stored once."""
+
+    def __init__(self) -> None:
+        self.strings = bytearray()
+        self._interned: dict[str, tuple[int, int]] = {}
+        self.files = bytearray()
+        self.nodes = bytearray()
+        self.options = bytearray()
+        self.pairs = bytearray()
+        self.counts = [0, 0, 0, 0]
+
+    def string(self, text: str | None) -> tuple[int, int]:
+        if text is None:
+            return _NONE, 0
+        if (ref := self._interned.get(text)) is None:
+            data = text.encode("utf-8")
+            ref = (len(self.strings), len(data))
+            self.strings += data
+            self._interned[text] = ref
+        return ref
+
+    def _pairs(self, items: dict[str, int]) -> tuple[int, int]:
+        start = self.counts[3]
+        for key, val in items.items():
+            self.pairs += _PAIR.pack(*self.string(key), int(val))
+        self.counts[3] += len(items)
+        return start, len(items)
+
+    def add_file(self, name: str, stories: dict[int, Story]) -> None:
+        self.files += _FILE.pack(*self.string(name), self.counts[1], len(stories))
+        self.counts[0] += 1
+        for id, story in stories.items():
+            option_start = self.counts[2]
+            for option in story.options:
+                self.options += _OPTION.pack(
+                    *self.string(option.description),
+                    _NO_GOTO if option.goto is None else int(option.goto),
+                    *self.string(option.next_description),
+                    option.visible,
+                    *self._pairs(option.status_condition),
+                )
+            self.counts[2] += len(story.options)
+            self.nodes += _NODE.pack(
+                int(id),
+                *self.string(story.description),
+                story.start_point,
+                _NO_GOTO if story.goto is None else int(story.goto),
+                *self.string(story.next_event),
+                option_start,
+                len(story.options),
+                *self._pairs(story.affect_status),
+                story.weight,
+                story.not_before_day,
+                *self.string(story.cooldown_group),
+                story.cooldown,
+            )
+            self.counts[1] += 1
+
+    def dump(self) -> bytes:
+        tables = [self.files, self.nodes, self.options, self.pairs, self.strings]
+        offsets = []
+        offset = _HEADER.size
+        for table in tables:
+            offsets.append(offset)
+            offset += len(table)
+        header = _HEADER.pack(_MAGIC, _VERSION, *self.counts, *offsets)
+        return header + b"".join(tables)
+
+
+class StoryStore:
+    """Story graphs compiled into one file and memory-mapped read-only.
+
+    Strings are interned and referenced by offsets, and nodes are read from fixed size records on access,
+    so that a process holds no copy of the stories. Every process which opens the store maps the same file,
+    so server workers on a host share one copy of the story graph through the page cache.
+
+    Use `StoryStore.build` to compile and open the store of a story file.
+
+    Args:
+        path (Path): Compiled store file.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        with path.open("rb") as f:
+            self._buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_files, n_nodes, n_options, n_pairs, *offsets = _HEADER.unpack_from(self._buf, 0)
+        if magic != _MAGIC or version != _VERSION:
+            msg = f"{path} isn't a story store of version {_VERSION}."
+            raise ValueError(msg)
+        self._files_at, self._nodes_at, self._options_at, self._pairs_at, self._strings_at = offsets
+        self._graphs: dict[str, StoryGraph] = {}
+        for i in range(n_files):
+            name_offset, name_len, node_start, node_count = _FILE.unpack_from(self._buf, self._files_at + i * _FILE.size)
+            name = self.string(name_offset, name_len)
+            self._graphs[name] = StoryGraph(self, node_start, node_count)
+
+    @classmethod
+    def build(
+        cls, story_db_dir: Path, file_name: str, file_key: list[int], loader: Callable[[], dict[int, Story]],
+    ) -> StoryStore:
+        """Open the store of one story file, compiling it with `loader` first if its current version isn't compiled.
+
+        `file_key` is mtime and size of the file. The store file name has hashes of the directory, the story file name
+        and `file_key`, so a store is never rewritten in place. Stores of older versions of the same story file are
+        removed, and processes which mapped them keep reading them.
+        """
+        dir_hash = hashlib.sha1(str(story_db_dir.resolve()).encode("utf-8")).hexdigest()[:12]
+        name_hash = hashlib.sha1(file_name.encode("utf-8")).hexdigest()[:8]
+        key_hash = hashlib.sha1(str(file_key).encode("utf-8")).hexdigest()[:12]
+        prefix = f"story_store_{dir_hash}_{name_hash}_"
+        path = get_cache_dir() / f"{prefix}{key_hash}.bin"
+        if not path.exists():
+            builder = _Builder()
+            builder.add_file(file_name, loader())
+            tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_bytes(builder.dump())
+            tmp_path.replace(path)
+            for old in path.parent.glob(f"{prefix}*.bin"):
+                if old != path:
+                    try:
+                        old.unlink()
+                    except OSError:
+                        pass
+        return cls(path)
+
+    def string(self, offset: int, length: int) -> str | None:
+        if offset == _NONE:
+            return None
+        start = self._strings_at + offset
+        return self._buf[start:start + length].decode("utf-8")
+
+    def graph(self, file_name: str) -> StoryGraph | None:
+        return self._graphs.get(file_name)
+
+    def file_names(self) -> list[str]:
+        return list(self._graphs)
+
+    def _node_record(self, idx: int) -> tuple:
+        return _NODE.unpack_from(self._buf, self._nodes_at + idx * _NODE.size)
+
+    def _option_record(self, idx: int) -> tuple:
+        return _OPTION.unpack_from(self._buf, self._options_at + idx * _OPTION.size)
+
+    def _pairs(self, start: int, count: int) -> dict[str, int]:
+        ret = {}
+        for idx in range(start, start + count):
+            key_offset, key_len, val = _PAIR.unpack_from(self._buf, self._pairs_at + idx * _PAIR.size)
+            ret[self.string(key_offset, key_len)] = val
+        return ret
+
+
+class StoryGraph(Mapping):
+    """Stories of one file, by id. Nodes are views into the store."""
+
+    __slots__ = ("_store", "_start", "_ids")
+
+    def __init__(self, store: StoryStore, start: int, count: int) -> None:
+        self._store = store
+        self._start = start
+        # node ids are the only thing kept per process, to find a node without scanning
+        self._ids = {store._node_record(idx)[0]: idx for idx in range(start, start + count)}
+
+    def __getitem__(self, id: int) -> StoryNode:
+        return StoryNode(self._store, self._ids[int(id)])
+
+    def __contains__(self, id: object) -> bool:
+        try:
+            return int(id) in self._ids
+        except (TypeError, ValueError):
+            return False
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._ids)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+class StoryNode:
+    """Read-only view of a `Story` in a store."""
+
+    __slots__ = ("_store", "_idx")
+
+    def __init__(self, store: StoryStore, idx: int) -> None:
+        self._store = store
+        self._idx = idx
+
+    def __repr__(self) -> str:
+        return f"StoryNode(id={self.id}, description={self.description[:20]!r}...)"
+
+    @property
+    def id(self) -> int:
+        return self._store._node_record(self._idx)[0]
+
+    @property
+    def description(self) -> str:
+        record = self._store._node_record(self._idx)
+        return self._store.string(record[1], record[2])
+
+    @property
+    def start_point(self) -> bool:
+        return bool(self._store._node_record(self._idx)[3])
+
+    @property
+    def goto(self) -> int | None:
+        goto = self._store._node_record(self._idx)[4]
+        return None if goto == _NO_GOTO else goto
+
+    @property
+    def next_event(self) -> str | None:
+        record = self._store._node_record(self._idx)
+        return self._store.string(record[5], record[6])
+
+    @property
+    def options(self) -> list[OptionNode]:
+        record = self._store._node_record(self._idx)
+        return [OptionNode(self._store, idx) for idx in range(record[7], record[7] + record[8])]
+
+    @property
+    def affect_status(self) -> dict[str, int]:
+        record = self._store._node_record(self._idx)
+        return self._store._pairs(record[9], record[10])
+
+    @property
+    def weight(self) -> float:
+        return self._store._node_record(self._idx)[11]
+
+    @property
+    def not_before_day(self) -> int:
+        return self._store._node_record(self._idx)[12]
+
+    @property
+    def cooldown_group(self) -> str | None:
+        record = self._store._node_record(self._idx)
+        return self._store.string(record[13], record[14])
+
+    @property
+    def cooldown(self) -> int:
+        return self._store._node_record(self._idx)[15]
+
+
+class OptionNode:
+    """Read-only view of a `StoryOption` in a store."""
+
+    __slots__ = ("_store", "_idx")
+
+    def __init__(self, store: StoryStore, idx: int) -> None:
+        self._store = store
+        self._idx = idx
+
+    def __repr__(self) -> str:
+        return f"OptionNode(description={self.description!r}, goto={self.goto})"
+
+    @property
+    def description(self) -> str:
+        record = self._store._option_record(self._idx)
+        return self._store.string(record[0], record[1])
+
+    @property
+    def goto(self) -> int | None:
+        goto = self._store._option_record(self._idx)[2]
+        return None if goto == _NO_GOTO else goto
+
+    @property
+    def next_description(self) -> str:
+        record = self._store._option_record(self._idx)
+        return self._store.string(record[3], record[4])
+
+    @property
+    def visible(self) -> bool:
+        return bool(self._store._option_record(self._idx)[5])
+
+    @property
+    def status_condition(self) -> dict[str, int]:
+        record = self._store._option_record(self._idx)
+        return self._store._pairs(record[6], record[7])
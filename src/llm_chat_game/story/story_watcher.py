@@ -0,0 +1,70 @@
+"""Reload of story files while the game is running.
+
+New sessions play the new version of the stories once it's validated. Sessions already started keep
+the version they started with, and a version with errors is never played.
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from llm_chat_game.story.story_index import ReloadResult, StoryIndex
+
+
+class StoryWatcher:
+    """Reload a story directory every `interval` seconds in background.
+
+    Args:
+        index (StoryIndex): Index of the story directory.
+        interval (float): Seconds between checks of the files.
+    """
+
+    def __init__(self, index: StoryIndex, interval: float) -> None:
+        self._index = index
+        self._interval = interval
+        self._task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _watch(self) -> None:
+        while True:
+            await asyncio.sleep(self._interval)
+            # files are parsed in a thread so that turns of sessions aren't blocked
+            result = await asyncio.to_thread(self._index.reload)
+            self.report(result)
+
+    def report(self, result: ReloadResult) -> None:
+        if result.errors:
+            print(f"stories aren't reloaded ({', '.join(result.changed + result.removed)}) :")
+            for error in result.errors:
+                print(f"  {error}")
+        elif result.changed or result.removed:
+            print(f"stories are reloaded to version {result.version} : {', '.join(result.changed + result.removed)}")
+
+
+@asynccontextmanager
+async def watch_stories(index: StoryIndex, interval: float | None) -> AsyncIterator[StoryWatcher | None]:
+    """Watch `index` while the block runs. Nothing is watched if `interval` is None."""
+    if interval is None:
+        yield None
+        return
+    watcher = StoryWatcher(index, interval)
+    watcher.start()
+    try:
+        yield watcher
+    finally:
+        await watcher.stop()
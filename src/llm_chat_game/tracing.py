@@ -0,0 +1,191 @@
+"""Spans of a game written to a JSONL file, and a latency report made from them.
+
+A span is one line with the fields of an OpenTelemetry span: trace_id, span_id, parent_span_id, name,
+start_time_unix_nano, end_time_unix_nano, attributes and status. Every span of a session has the same trace id.
+Spans are written only while `TRACER` context variable is set, otherwise `span` costs nothing but a lookup.
+"""
+
+from __future__ import annotations
+
+import argparse
+import atexit
+import json
+import os
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any
+
+from llm_chat_game.context_var import TRACER
+
+_CURRENT_SPAN: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Append finished spans to a JSONL file.
+
+    Args:
+        path (Path | str): File the spans are appended to.
+    """
+
+    def __init__(self, path: Path | str) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = self.path.open("a", encoding="utf-8")
+        self.exported = 0
+        atexit.register(self.close)
+
+    def export(self, span: Span, end_ns: int) -> None:
+        if self._file.closed:
+            return
+        record = {
+            "trace_id": span.trace_id,
+            "span_id": span.span_id,
+            "parent_span_id": span.parent_span_id,
+            "name": span.name,
+            "start_time_unix_nano": span.start_ns,
+            "end_time_unix_nano": end_ns,
+            "attributes": span.attributes,
+            "status": span.status,
+        }
+        self._file.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self.exported += 1
+
+    def close(self) -> None:
+        if not self._file.closed:
+            self._file.close()
+
+
+class Span:
+    """Timed phase of a game. Child spans are the ones started while it's the current span of the context."""
+
+    __slots__ = (
+        "_tracer", "name", "attributes", "status", "trace_id", "span_id", "parent_span_id", "start_ns", "_token", "_start",
+    )
+
+    def __init__(self, tracer: Tracer, name: str, attributes: dict[str, Any]) -> None:
+        self._tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.status = "ok"
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> Span:
+        parent = _CURRENT_SPAN.get()
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.parent_span_id = parent.span_id if parent is not None else None
+        self.span_id = os.urandom(8).hex()
+        self._token = _CURRENT_SPAN.set(self)
+        self.start_ns = time.time_ns()
+        self._start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        end_ns = self.start_ns + time.perf_counter_ns() - self._start
+        _CURRENT_SPAN.reset(self._token)
+        if exc_type is not None:
+            self.status = "error" if issubclass(exc_type, Exception) else "cancelled"
+            self.attributes["error"] = exc_type.__name__
+        self._tracer.export(self, end_ns)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> None:
+        pass
+
+    def __enter__(self) -> _NoopSpan:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attributes: Any) -> Span | _NoopSpan:
+    """Context manager which records `name` phase as a child of the current span."""
+    if (tracer := TRACER.get()) is None:
+        return _NOOP_SPAN
+    return Span(tracer, name, attributes)
+
+
+def current_span() -> Span | _NoopSpan:
+    """Span of the running phase, to add attributes known only inside it."""
+    return _CURRENT_SPAN.get() or _NOOP_SPAN
+
+
+def load_spans(paths: list[Path]) -> list[dict[str, Any]]:
+    spans = []
+    for path in paths:
+        with path.open("r", encoding="utf-8") as f:
+            spans.extend(json.loads(line) for line in f if line.strip())
+    return spans
+
+
+def _percentile(ordered: list[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, round(q / 100 * (len(ordered) - 1)))]
+
+
+def summarize(spans: list[dict[str, Any]], by: str | None = None) -> dict[str, dict[str, float]]:
+    """Count, errors, cancellations, total and p50/p95/p99 of duration in seconds per span name.
+
+    If `by` is given, spans are also split by that attribute, e.g. model of LLM requests.
+    """
+    durations: dict[str, list[float]] = defaultdict(list)
+    statuses: dict[str, dict[str, int]] = defaultdict(lambda: defaultdict(int))
+    for item in spans:
+        key = item["name"]
+        if by is not None and (val := item["attributes"].get(by)) is not None:
+            key = f"{key}[{by}={val}]"
+        durations[key].append((item["end_time_unix_nano"] - item["start_time_unix_nano"]) / 1e9)
+        statuses[key][item.get("status", "ok")] += 1
+
+    summary = {}
+    for key in sorted(durations):
+        ordered = sorted(durations[key])
+        summary[key] = {
+            "count": len(ordered),
+            "errors": statuses[key]["error"],
+            "cancelled": statuses[key]["cancelled"],
+            "total": sum(ordered),
+            **{f"p{q}": _percentile(ordered, q) for q in (50, 95, 99)},
+        }
+    return summary
+
+
+def format_summary(summary: dict[str, dict[str, float]], sessions: int) -> str:
+    width = max([len(key) for key in summary] + [4])
+    lines = [
+        f"sessions : {sessions}",
+        f"{'span':<{width}} {'count':>8} {'errors':>7} {'cancelled':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'total':>10}",
+    ]
+    for key, row in summary.items():
+        lines.append(
+            f"{key:<{width}} {row['count']:>8} {row['errors']:>7} {row['cancelled']:>9} {row['p50']:>9.4f} {row['p95']:>9.4f} "
+            f"{row['p99']:>9.4f} {row['total']:>10.2f}"
+        )
+    return "\n".join(lines)
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Latency per span type of span files written by --profile.")
+    parser.add_argument('paths', nargs="+", type=Path, help="Span files.")
+    parser.add_argument('--by', metavar="ATTRIBUTE", help="Also split spans by this attribute, e.g. model or call_type.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = get_args()
+    spans = load_spans(args.paths)
+    sessions = len({item["trace_id"] for item in spans})
+    print(format_summary(summarize(spans, args.by), sessions))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,9 @@
+import re
+import unicodedata
+from os import environ
+from pathlib import Path
+
+
 def print_with_border(content: str, border_char: str = '#'):
     lines = content.split('\n')  # 여러 줄로 나뉜 스트링도 처리
     max_length = max(len(line) for line in lines)  # 가장 긴 줄의 길이
@@ -6,4 +12,23 @@ def print_with_border(content: str, border_char: str = '#'):
     print(border_line)
     for line in lines:
         print(f"{border_char} {line.ljust(max_length)} {border_char}")  # 왼쪽 정렬
-    print(border_line)
\ No newline at end of file
+    print(border_line)
+
+def get_cache_dir() -> Path:
+    """Directory where local caches and stores are written. It can be changed by LLM_CHAT_GAME_CACHE_DIR."""
+    cache_dir = Path(environ.get("LLM_CHAT_GAME_CACHE_DIR", Path.home() / ".cache" / "llm_chat_game"))
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    return cache_dir
+
+
+def normalize_text(text: str) -> str:
+    """Normalize free text so that trivially different inputs (case, punctuation, spaces) become same."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count. Ascii text takes about 4 characters per token and Korean about 1.5."""
+    n_ascii = sum(1 for ch in text if ch.isascii())
+    return int(n_ascii / 4 + (len(text) - n_ascii) / 1.5) + 4  # 4 tokens of per message overhead
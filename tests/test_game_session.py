@@ -0,0 +1,31 @@
+"""Tests of snapshots of `GameSession`."""
+
+from __future__ import annotations
+
+import contextvars
+import json
+
+from llm_chat_game.context_var import GAME_SEED
+from llm_chat_game.game import GameSession
+from llm_chat_game.scheduler import DayScheduler
+
+
+def _resume_rolls() -> tuple[list[float], list[float]]:
+    GAME_SEED.set(7)
+    session = GameSession(None, "seeded", scheduler=DayScheduler())
+    session.rng.random()
+    snapshot = json.loads(json.dumps(session.snapshot()))
+    restored = GameSession.restore(None, snapshot)
+    assert restored.scheduler._rng is restored.rng
+    return [session.rng.random() for _ in range(5)], [restored.rng.random() for _ in range(5)]
+
+
+def test_restore_continues_random_rolls():
+    rolls, restored_rolls = contextvars.copy_context().run(_resume_rolls)
+    assert rolls == restored_rolls
+
+
+def test_snapshot_without_seed_has_no_rng():
+    session = GameSession(None, "unseeded", scheduler=DayScheduler())
+    assert session.snapshot()["rng"] is None
+    assert GameSession.restore(None, session.snapshot()).rng is None
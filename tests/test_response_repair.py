@@ -0,0 +1,186 @@
+"""Tests of local repair of structured responses, and of repair in `GptAgent`."""
+
+from __future__ import annotations
+
+import asyncio
+import json
+from typing import List, Literal
+
+import pytest
+from pydantic import BaseModel
+
+from llm_chat_game.context_var import LLM_BACKEND, LLM_RESILIENCE
+from llm_chat_game.gpt_agent import GptAgent, TrpgHostResponse
+from llm_chat_game.llm_backend import LlmResult, LocalBackend
+from llm_chat_game.metrics import METRICS
+from llm_chat_game.resilience import Resilience
+from llm_chat_game.response_repair import (
+    DEFAULT_SELECTIONS,
+    MalformedResponse,
+    follow_up_messages,
+    missing_fields_format,
+    repair_response,
+)
+from llm_chat_game.story.story_entity import StoryOption
+
+
+class Suggestion(BaseModel):
+    situation: str
+    selections: List[str]
+
+
+class Result(BaseModel):
+    result: str
+    health: Literal[-2, -1, 0, 1, 2]
+
+
+MESSAGES = [{"role": "system", "content": "상황"}, {"role": "user", "content": "행동"}]
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    METRICS.reset()
+    yield
+    METRICS.reset()
+
+
+def run(coro):
+    """Run `coro` with a local backend and a resilience which neither hedges nor times out."""
+    async def main():
+        LLM_RESILIENCE.set(Resilience(default_deadline=None, deadline_scale=0, hedge_percentile=None))
+        return await coro
+
+    return asyncio.run(main())
+
+
+def test_valid_response_is_unchanged():
+    parsed = Result(result="살아남았다.", health=1)
+    repair = repair_response(Result, parsed, None)
+    assert repair.response == parsed
+    assert not repair.changed
+    assert not repair.missing
+
+
+def test_truncated_text_is_cut_to_last_sentence():
+    raw = '{"selections": ["숨는다", "달린다", "싸운다"], "situation": "연기가 피어오릅니다. 멀리서 총성이'
+    repair = repair_response(Suggestion, None, raw)
+    assert repair.changed
+    assert repair.response == Suggestion(situation="연기가 피어오릅니다.", selections=["숨는다", "달린다", "싸운다"])
+
+
+def test_truncated_text_without_sentence_is_missing():
+    repair = repair_response(Suggestion, None, '{"selections": ["숨는다"], "situation": "연기가 피어')
+    assert repair.response is None
+    assert repair.missing == ["situation"]
+
+
+def test_truncated_list_drops_last_item_and_is_padded():
+    raw = '{"situation": "조용합니다.", "selections": ["숨는다", "달린'
+    repair = repair_response(Suggestion, None, raw)
+    assert repair.response is not None
+    assert repair.response.selections == ["숨는다", *DEFAULT_SELECTIONS[:2]]
+
+
+def test_short_selections_are_padded_and_long_ones_trimmed():
+    short = Suggestion.model_construct(situation="조용합니다.", selections=["숨는다"])
+    assert repair_response(Suggestion, short, None).response.selections == ["숨는다", *DEFAULT_SELECTIONS[:2]]
+
+    long = Suggestion(situation="조용합니다.", selections=["a", "b", "c", "d"])
+    repair = repair_response(Suggestion, long, None)
+    assert repair.changed
+    assert repair.response.selections == ["a", "b", "c"]
+
+
+def test_literal_out_of_range_is_clamped():
+    parsed = Result.model_construct(result="크게 다쳤다.", health=-5)
+    repair = repair_response(Result, parsed, None)
+    assert repair.changed
+    assert repair.response.health == -2
+
+
+def test_literal_cut_off_is_missing():
+    repair = repair_response(Result, None, '{"result": "크게 다쳤다.", "health": 1')
+    assert repair.response is None
+    assert repair.data == {"result": "크게 다쳤다."}
+    assert repair.missing == ["health"]
+
+
+def test_unparsable_response_misses_every_field():
+    repair = repair_response(Result, None, "not json")
+    assert repair.response is None
+    assert not repair.data
+    assert repair.missing == ["result", "health"]
+
+
+def test_follow_up_asks_only_missing_fields():
+    repair = repair_response(Result, None, '{"result": "크게 다쳤다.", "health": 1')
+    missing_format = missing_fields_format(Result, tuple(repair.missing))
+    assert list(missing_format.model_fields) == ["health"]
+
+    messages = follow_up_messages(MESSAGES, repair)
+    assert messages[:2] == MESSAGES
+    assert json.loads(messages[2]["content"]) == {"result": "크게 다쳤다."}
+    assert "health" in messages[3]["content"]
+
+
+def test_validated_merges_follow_up():
+    async def validated():
+        LLM_BACKEND.set(LocalBackend(latency=0))
+        result = LlmResult(None, None, raw='{"result": "크게 다쳤다.", "health": 1')
+        return await GptAgent()._validated(MESSAGES, Result, result)
+
+    response = run(validated())
+    assert response.result == "크게 다쳤다."
+    assert response.health in (-2, -1, 0, 1, 2)
+    assert METRICS.counter("llm.repair.follow_up") == 1
+    assert METRICS.counter("llm.repair.follow_up_ok") == 1
+
+
+def test_validated_raises_when_nothing_is_recovered():
+    async def validated():
+        LLM_BACKEND.set(LocalBackend(latency=0))
+        return await GptAgent()._validated(MESSAGES, Result, LlmResult(None, None, raw="{"))
+
+    with pytest.raises(MalformedResponse):
+        run(validated())
+    assert METRICS.counter("llm.repair.failed") == 1
+    assert METRICS.counter("llm.repair.follow_up") == 0
+
+
+def test_validated_raises_on_refusal():
+    async def validated():
+        LLM_BACKEND.set(LocalBackend(latency=0))
+        return await GptAgent()._validated(MESSAGES, Result, LlmResult(None, None, refusal="거절"))
+
+    with pytest.raises(MalformedResponse):
+        run(validated())
+
+
+def test_malformed_responses_are_repaired():
+    async def requests():
+        LLM_BACKEND.set(LocalBackend(latency=0, malformed_rate=0.3))
+        agent = GptAgent()
+        return [
+            await agent.talk([*MESSAGES, {"role": "user", "content": str(i)}], response_format=Suggestion)
+            for i in range(50)
+        ]
+
+    for response in run(requests()):
+        assert response.situation
+        assert len(response.selections) == 3
+    assert METRICS.counter("llm.repair.local") > 0
+    assert METRICS.counter("llm.repair.follow_up_ok") > 0
+
+
+def test_option_out_of_range_is_clamped():
+    options = [StoryOption(f"선택 {i}", str(i), next_description=f"결과 {i}") for i in range(1, 4)]
+
+    async def stories():
+        LLM_BACKEND.set(LocalBackend(latency=0, malformed_rate=0.5))
+        agent = GptAgent()
+        return [await agent._request_story(f"행동 {i}", "상황", options) for i in range(50)]
+
+    responses = run(stories())
+    assert all(isinstance(response, TrpgHostResponse) for response in responses)
+    assert all(1 <= response.option <= len(options) for response in responses)
+    assert METRICS.counter("llm.repair.option_clamped") > 0
@@ -0,0 +1,116 @@
+"""Tests of `DayScheduler` and of schedule weights of stories."""
+
+from __future__ import annotations
+
+import json
+import random
+from dataclasses import dataclass, field
+from typing import Any
+
+import pytest
+
+from llm_chat_game.scheduler import DayScheduler, ScheduleHints
+from llm_chat_game.story.story_entity import Story
+from llm_chat_game.story.story_index import validate_entries
+
+
+@dataclass
+class Narrator:
+    name: str
+    schedule_hints: ScheduleHints = field(default_factory=ScheduleHints)
+
+    @property
+    def reference(self) -> dict[str, Any]:
+        return {"name": self.name}
+
+
+def play(scheduler: DayScheduler, days: range) -> list[str | None]:
+    return [narrator.name if (narrator := scheduler.pop(day)) is not None else None for day in days]
+
+
+def test_pop_plays_every_story_once():
+    scheduler = DayScheduler(random.Random(0))
+    for name in "abcde":
+        scheduler.add(Narrator(name))
+    assert len(scheduler) == 5
+    assert sorted(play(scheduler, range(1, 6))) == list("abcde")
+    assert len(scheduler) == 0
+    assert scheduler.pop(6) is None
+
+
+def test_weight_plays_heavy_stories_earlier():
+    firsts = []
+    for seed in range(200):
+        scheduler = DayScheduler(random.Random(seed))
+        scheduler.add(Narrator("heavy", ScheduleHints(weight=9.0)))
+        scheduler.add(Narrator("light", ScheduleHints(weight=1.0)))
+        firsts.append(scheduler.pop(1).name)
+    assert 0.8 < firsts.count("heavy") / len(firsts) < 0.98
+
+
+def test_not_before_day_waits():
+    scheduler = DayScheduler(random.Random(0))
+    scheduler.add(Narrator("late", ScheduleHints(not_before_day=3)))
+    assert scheduler.peek(1) is None
+    assert play(scheduler, range(1, 3)) == [None, None]
+    assert len(scheduler) == 1
+    assert scheduler.pop(3).name == "late"
+
+
+def test_not_before_day_lets_others_play_first():
+    scheduler = DayScheduler(random.Random(0))
+    scheduler.add(Narrator("late", ScheduleHints(weight=100.0, not_before_day=2)))
+    scheduler.add(Narrator("early", ScheduleHints(weight=0.01)))
+    assert play(scheduler, range(1, 3)) == ["early", "late"]
+
+
+def test_cooldown_holds_stories_of_group():
+    hints = ScheduleHints(group="g", cooldown=2)
+    scheduler = DayScheduler(random.Random(0))
+    scheduler.add(Narrator("a", hints))
+    scheduler.add(Narrator("b", hints))
+    scheduler.add(Narrator("other"))
+    played = play(scheduler, range(1, 6))
+    grouped = [day for day, name in enumerate(played, start=1) if name in ("a", "b")]
+    assert len(grouped) == 2
+    assert grouped[1] - grouped[0] > 2
+    assert "other" in played
+
+
+def test_cooldown_starts_from_day_played():
+    hints = ScheduleHints(group="g", cooldown=1)
+    scheduler = DayScheduler(random.Random(0))
+    scheduler.add(Narrator("a", hints))
+    scheduler.add(Narrator("b", hints))
+    assert play(scheduler, range(1, 4))[1] is None
+    assert len(scheduler) == 0
+
+
+def test_state_restores_same_schedule():
+    narrators = {name: Narrator(name, ScheduleHints(group="g", cooldown=1)) for name in "ab"}
+    narrators.update({name: Narrator(name, ScheduleHints(not_before_day=4)) for name in "cd"})
+    scheduler = DayScheduler(random.Random(1))
+    for narrator in narrators.values():
+        scheduler.add(narrator)
+    assert play(scheduler, range(1, 3))[1] is None  # a story of the group was played and the other is in cooldown
+
+    state = json.loads(json.dumps(scheduler.state()))
+    restored = DayScheduler.restore(state, lambda reference: narrators[reference["name"]])
+    assert len(restored) == len(scheduler) == 3
+    assert play(restored, range(3, 7)) == play(scheduler, range(3, 7))
+
+
+def test_from_order_keeps_order():
+    narrators = [Narrator(name) for name in "cab"]
+    assert play(DayScheduler.from_order(narrators), range(1, 4)) == ["c", "a", "b"]
+
+
+@pytest.mark.parametrize("weight", [0, -1.0])
+def test_story_rejects_weight_which_isnt_positive(weight):
+    with pytest.raises(ValueError):
+        Story("1", "시작", weight=weight)
+
+
+def test_validate_entries_rejects_weight_which_isnt_positive():
+    entries = {"a.yaml": {"nodes": {"1": {"goto": None, "options": [], "next_event": None, "schedule": {"weight": 0}}}}}
+    assert validate_entries(entries) == ["a.yaml:1 has weight 0, which isn't positive."]
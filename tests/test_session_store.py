@@ -0,0 +1,34 @@
+"""Tests of `SessionStore`."""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+
+from llm_chat_game.session_store import SessionStore
+
+
+def test_async_methods_run_off_the_event_loop(tmp_path, monkeypatch):
+    store = SessionStore(tmp_path / "sessions.sqlite3")
+    threads = []
+    write = store._write
+
+    def record_thread(*args):
+        threads.append(threading.current_thread())
+        return write(*args)
+
+    monkeypatch.setattr(store, "_write", record_thread)
+
+    async def main():
+        snapshots = {f"s{i}": {"day": i, "status": {"health": i}} for i in range(20)}
+        await asyncio.gather(*(store.save_async(session_id, snapshot) for session_id, snapshot in snapshots.items()))
+        loaded = {session_id: await store.load_async(session_id) for session_id in snapshots}
+        await store.delete_async("s0")
+        return snapshots, loaded, await store.load_async("s0")
+
+    snapshots, loaded, deleted = asyncio.run(main())
+    assert loaded == snapshots
+    assert deleted is None
+    assert threading.main_thread() not in threads
+    assert sorted(store.session_ids()) == sorted(set(snapshots) - {"s0"})
+    store.close()
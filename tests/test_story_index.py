@@ -0,0 +1,70 @@
+"""Tests of reloading story files into `StoryIndex` versions."""
+
+from __future__ import annotations
+
+import os
+
+import pytest
+
+from llm_chat_game.story.story_index import StoryIndex
+
+VALID = """\
+- id: 0
+  start_point: True
+  description: 부서진 편의점을 발견합니다.
+  options:
+  - description: 안으로 들어간다.
+    goto: 1
+- id: 1
+  description: 어둠 속에서 희미한 움직임이 보입니다.
+"""
+
+BAD_OPTION = """\
+- id: 0
+  start_point: True
+  description: 부서진 편의점을 발견합니다.
+  options:
+  - descripton: 안으로 들어간다.
+    goto: 1
+- id: 1
+  description: 어둠 속에서 희미한 움직임이 보입니다.
+"""
+
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    monkeypatch.setenv("LLM_CHAT_GAME_CACHE_DIR", str(tmp_path / "cache"))
+    story_dir = tmp_path / "story_db"
+    story_dir.mkdir()
+    (story_dir / "event_1.yaml").write_text(VALID, encoding="utf-8")
+    return StoryIndex(story_dir, tmp_path / "index.json")
+
+
+def _write(index: StoryIndex, text: str) -> None:
+    story_file = index.story_db_dir / "event_1.yaml"
+    mtime_ns = story_file.stat().st_mtime_ns
+    story_file.write_text(text, encoding="utf-8")
+    os.utime(story_file, ns=(mtime_ns + 10**9, mtime_ns + 10**9))  # changed even if the clock is coarse
+
+
+def test_reload_rejects_bad_option(index):
+    version = index.current
+    _write(index, BAD_OPTION)
+    result = index.reload()
+    assert result.version == version.number
+    assert len(result.errors) == 1
+    assert "event_1.yaml" in result.errors[0]
+    assert "invalid option" in result.errors[0]
+    assert index.current is version
+
+
+def test_reload_applies_fixed_file(index):
+    version = index.current
+    _write(index, BAD_OPTION)
+    assert index.reload().errors
+    _write(index, VALID.replace("움직임이", "그림자가"))
+    result = index.reload()
+    assert not result.errors
+    assert result.version == version.number + 1
+    assert index.current is not version
+    assert result.changed == ["event_1.yaml"]